@@ -0,0 +1,145 @@
+"""Content-addressed cache for LLM results, stored in the app database with an in-process LRU in front"""
+import os
+import re
+import json
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+
+from sqlalchemy.exc import IntegrityError
+
+# Cache settings (override through environment variables)
+CACHE_TTL_SECONDS = int(os.getenv("ANALYSIS_CACHE_TTL", str(30 * 24 * 3600)))
+CACHE_MAX_ENTRIES = int(os.getenv("ANALYSIS_CACHE_MAX_ENTRIES", "100000"))
+CACHE_LRU_SIZE = int(os.getenv("ANALYSIS_CACHE_LRU_SIZE", "1024"))
+# Prune the table once every this many stores
+CACHE_PRUNE_EVERY = 200
+
+WHITESPACE_PATTERN = re.compile(r'\s+')
+
+
+def normalize_text(text):
+    """Lowercase and collapse whitespace so trivial differences share a key"""
+    return WHITESPACE_PATTERN.sub(' ', (text or '').strip().lower())
+
+
+def make_key(*parts):
+    """Hash the normalized parts into a cache key"""
+    canonical = json.dumps([normalize_text(part) for part in parts], separators=(',', ':'))
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+
+class AnalysisCache:
+    """Two-level cache: a bounded LRU per process over a shared table"""
+
+    def __init__(self, app, db, model, ttl=CACHE_TTL_SECONDS, max_entries=CACHE_MAX_ENTRIES, lru_size=CACHE_LRU_SIZE):
+        self.app = app
+        self.db = db
+        self.model = model
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.lru_size = lru_size
+        self._lru = OrderedDict()
+        self._lock = threading.Lock()
+        self._stores = 0
+        self.counters = {"memory_hits": 0, "db_hits": 0, "misses": 0, "stores": 0, "evictions": 0}
+
+    def get(self, key):
+        """Return the cached value for key, or None"""
+        now = time.time()
+        with self._lock:
+            entry = self._lru.get(key)
+            if entry and entry[1] > now:
+                self._lru.move_to_end(key)
+                self.counters["memory_hits"] += 1
+                return entry[0]
+            if entry:
+                del self._lru[key]
+
+        # Own app context so this works from request, job and pool threads
+        with self.app.app_context():
+            row = self.model.query.get(key)
+            if row is None:
+                self._count("misses")
+                return None
+
+            if row.created_at < datetime.utcnow() - timedelta(seconds=self.ttl):
+                self.db.session.delete(row)
+                self.db.session.commit()
+                self._count("misses")
+                self._count("evictions")
+                return None
+
+            value = json.loads(row.value)
+            expires_at = now + self.ttl - (datetime.utcnow() - row.created_at).total_seconds()
+            row.last_used_at = datetime.utcnow()
+            self.db.session.commit()
+
+        self._remember(key, value, expires_at)
+        self._count("db_hits")
+        return value
+
+    def put(self, key, value):
+        """Store value under key in both levels"""
+        self._remember(key, value, time.time() + self.ttl)
+
+        with self.app.app_context():
+            row = self.model.query.get(key)
+            if row is None:
+                self.db.session.add(self.model(key=key, value=json.dumps(value)))
+            else:
+                row.value = json.dumps(value)
+                row.created_at = datetime.utcnow()
+                row.last_used_at = datetime.utcnow()
+            try:
+                self.db.session.commit()
+            except IntegrityError:
+                # Stored concurrently by another worker
+                self.db.session.rollback()
+
+            self._count("stores")
+            with self._lock:
+                self._stores += 1
+                prune = self._stores % CACHE_PRUNE_EVERY == 0
+            if prune:
+                self.prune()
+
+    def prune(self):
+        """Delete expired rows and the least recently used rows over the size limit"""
+        model = self.model
+        expired = model.query.filter(
+            model.created_at < datetime.utcnow() - timedelta(seconds=self.ttl)
+        ).delete(synchronize_session=False)
+
+        overflow = model.query.count() - self.max_entries
+        if overflow > 0:
+            stale_keys = [row.key for row in model.query.with_entities(model.key)
+                          .order_by(model.last_used_at).limit(overflow)]
+            model.query.filter(model.key.in_(stale_keys)).delete(synchronize_session=False)
+        else:
+            overflow = 0
+
+        self.db.session.commit()
+        self._count("evictions", expired + overflow)
+
+    def stats(self):
+        """Return the hit/miss counters and current LRU size"""
+        with self._lock:
+            stats = dict(self.counters)
+            stats["lru_entries"] = len(self._lru)
+        lookups = stats["memory_hits"] + stats["db_hits"] + stats["misses"]
+        stats["hit_rate"] = round((stats["memory_hits"] + stats["db_hits"]) / lookups, 4) if lookups else 0.0
+        return stats
+
+    def _remember(self, key, value, expires_at):
+        with self._lock:
+            self._lru[key] = (value, expires_at)
+            self._lru.move_to_end(key)
+            while len(self._lru) > self.lru_size:
+                self._lru.popitem(last=False)
+
+    def _count(self, name, amount=1):
+        with self._lock:
+            self.counters[name] += amount
@@ -0,0 +1,221 @@
+"""Per-user score rollups, refreshed for the touched buckets as scores are saved"""
+from datetime import datetime, timedelta
+
+from sqlalchemy import func
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.dialects import postgresql, sqlite
+
+import scoring
+
+# Rollup dimensions stored in the rollup table
+QUESTION_TYPE = 'question_type'
+MONTH = 'month'
+
+# Number of weakest question types reported
+WEAKEST_CATEGORIES = 3
+
+
+def month_bucket(created_at):
+    """Bucket name for the month an interview was taken in"""
+    return (created_at or datetime.utcnow()).strftime('%Y-%m')
+
+
+class UserAnalytics:
+    """Keeps the user stats and rollup tables in step with interview and response scores.
+
+    After writing scores, callers lock the user and recompute the buckets the
+    change touched from the stored scores, inside their own transaction, so
+    concurrent updates cannot apply a change on top of a stale read and the
+    rollups never need a full rescan."""
+
+    def __init__(self, db, stats_model, rollup_model, interview_model, response_model):
+        self.db = db
+        self.stats_model = stats_model
+        self.rollup_model = rollup_model
+        self.interview_model = interview_model
+        self.response_model = response_model
+
+    def interview_created(self, user_id, created_at):
+        """Count a newly started interview; call after the interview row is flushed"""
+        if self._ensure_stats(user_id):
+            # Built from the interview table, which already holds the new interview
+            return
+        self.stats_model.query.filter_by(user_id=user_id).update({
+            'interview_count': self.stats_model.interview_count + 1,
+            'last_interview_at': created_at
+        }, synchronize_session=False)
+
+    def lock_user(self, user_id):
+        """Serialize score updates for one user until the caller commits.
+
+        Statements run after this see every score change committed before it."""
+        self._ensure_stats(user_id)
+        self.stats_model.query.filter_by(user_id=user_id).with_for_update().first()
+
+    def scores_changed(self, user_id, created_at, question_types):
+        """Recompute the user totals, the interview's month and the given question types.
+
+        Call after lock_user and after the new interview and response scores are written."""
+        interviews = self.interview_model
+        responses = self.response_model
+        owned = interviews.user_id == user_id
+
+        count, total, best = self.db.session.query(
+            func.count(interviews.overall_score),
+            func.coalesce(func.sum(interviews.overall_score), 0),
+            func.max(interviews.overall_score)
+        ).filter(owned).one()
+        self.stats_model.query.filter_by(user_id=user_id).update({
+            'scored_interview_count': count,
+            'score_total': total,
+            'best_score': best
+        }, synchronize_session=False)
+
+        month = month_bucket(created_at)
+        month_start = datetime.strptime(month, '%Y-%m')
+        month_end = (month_start + timedelta(days=32)).replace(day=1)
+        count, total = self.db.session.query(
+            func.count(interviews.overall_score), func.coalesce(func.sum(interviews.overall_score), 0)
+        ).filter(owned, interviews.created_at >= month_start, interviews.created_at < month_end).one()
+        self._set_rollup(user_id, MONTH, month, count, total)
+
+        for question_type in set(question_types):
+            count, total = self.db.session.query(
+                func.count(responses.score), func.coalesce(func.sum(responses.score), 0.0)
+            ).join(interviews, interviews.id == responses.interview_id).filter(
+                owned, responses.question_type == question_type
+            ).one()
+            self._set_rollup(user_id, QUESTION_TYPE, question_type, count, total)
+
+    def summary(self, user_id):
+        """Return the dashboard rollups for a user, building them on first use"""
+        stats = self.stats_model.query.get(user_id)
+        if stats is None:
+            self.rebuild(user_id)
+            self.db.session.commit()
+            stats = self.stats_model.query.get(user_id)
+
+        rollups = self.rollup_model.query.filter_by(user_id=user_id).all()
+        by_type = sorted(
+            (self._bucket_summary(row) for row in rollups if row.dimension == QUESTION_TYPE and row.count > 0),
+            key=lambda bucket: bucket["average_score"]
+        )
+        trend = sorted(
+            (self._bucket_summary(row) for row in rollups if row.dimension == MONTH and row.count > 0),
+            key=lambda bucket: bucket["bucket"]
+        )
+
+        return {
+            "interview_count": stats.interview_count,
+            "scored_interviews": stats.scored_interview_count,
+            "average_score": (
+                int(round(stats.score_total / stats.scored_interview_count))
+                if stats.scored_interview_count else None
+            ),
+            "best_score": stats.best_score,
+            "last_interview_at": stats.last_interview_at,
+            "by_question_type": by_type,
+            "weakest_categories": [bucket["bucket"] for bucket in by_type[:WEAKEST_CATEGORIES]],
+            "trend": trend
+        }
+
+    def rebuild(self, user_id=None):
+        """Recompute the rollups from the interview and response tables (one user, or everyone)"""
+        interviews = self.interview_model
+        responses = self.response_model
+
+        stats_query = self.stats_model.query
+        rollup_query = self.rollup_model.query
+        interview_filter = []
+        if user_id is not None:
+            stats_query = stats_query.filter_by(user_id=user_id)
+            rollup_query = rollup_query.filter_by(user_id=user_id)
+            interview_filter.append(interviews.user_id == user_id)
+        stats_query.delete(synchronize_session=False)
+        rollup_query.delete(synchronize_session=False)
+
+        scored = interviews.overall_score.isnot(None)
+        added = False
+        for row in self.db.session.query(
+            interviews.user_id,
+            func.count(interviews.id),
+            func.count(interviews.overall_score),
+            func.coalesce(func.sum(interviews.overall_score), 0),
+            func.max(interviews.overall_score),
+            func.max(interviews.created_at)
+        ).filter(*interview_filter).group_by(interviews.user_id):
+            self.db.session.add(self.stats_model(
+                user_id=row[0],
+                interview_count=row[1],
+                scored_interview_count=row[2],
+                score_total=row[3],
+                best_score=row[4],
+                last_interview_at=row[5]
+            ))
+            added = True
+
+        if user_id is not None and not added:
+            # A user with no interviews yet still gets an (empty) stats row
+            self.db.session.add(self.stats_model(user_id=user_id))
+
+        by_type = self.db.session.query(
+            interviews.user_id, responses.question_type, func.count(responses.score), func.sum(responses.score)
+        ).join(interviews, interviews.id == responses.interview_id).filter(
+            responses.score.isnot(None), *interview_filter
+        ).group_by(interviews.user_id, responses.question_type)
+        for owner, question_type, count, total in by_type:
+            self.db.session.add(self.rollup_model(
+                user_id=owner, dimension=QUESTION_TYPE, bucket=question_type, count=count, total=total
+            ))
+
+        monthly = {}
+        for owner, created_at, score in self.db.session.query(
+            interviews.user_id, interviews.created_at, interviews.overall_score
+        ).filter(scored, *interview_filter):
+            count, total = monthly.get((owner, month_bucket(created_at)), (0, 0.0))
+            monthly[(owner, month_bucket(created_at))] = (count + 1, total + score)
+        for (owner, bucket), (count, total) in monthly.items():
+            self.db.session.add(self.rollup_model(
+                user_id=owner, dimension=MONTH, bucket=bucket, count=count, total=total
+            ))
+
+    def _set_rollup(self, user_id, dimension, bucket, count, total):
+        model = self.rollup_model
+        self._ensure(model, user_id=user_id, dimension=dimension, bucket=bucket)
+        model.query.filter_by(user_id=user_id, dimension=dimension, bucket=bucket).update({
+            'count': count,
+            'total': total
+        }, synchronize_session=False)
+
+    def _ensure_stats(self, user_id):
+        """Build the user's stats and rollups from their existing interviews if they have
+        none yet (users from before the rollups, or brand new ones); returns whether it did"""
+        if self.stats_model.query.filter_by(user_id=user_id).first() is not None:
+            return False
+        try:
+            with self.db.session.begin_nested():
+                self.rebuild(user_id)
+        except IntegrityError:
+            # A concurrent request built them first
+            return False
+        return True
+
+    def _ensure(self, model, **keys):
+        """Create the counter row for keys if it does not exist yet"""
+        dialect = self.db.engine.dialect.name
+        if dialect in ('sqlite', 'postgresql'):
+            insert = sqlite.insert if dialect == 'sqlite' else postgresql.insert
+            self.db.session.execute(insert(model.__table__).values(**keys).on_conflict_do_nothing())
+        elif model.query.filter_by(**keys).first() is None:
+            self.db.session.add(model(**keys))
+            self.db.session.flush()
+
+    @staticmethod
+    def _bucket_summary(row):
+        average = row.total / row.count
+        if row.dimension == QUESTION_TYPE:
+            # Response scores are stored out of 10
+            average = scoring.to_percentage(average)
+        else:
+            average = int(round(average))
+        return {"bucket": row.bucket, "average_score": average, "count": row.count}
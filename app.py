@@ -1,24 +1,62 @@
 import os
-from flask import Flask, render_template, request, jsonify, redirect, url_for, flash, session
+import atexit
+import logging
+import click
+from flask import Flask, render_template, request, jsonify, redirect, url_for, flash, session, stream_with_context
 from flask_sqlalchemy import SQLAlchemy
+from flask_migrate import Migrate, upgrade
 from flask_login import LoginManager, UserMixin, login_user, login_required, logout_user, current_user
 from werkzeug.security import generate_password_hash, check_password_hash
 from datetime import datetime
 from dotenv import load_dotenv
 import openai
 import json
+import math
+import hashlib
+from functools import partial
+from sqlalchemy import func
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.dialects import postgresql, sqlite
+import llm_client
+import llm_parsing
+import jobs
+import analysis_cache
+import question_cache
+import scoring
+import analytics
+import database
+import question_bank
+import similarity_index
+import code_runner
+import grading
+import log_setup
+import metrics
+import profiling
 
 # Load environment variables
 load_dotenv()
+log_setup.configure()
+logger = logging.getLogger(__name__)
 
 # Initialize Flask app
 app = Flask(__name__)
+# Request latency and query counts by route, served on /metrics
+metrics.instrument(app)
+metrics.count_queries()
+# Per-request profiles on demand (X-Profile header or PROFILE_SAMPLE_RATE), listed on /admin/profiles
+profiling.instrument(app, 'app')
 app.config['SECRET_KEY'] = os.getenv("SECRET_KEY", "default-secret-key")
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///interview_app.db'
+database_url = database.configure(app)
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 
-# Initialize database
+# Initialize database; the schema is managed by migrations (flask db upgrade)
 db = SQLAlchemy(app)
+migrate = Migrate(
+    app,
+    db,
+    render_as_batch=database.is_sqlite(database_url),
+    include_object=database.include_in_migrations
+)
 
 # Initialize login manager
 login_manager = LoginManager()
@@ -44,31 +82,358 @@ class User(UserMixin, db.Model):
         return check_password_hash(self.password_hash, password)
 
 class Interview(db.Model):
+    __table_args__ = (
+        # Keyset pagination of a user's interview history
+        db.Index('ix_interview_user_id_id', 'user_id', 'id'),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     job_title = db.Column(db.String(100), nullable=False)
     experience_level = db.Column(db.String(50), nullable=False)
     experience_years = db.Column(db.Integer, nullable=True)
     overall_score = db.Column(db.Integer, nullable=True)
+    # Generated question list (JSON), kept server-side instead of in the session cookie
+    questions = db.Column(db.Text, nullable=True)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     responses = db.relationship('Response', backref='interview', lazy=True)
 
+class PracticeSession(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False, index=True)
+    questions = db.Column(db.Text, nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+class UserStats(db.Model):
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    interview_count = db.Column(db.Integer, nullable=False, default=0)
+    scored_interview_count = db.Column(db.Integer, nullable=False, default=0)
+    score_total = db.Column(db.Float, nullable=False, default=0)
+    best_score = db.Column(db.Integer, nullable=True)
+    last_interview_at = db.Column(db.DateTime, nullable=True)
+
+class UserScoreRollup(db.Model):
+    # dimension is 'question_type' (bucket = type, scores out of 10)
+    # or 'month' (bucket = YYYY-MM, interview percentages)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    dimension = db.Column(db.String(20), primary_key=True)
+    bucket = db.Column(db.String(50), primary_key=True)
+    count = db.Column(db.Integer, nullable=False, default=0)
+    total = db.Column(db.Float, nullable=False, default=0)
+
+def make_question_key(question, question_type):
+    """Stable hash identifying a question within an interview"""
+    return hashlib.sha256(f"{question_type}\x1f{(question or '').strip()}".encode('utf-8')).hexdigest()
+
+def default_question_key(context):
+    params = context.get_current_parameters()
+    return make_question_key(params['question'], params['question_type'])
+
 class Response(db.Model):
+    __table_args__ = (
+        db.Index('ix_response_interview_question_key', 'interview_id', 'question_key', unique=True),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     interview_id = db.Column(db.Integer, db.ForeignKey('interview.id'), nullable=False)
     question = db.Column(db.Text, nullable=False)
     question_type = db.Column(db.String(50), nullable=False)
+    question_key = db.Column(db.String(64), nullable=False, default=default_question_key)
     transcript = db.Column(db.Text, nullable=True)
     analysis = db.Column(db.Text, nullable=True)
+    score = db.Column(db.Float, nullable=True, index=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+class AnalysisCacheEntry(db.Model):
+    key = db.Column(db.String(64), primary_key=True)
+    value = db.Column(db.Text, nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+    last_used_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+
+class QuestionSet(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(50), nullable=False)
+    cache_key = db.Column(db.String(64), nullable=False, index=True)
+    params = db.Column(db.Text, nullable=False)
+    questions = db.Column(db.Text, nullable=False)
+    serve_count = db.Column(db.Integer, nullable=False, default=0)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+class Question(db.Model):
+    __table_args__ = (
+        db.Index('ix_question_level_type', 'level', 'question_type'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    question = db.Column(db.Text, nullable=False)
+    question_hash = db.Column(db.String(64), unique=True, nullable=False)
+    question_type = db.Column(db.String(50), nullable=False)
+    role = db.Column(db.String(100), nullable=False)
+    level = db.Column(db.String(50), nullable=False)
+    difficulty = db.Column(db.String(20), nullable=True)
+    language = db.Column(db.String(50), nullable=True)
+    source = db.Column(db.String(20), nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    def to_dict(self):
+        question = {"type": self.question_type, "question": self.question}
+        if self.difficulty:
+            question["difficulty"] = self.difficulty
+        if self.language:
+            question["language"] = self.language
+        return question
+
+class CodingTestSuite(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    question_hash = db.Column(db.String(64), unique=True, nullable=False)
+    function_name = db.Column(db.String(100), nullable=False)
+    test_cases = db.Column(db.Text, nullable=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
 
+    def to_dict(self):
+        return {"function_name": self.function_name, "test_cases": json.loads(self.test_cases)}
+
+class Job(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=True)
+    kind = db.Column(db.String(50), nullable=False)
+    dedup_key = db.Column(db.String(64), unique=True, nullable=False)
+    payload = db.Column(db.Text, nullable=False)
+    status = db.Column(db.String(20), nullable=False, default='queued', index=True)
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    max_attempts = db.Column(db.Integer, nullable=False, default=3)
+    result = db.Column(db.Text, nullable=True)
+    error = db.Column(db.Text, nullable=True)
+    run_after = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    locked_at = db.Column(db.DateTime, nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    def to_dict(self):
+        return {
+            "job_id": self.id,
+            "kind": self.kind,
+            "status": self.status,
+            "attempts": self.attempts,
+            "result": json.loads(self.result) if self.result else None,
+            "error": self.error if self.status == 'failed' else None
+        }
+
 @login_manager.user_loader
 def load_user(user_id):
     return User.query.get(int(user_id))
 
-# Create database tables
-with app.app_context():
-    db.create_all()
+user_analytics = analytics.UserAnalytics(db, UserStats, UserScoreRollup, Interview, Response)
+
+def analysis_columns(analysis):
+    """Column values for storing an analysis together with its numeric score"""
+    return {"analysis": json.dumps(analysis), "score": scoring.score_analysis(analysis)}
+
+def refresh_interview_scores(*interview_ids):
+    """Recompute overall_score (a percentage) from the stored response scores"""
+    average = db.session.query(func.avg(Response.score)).filter(
+        Response.interview_id == Interview.id
+    ).scalar_subquery()
+
+    query = Interview.query
+    if interview_ids:
+        query = query.filter(Interview.id.in_(interview_ids))
+    query.update({
+        'overall_score': db.cast(func.round(average * 100 / scoring.SCORE_SCALE), db.Integer)
+    }, synchronize_session=False)
+
+def record_scores(interview_id, changes):
+    """Refresh an interview's overall score and its user's rollups.
+
+    changes is a list of (question_type, old_score, new_score) for the responses
+    whose scores were just written; the caller commits."""
+    interview = db.session.query(Interview.user_id, Interview.created_at).filter(
+        Interview.id == interview_id
+    ).first()
+    if interview is None:
+        return
+
+    # Taken before any score is read, so a concurrent update for the same user
+    # is either fully visible here or waits for this transaction
+    user_analytics.lock_user(interview.user_id)
+    refresh_interview_scores(interview_id)
+    user_analytics.scores_changed(interview.user_id, interview.created_at,
+                                  [question_type for question_type, _, _ in changes])
+
+def upsert_response(interview_id, question, question_type, **values):
+    """Insert or update the response to a question in one atomic statement"""
+    question_key = make_question_key(question, question_type)
+    row = {
+        "interview_id": interview_id,
+        "question": question,
+        "question_type": question_type,
+        "question_key": question_key,
+        "created_at": datetime.utcnow(),
+        **values
+    }
+
+    dialect = db.engine.dialect.name
+    if dialect in ('sqlite', 'postgresql'):
+        insert = sqlite.insert if dialect == 'sqlite' else postgresql.insert
+        statement = insert(Response.__table__).values(**row)
+        if values:
+            statement = statement.on_conflict_do_update(index_elements=['interview_id', 'question_key'], set_=values)
+        else:
+            statement = statement.on_conflict_do_nothing(index_elements=['interview_id', 'question_key'])
+        db.session.execute(statement)
+        return
+
+    # Other databases: indexed lookup, then insert or update
+    response_record = Response.query.filter_by(interview_id=interview_id, question_key=question_key).first()
+    if response_record:
+        for name, value in values.items():
+            setattr(response_record, name, value)
+    else:
+        db.session.add(Response(**row))
+
+# Cache of response analyses keyed by question, transcript and prompt version
+response_analysis_cache = analysis_cache.AnalysisCache(app, db, AnalysisCacheEntry)
+
+# Pre-generated question sets for common setups (generators are registered below)
+question_sets = question_cache.QuestionSetCache(app, db, QuestionSet)
+
+# Every generated question, reused to assemble new sets before calling the LLM;
+# the similarity index keeps near-duplicates out of the bank and out of assembled sets
+question_index = similarity_index.SimilarityIndex(
+    os.getenv("SIMILARITY_INDEX_DIR", os.path.join(app.instance_path, 'similarity'))
+)
+questions_bank = question_bank.QuestionBank(db, Question, question_index)
+
+# Warm, jailed interpreter processes for running submitted code
+code_runs = code_runner.CodeRunner()
+atexit.register(code_runs.shutdown)
+
+# Test cases for coding questions, generated on first grading
+test_suites = grading.TestSuites(db, CodingTestSuite)
+
+# Most recent answers considered when skipping questions a user has already seen
+ANSWERED_LOOKBACK = 500
+
+def answered_questions(user_id):
+    """Texts of the questions this user answered most recently"""
+    return [row.question for row in db.session.query(Response.question).join(
+        Interview, Interview.id == Response.interview_id
+    ).filter(Interview.user_id == user_id).order_by(Response.id.desc()).limit(ANSWERED_LOOKBACK)]
+
+def bank_questions(kind, params, questions):
+    """Keep generated questions in the bank; failures here never affect generation"""
+    try:
+        questions_bank.add(
+            questions,
+            params.get('job_title', ''),
+            params.get('experience_level', ''),
+            source=kind,
+            difficulty=params.get('difficulty')
+        )
+        db.session.commit()
+        questions_bank.sync_index()
+    except Exception:
+        db.session.rollback()
+        logger.exception("Error adding questions to the bank")
+
+def assemble_from_bank(params, answered=None, allow_partial=False):
+    """Assemble a full question set from the bank, or return None if it has too few matches.
+    With allow_partial, return whatever matches there are"""
+    questions = questions_bank.assemble(
+        params.get('job_title', ''),
+        params.get('experience_level', ''),
+        params.get('question_types', []),
+        params['num_questions'],
+        difficulty=params.get('difficulty'),
+        languages=params.get('coding_languages'),
+        answered=answered
+    )
+    return questions if allow_partial or len(questions) >= params['num_questions'] else None
+
+def diversify_question_set(questions, params, answered):
+    """Drop near-duplicates within a set and of the user's answered questions, topping the
+    set back up from the bank; a set that would be left empty is served as it is"""
+    if not questions:
+        return questions
+    vectors = similarity_index.vectorize([question.get('question', '') for question in questions])
+    avoid = similarity_index.vectorize(answered) if answered else None
+    kept = [questions[index] for index in similarity_index.pick_diverse(vectors, params['num_questions'], avoid)]
+
+    missing = params['num_questions'] - len(kept)
+    if missing > 0:
+        seen = (answered or []) + [question['question'] for question in kept]
+        kept += (assemble_from_bank(params, seen, allow_partial=True) or [])[:missing]
+    return kept or questions
+
+def take_question_set(kind, params, user_id=None):
+    """Serve questions from the bank, then the pre-generated pool, and only then generate live.
+
+    Every set is kept free of near-duplicates and of questions the user answered recently."""
+    answered = answered_questions(user_id) if user_id else None
+    questions = assemble_from_bank(params, answered)
+    if questions:
+        return questions
+
+    questions = question_sets.take(kind, params)
+    if questions is None:
+        generator = generate_interview_questions if kind == 'interview' else generate_practice_questions
+        unavailable = None
+        try:
+            questions = generator(**params)
+        except llm_client.LLMUnavailableError as e:
+            unavailable = e
+        if questions:
+            question_sets.add(kind, params, questions, serve_count=1)
+        else:
+            # A short set from the bank beats no set while live generation is failing
+            questions = assemble_from_bank(params, answered, allow_partial=True) or questions
+            if not questions and unavailable:
+                raise unavailable
+    return diversify_question_set(questions, params, answered)
+
+# Background job queue for LLM work (handlers are registered below)
+job_queue = jobs.JobQueue(app, db, Job)
+
+@app.before_request
+def start_job_workers():
+    """Make sure this process runs job workers, so queued jobs survive restarts"""
+    job_queue.ensure_started()
+
+# LLM scheduling priority of the endpoints that call the model; others run at normal priority
+LLM_ENDPOINT_PRIORITIES = {
+    'transcribe_audio': llm_client.PRIORITY_HIGH,
+    'analyze_response': llm_client.PRIORITY_HIGH,
+    'analyze_batch': llm_client.PRIORITY_HIGH,
+    'check_answer': llm_client.PRIORITY_NORMAL,
+    'setup': llm_client.PRIORITY_NORMAL,
+    'generate_prep_questions': llm_client.PRIORITY_LOW,
+    'explain_code': llm_client.PRIORITY_LOW,
+}
+
+# Seconds an endpoint's LLM calls may take in total, retries included; others get LLM_DEFAULT_DEADLINE
+LLM_ENDPOINT_DEADLINES = {
+    'transcribe_audio': 30,
+    'analyze_response': 30,
+    'analyze_batch': 60,
+    'check_answer': 45,
+    'setup': 30,
+    'generate_prep_questions': 30,
+    'explain_code': 150,
+}
+
+@app.before_request
+def set_llm_caller():
+    """Charge this request's LLM calls to the signed-in user at the endpoint's priority, within its deadline"""
+    user_id = current_user.get_id() if current_user.is_authenticated else None
+    llm_client.set_caller(user_id, LLM_ENDPOINT_PRIORITIES.get(request.endpoint, llm_client.PRIORITY_NORMAL))
+    llm_client.set_deadline(LLM_ENDPOINT_DEADLINES.get(request.endpoint))
+
+def busy_response(e):
+    """429 when the user is over their LLM rate, 503 when the service is overloaded; both say when to retry"""
+    response = jsonify({"error": str(e), "retry_after": round(e.retry_after, 1)})
+    response.status_code = 429 if isinstance(e, llm_client.LLMRateLimitError) else 503
+    response.headers['Retry-After'] = str(math.ceil(e.retry_after))
+    return response
 
 # Interview questions by category
 interview_questions = {
@@ -168,14 +533,42 @@ def logout():
     flash('You have been logged out', 'info')
     return redirect(url_for('index'))
 
+# Interviews listed per dashboard page
+DASHBOARD_PAGE_SIZE = int(os.getenv("DASHBOARD_PAGE_SIZE", "20"))
+
 @app.route('/dashboard')
 @login_required
 def dashboard():
     """Render the user dashboard"""
-    # Get user's interview history
-    interviews = Interview.query.filter_by(user_id=current_user.id).order_by(Interview.created_at.desc()).all()
-
-    return render_template('dashboard.html', interviews=interviews)
+    # One page of the user's interview history, newest first
+    interviews, next_before = interview_history_page(current_user.id, request.args.get('before', type=int))
+
+    return render_template(
+        'dashboard.html',
+        interviews=interviews,
+        next_before=next_before,
+        score_summary=user_analytics.summary(current_user.id)
+    )
+
+def interview_history_page(user_id, before=None, page_size=None):
+    """Return (interviews, next_before) using keyset pagination on interview id"""
+    page_size = page_size or DASHBOARD_PAGE_SIZE
+    query = Interview.query.filter(Interview.user_id == user_id)
+    if before:
+        query = query.filter(Interview.id < before)
+    interviews = query.order_by(Interview.id.desc()).limit(page_size + 1).all()
+
+    next_before = None
+    if len(interviews) > page_size:
+        interviews = interviews[:page_size]
+        next_before = interviews[-1].id
+    return interviews, next_before
+
+@app.route('/api/analytics')
+@login_required
+def get_analytics():
+    """Return the current user's score rollups"""
+    return jsonify(user_analytics.summary(current_user.id))
 
 @app.route('/setup', methods=['GET', 'POST'])
 @login_required
@@ -190,28 +583,32 @@ def setup():
         question_types = data.get('question_types', [])
         num_questions = int(data.get('num_questions', 5))
 
-        # Generate questions based on preferences
-        generated_questions = generate_interview_questions(
-            job_title,
-            experience_level,
-            question_types,
-            num_questions
-        )
+        # Assemble from the question bank, falling back to pooled or live generation
+        question_params = {
+            "job_title": job_title,
+            "experience_level": experience_level,
+            "question_types": question_types,
+            "num_questions": num_questions
+        }
+        generated_questions = take_question_set('interview', question_params, current_user.id)
 
         # Create new interview record in database
         interview = Interview(
             user_id=current_user.id,
             job_title=job_title,
             experience_level=experience_level,
-            experience_years=experience_years
+            experience_years=experience_years,
+            questions=json.dumps(generated_questions)
         )
 
         db.session.add(interview)
+        db.session.flush()
+        user_analytics.interview_created(current_user.id, interview.created_at)
         db.session.commit()
 
-        # Store interview ID and questions in session for later use
+        # Only the interview ID goes in the session; the questions live on the interview row
         session['current_interview_id'] = interview.id
-        session['interview_questions'] = generated_questions
+        session.pop('interview_questions', None)
         session['enable_video'] = data.get('enable_video', False)
 
         return jsonify({"questions": generated_questions, "interview_id": interview.id})
@@ -234,10 +631,10 @@ def interview():
         flash('Interview not found', 'error')
         return redirect(url_for('dashboard'))
 
-    # Get questions for this interview from session
-    questions = session.get('interview_questions', [])
+    # Get questions stored with this interview
+    questions = json.loads(interview.questions) if interview.questions else []
 
-    # If no questions in session, use some default questions for testing
+    # If no questions were stored, use some default questions for testing
     if not questions:
         questions = [
             {"type": "technical", "question": "What is your experience with Python programming?"},
@@ -246,12 +643,13 @@ def interview():
             {"type": "technical", "question": "Explain the concept of object-oriented programming."},
             {"type": "behavioral", "question": "Describe a project you're particularly proud of."}
         ]
-        # Store these questions in the session
-        session['interview_questions'] = questions
-        print("Using default questions since none were found in session")
+        # Store these questions with the interview
+        interview.questions = json.dumps(questions)
+        db.session.commit()
+        logger.info("Using default questions since none were stored for this interview",
+                    extra={"interview_id": interview.id})
 
-    # Print questions for debugging
-    print("Questions being passed to template:", questions)
+    logger.debug("Rendering interview questions", extra={"interview_id": interview.id, "count": len(questions)})
 
     return render_template('interview.html', interview=interview, questions=questions)
 
@@ -288,7 +686,8 @@ def results():
                 "type": response.question_type
             },
             "transcript": response.transcript,
-            "analysis": analysis
+            "analysis": analysis,
+            "score": response.score
         })
 
     return render_template('results.html', interview=interview, responses=formatted_responses)
@@ -305,52 +704,21 @@ def transcribe_audio():
     question_type = request.form.get('question_type')
 
     try:
-        # Use OpenAI's Whisper API for transcription
-        # Save the audio file to a temporary file
-        temp_file_path = "temp_audio.webm"
-        audio_file.save(temp_file_path)
-
-        # Open the file and transcribe
-        with open(temp_file_path, "rb") as audio_file_obj:
-            transcript = openai.Audio.transcribe("whisper-1", audio_file_obj)
-
-        # Remove the temporary file
-        os.remove(temp_file_path)
-
-        # Get the transcript text
-        transcript_text = transcript.text
+        # Use OpenAI's Whisper API for transcription, streaming the upload
+        # straight from this request's own buffer (no shared file on disk)
+        transcript_text = llm_client.transcribe(audio_file.stream, audio_file.filename or "recording.webm")
 
         # Save to database if we have an active interview
         interview_id = session.get('current_interview_id')
         if interview_id and question_text and question_type:
-            # Check if response already exists
-            existing_response = Response.query.filter_by(
-                interview_id=interview_id,
-                question=question_text,
-                question_type=question_type
-            ).first()
-
-            if existing_response:
-                # Update existing response
-                existing_response.transcript = transcript_text
-                db.session.commit()
-            else:
-                # Create new response
-                response = Response(
-                    interview_id=interview_id,
-                    question=question_text,
-                    question_type=question_type,
-                    transcript=transcript_text
-                )
-                db.session.add(response)
-                db.session.commit()
+            upsert_response(interview_id, question_text, question_type, transcript=transcript_text)
+            db.session.commit()
 
         return jsonify({"transcript": transcript_text})
+    except llm_client.LLMBusyError as e:
+        return busy_response(e)
     except Exception as e:
-        print(f"Transcription error: {str(e)}")
-        # Check if the file exists and remove it
-        if os.path.exists(temp_file_path):
-            os.remove(temp_file_path)
+        logger.exception("Transcription error")
         return jsonify({"error": f"Error transcribing audio: {str(e)}"}), 500
 
 @app.route('/api/transcribe-text', methods=['POST'])
@@ -371,33 +739,64 @@ def transcribe_text():
         if not interview_id:
             return jsonify({"error": "No active interview"}), 400
 
-        # Check if response already exists
-        existing_response = Response.query.filter_by(
-            interview_id=interview_id,
-            question=question_text,
-            question_type=question_type
-        ).first()
-
-        if existing_response:
-            # Update existing response
-            existing_response.transcript = transcript
-            db.session.commit()
-        else:
-            # Create new response
-            response = Response(
-                interview_id=interview_id,
-                question=question_text,
-                question_type=question_type,
-                transcript=transcript
-            )
-            db.session.add(response)
-            db.session.commit()
+        upsert_response(interview_id, question_text, question_type, transcript=transcript)
+        db.session.commit()
 
         return jsonify({"success": True})
     except Exception as e:
-        print(f"Error saving transcript: {str(e)}")
+        logger.exception("Error saving transcript")
         return jsonify({"error": f"Error saving transcript: {str(e)}"}), 500
 
+def wants_event_stream():
+    """Check whether the client asked for a server-sent event stream"""
+    return request.args.get('stream') == '1' or request.accept_mimetypes.best == 'text/event-stream'
+
+def sse_event(event, data):
+    """Format one server-sent event"""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+def stream_llm_response(messages, finish, timeout=None):
+    """Stream a completion as server-sent events"""
+    # token events per chunk, field/item events as JSON fields complete,
+    # then a done event with the same payload the buffered endpoint returns
+    def generate():
+        fields = llm_parsing.StreamingJSONFields()
+        parts = []
+        try:
+            for token in llm_client.stream_chat_completion(messages, temperature=0.7, timeout=timeout):
+                parts.append(token)
+                yield sse_event('token', {"text": token})
+                for event in fields.feed(token):
+                    yield sse_event(event.pop('event'), event)
+
+            yield sse_event('done', finish(''.join(parts)))
+        except llm_client.LLMBusyError as e:
+            yield sse_event('error', {"error": str(e), "retry_after": round(e.retry_after, 1)})
+        except Exception as e:
+            logger.exception("Error streaming completion")
+            yield sse_event('error', {"error": str(e)})
+
+    return app.response_class(
+        stream_with_context(generate()),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+def save_response_analysis(interview_id, question, question_type, analysis):
+    """Store an analysis on the matching response of an interview"""
+    # Indexed lookup by question key; responses that were never recorded are left alone
+    response_record = db.session.query(Response.id, Response.score).filter_by(
+        interview_id=interview_id,
+        question_key=make_question_key(question, question_type)
+    ).first()
+    if response_record is None:
+        return
+
+    values = analysis_columns(analysis)
+    Response.query.filter_by(id=response_record.id).update(values, synchronize_session=False)
+    record_scores(interview_id, [(question_type, response_record.score, values["score"])])
+    db.session.commit()
+
 @app.route('/api/analyze', methods=['POST'])
 @login_required
 def analyze_response():
@@ -406,29 +805,142 @@ def analyze_response():
     question = data.get('question', '')
     response_text = data.get('response', '')
     question_type = data.get('question_type', 'general')
+    interview_id = session.get('current_interview_id')
+
+    if wants_event_stream():
+        cached = response_analysis_cache.get(analysis_cache_key(question, response_text))
+        if cached is not None:
+            # Nothing to stream; answer with the final event right away
+            if interview_id and question:
+                save_response_analysis(interview_id, question, question_type, cached)
+            return app.response_class(sse_event('done', {"analysis": cached}), mimetype='text/event-stream')
+
+        def finish(content):
+            analysis = parse_analysis_content(content)
+            cache_analysis(question, response_text, analysis)
+            # Save to database if we have an active interview
+            if interview_id and question:
+                save_response_analysis(interview_id, question, question_type, analysis)
+            return {"analysis": analysis}
+
+        return stream_llm_response(build_analysis_messages(question, response_text), finish)
 
     try:
         # Use OpenAI to analyze the response
         analysis = analyze_interview_response(question, response_text)
-        analysis_json = json.dumps(analysis)
 
         # Save to database if we have an active interview
-        interview_id = session.get('current_interview_id')
         if interview_id and question:
-            # Find the response in the database
-            response_record = Response.query.filter_by(
-                interview_id=interview_id,
-                question=question,
-                question_type=question_type
-            ).first()
+            save_response_analysis(interview_id, question, question_type, analysis)
 
+        return jsonify({"analysis": analysis})
+    except llm_client.LLMBusyError as e:
+        return busy_response(e)
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+# Upper bound on analyses per batch and on how many run at once
+ANALYZE_BATCH_MAX_ITEMS = 50
+ANALYZE_BATCH_CONCURRENCY = int(os.getenv("ANALYZE_BATCH_CONCURRENCY", "5"))
+
+def batch_item_error(index, item):
+    """Describe what is wrong with one responses[] entry of a batch request, or None"""
+    if not isinstance(item, dict):
+        return f"responses[{index}] must be an object"
+    if not isinstance(item.get('question'), str) or not item['question'].strip():
+        return f"responses[{index}].question must be a non-empty string"
+    for name in ('response', 'question_type'):
+        if name in item and not isinstance(item[name], str):
+            return f"responses[{index}].{name} must be a string"
+    return None
+
+@app.route('/api/analyze-batch', methods=['POST'])
+@login_required
+def analyze_batch():
+    """Analyze all responses of the current interview in parallel"""
+    data = request.get_json(silent=True) or {}
+    if not isinstance(data, dict):
+        return jsonify({"error": "Request body must be a JSON object"}), 400
+
+    items = data.get('responses')
+    if items is not None:
+        if not isinstance(items, list):
+            return jsonify({"error": "responses must be a list"}), 400
+        if len(items) > ANALYZE_BATCH_MAX_ITEMS:
+            return jsonify({"error": f"At most {ANALYZE_BATCH_MAX_ITEMS} responses can be analyzed at once"}), 400
+        for index, item in enumerate(items):
+            error = batch_item_error(index, item)
+            if error:
+                return jsonify({"error": error}), 400
+
+    interview_id = session.get('current_interview_id')
+    if not interview_id:
+        return jsonify({"error": "No active interview"}), 400
+
+    try:
+        records = Response.query.filter_by(interview_id=interview_id).all()
+        records_by_key = {record.question_key: record for record in records}
+
+        if items is None:
+            # Analyze every saved transcript that has no analysis yet
+            items = [
+                {"question": record.question, "question_type": record.question_type, "response": record.transcript}
+                for record in records if record.transcript and not record.analysis
+            ]
+
+        if len(items) > ANALYZE_BATCH_MAX_ITEMS:
+            return jsonify({"error": f"At most {ANALYZE_BATCH_MAX_ITEMS} responses can be analyzed at once"}), 400
+
+        # Fan the analyses out; total wait is roughly the slowest one. One analysis
+        # being turned away (rate limit, overload) does not lose the others.
+        analyses = llm_client.map_concurrent(
+            analyze_interview_response,
+            [(item.get('question', ''), item.get('response', '')) for item in items],
+            limit=ANALYZE_BATCH_CONCURRENCY,
+            return_exceptions=True
+        )
+
+        # Write all successful analyses in a single transaction
+        results = []
+        failed = []
+        score_changes = []
+        for item, analysis in zip(items, analyses):
+            question = item.get('question', '')
+            question_type = item.get('question_type', 'general')
+            if isinstance(analysis, Exception):
+                failure = {"question": question, "question_type": question_type, "error": str(analysis)}
+                if isinstance(analysis, llm_client.LLMBusyError):
+                    failure["retry_after"] = round(analysis.retry_after, 1)
+                else:
+                    logger.error("Error analyzing batch item", exc_info=analysis)
+                failed.append(failure)
+                continue
+
+            response_record = records_by_key.get(make_question_key(question, question_type))
             if response_record:
-                # Update with analysis
-                response_record.analysis = analysis_json
-                db.session.commit()
+                values = analysis_columns(analysis)
+                score_changes.append((question_type, response_record.score, values["score"]))
+                for name, value in values.items():
+                    setattr(response_record, name, value)
+
+            results.append({
+                "question": question,
+                "question_type": question_type,
+                "analysis": analysis
+            })
+
+        if score_changes:
+            record_scores(interview_id, score_changes)
+        db.session.commit()
 
-        return jsonify({"analysis": analysis})
+        busy = [analysis for analysis in analyses if isinstance(analysis, llm_client.LLMBusyError)]
+        if busy and not results:
+            # Nothing was analyzed: answer like a single turned-away call
+            return busy_response(min(busy, key=lambda error: error.retry_after))
+        return jsonify({"results": results, "failed": failed})
     except Exception as e:
+        db.session.rollback()
+        logger.exception("Error analyzing batch")
         return jsonify({"error": str(e)}), 500
 
 @app.route('/api/get-responses', methods=['GET'])
@@ -459,19 +971,23 @@ def get_responses():
                     'type': response.question_type
                 },
                 'transcript': response.transcript,
-                'analysis': analysis
+                'analysis': analysis,
+                'score': response.score
             }
             responses_data.append(response_data)
 
         return jsonify({"responses": responses_data})
     except Exception as e:
-        print(f"Error getting responses: {str(e)}")
+        logger.exception("Error getting responses")
         return jsonify({"error": str(e)}), 500
 
 @app.route('/api/save-interview', methods=['POST'])
 @login_required
 def save_interview():
-    """Save completed interview data"""
+    """Save completed interview data.
+
+    Only transcripts are taken from the payload; analyses and scores are written
+    by the server when it analyzes a response, never from what the browser sends."""
     data = request.json
     responses = data.get('responses', [])
 
@@ -479,68 +995,68 @@ def save_interview():
     if not interview_id:
         return jsonify({"error": "No active interview"}), 400
 
-    try:
-        # Save each response
-        for resp in responses:
-            question = resp.get('question', {})
-            question_text = question.get('question', '')
-            question_type = question.get('type', 'general')
-            transcript = resp.get('transcript', '')
-            analysis = resp.get('analysis', {})
-
-            # Find or create response record
-            response_record = Response.query.filter_by(
-                interview_id=interview_id,
-                question=question_text,
-                question_type=question_type
-            ).first()
-
-            if response_record:
-                # Update existing record
-                response_record.transcript = transcript
-                response_record.analysis = json.dumps(analysis)
-            else:
-                # Create new record
-                response_record = Response(
-                    interview_id=interview_id,
-                    question=question_text,
-                    question_type=question_type,
-                    transcript=transcript,
-                    analysis=json.dumps(analysis)
-                )
-                db.session.add(response_record)
+    # Collapse the payload to one entry per question; the last one wins
+    incoming = {}
+    for resp in responses:
+        question = resp.get('question', {})
+        question_text = question.get('question', '')
+        question_type = question.get('type', 'general')
+        incoming[make_question_key(question_text, question_type)] = {
+            "question": question_text,
+            "question_type": question_type,
+            "transcript": resp.get('transcript', '')
+        }
 
-        db.session.commit()
-        return jsonify({"success": True})
+    try:
+        for attempt in range(2):
+            try:
+                summary = save_interview_responses(interview_id, incoming)
+                break
+            except IntegrityError:
+                # A concurrent request inserted one of the rows; rematch against it
+                db.session.rollback()
+                if attempt:
+                    raise
+
+        return jsonify({"success": True, **summary})
     except Exception as e:
+        db.session.rollback()
         return jsonify({"error": str(e)}), 500
 
-@app.route('/api/save-score', methods=['POST'])
-@login_required
-def save_score():
-    """Save overall score for an interview"""
-    data = request.json
-    interview_id = data.get('interview_id')
-    overall_score = data.get('overall_score')
-
-    if not interview_id or overall_score is None:
-        return jsonify({"error": "Missing interview_id or overall_score"}), 400
-
-    try:
-        # Get the interview
-        interview = Interview.query.get(interview_id)
+def save_interview_responses(interview_id, incoming):
+    """Apply incoming transcripts (keyed by question_key) with one read and bulk writes"""
+    existing = {
+        row.question_key: row
+        for row in db.session.query(
+            Response.id, Response.question_key, Response.transcript
+        ).filter(Response.interview_id == interview_id)
+    }
+
+    inserts, updates = [], []
+    unchanged = 0
+    now = datetime.utcnow()
+    for question_key, values in incoming.items():
+        row = existing.get(question_key)
+        if row is None:
+            inserts.append({
+                "interview_id": interview_id,
+                "question_key": question_key,
+                "created_at": now,
+                **values
+            })
+        elif row.transcript != values["transcript"]:
+            # Stored analyses and scores are left as they are
+            updates.append({"id": row.id, "transcript": values["transcript"]})
+        else:
+            unchanged += 1
 
-        # Check if the interview exists and belongs to the current user
-        if not interview or interview.user_id != current_user.id:
-            return jsonify({"error": "Interview not found"}), 404
+    if inserts:
+        db.session.bulk_insert_mappings(Response, inserts)
+    if updates:
+        db.session.bulk_update_mappings(Response, updates)
+    db.session.commit()
 
-        # Update the overall score (convert to integer if it's a string)
-        interview.overall_score = int(overall_score) if isinstance(overall_score, (str, float)) else overall_score
-        db.session.commit()
-
-        return jsonify({"success": True})
-    except Exception as e:
-        return jsonify({"error": str(e)}), 500
+    return {"inserted": len(inserts), "updated": len(updates), "unchanged": unchanged}
 
 def generate_interview_questions(job_title, experience_level, question_types, num_questions):
     """Generate interview questions using OpenAI"""
@@ -549,8 +1065,7 @@ def generate_interview_questions(job_title, experience_level, question_types, nu
         Include questions of these types: {', '.join(question_types)}.
         Format the response as a JSON array of objects with 'type' and 'question' fields."""
 
-        response = openai.ChatCompletion.create(
-            model="gpt-3.5-turbo",
+        content = llm_client.chat_completion(
             messages=[
                 {"role": "system", "content": "You are an expert interviewer for technical positions."},
                 {"role": "user", "content": prompt}
@@ -559,43 +1074,29 @@ def generate_interview_questions(job_title, experience_level, question_types, nu
         )
 
         # Parse the response to extract questions
-        content = response.choices[0].message.content
-        try:
-            # Try to parse as JSON directly
-            questions = json.loads(content)
-        except json.JSONDecodeError:
-            # If not valid JSON, extract JSON part from the text
-            start_idx = content.find('[')
-            end_idx = content.rfind(']') + 1
-            if start_idx != -1 and end_idx != -1:
-                questions_json = content[start_idx:end_idx]
-                questions = json.loads(questions_json)
-            else:
-                # Fallback: create structured questions from text
-                lines = content.split('\n')
-                questions = []
-                for line in lines:
-                    if line.strip() and ':' in line:
-                        q_type = "general"
-                        if "technical" in line.lower():
-                            q_type = "technical"
-                        elif "behavioral" in line.lower():
-                            q_type = "behavioral"
-                        elif "situational" in line.lower():
-                            q_type = "situational"
-
-                        question_text = line.split(':', 1)[1].strip()
-                        questions.append({"type": q_type, "question": question_text})
+        questions = llm_parsing.parse_structured(content, 'interview_questions')
 
+        bank_questions('interview', {"job_title": job_title, "experience_level": experience_level}, questions)
         return questions
-    except Exception as e:
-        print(f"Error generating questions: {str(e)}")
+    except Exception:
+        logger.exception("Error generating questions")
         return []
 
-def analyze_interview_response(question, response):
-    """Analyze interview response using OpenAI"""
-    try:
-        prompt = f"""
+# Bump whenever the analysis prompt changes so cached analyses are not reused
+ANALYSIS_PROMPT_VERSION = "1"
+
+def analysis_cache_key(question, response):
+    """Cache key for analyzing this response to this question"""
+    return analysis_cache.make_key(question, response, ANALYSIS_PROMPT_VERSION)
+
+def cache_analysis(question, response, analysis):
+    """Cache an analysis unless it is an unparsed or error fallback"""
+    if 'text' not in analysis:
+        response_analysis_cache.put(analysis_cache_key(question, response), analysis)
+
+def build_analysis_messages(question, response):
+    """Build the chat messages for analyzing an interview response"""
+    prompt = f"""
         Question: {question}
 
         Response: {response}
@@ -613,83 +1114,43 @@ def analyze_interview_response(question, response):
         Where X is a number between 1 and 10 representing your overall assessment of the answer quality. The score should be displayed as "X/10" in the final output.
         """
 
-        analysis_response = openai.ChatCompletion.create(
-            model="gpt-3.5-turbo",
-            messages=[
-                {"role": "system", "content": "You are an expert at evaluating interview responses. Always format your response as valid JSON."},
-                {"role": "user", "content": prompt}
-            ],
-            temperature=0.7,
-        )
+    return [
+        {"role": "system", "content": "You are an expert at evaluating interview responses. Always format your response as valid JSON."},
+        {"role": "user", "content": prompt}
+    ]
 
-        # Extract and parse the analysis
-        content = analysis_response.choices[0].message.content
-        print("Raw analysis response:", content)
+def compute_analysis(question, response):
+    """Analyze interview response using OpenAI, raising on failure"""
+    # Repeated question/transcript pairs are served from the cache
+    cached = response_analysis_cache.get(analysis_cache_key(question, response))
+    if cached is not None:
+        return cached
 
-        try:
-            # Try to parse as JSON directly
-            # First, clean up any potential formatting issues
-            content = content.replace('\n', ' ').replace('\r', ' ')
-            # Handle the case where score is formatted as X/10 which is not valid JSON
-            content = content.replace('"score": 1/10', '"score": "1/10"')
-            content = content.replace('"score": 2/10', '"score": "2/10"')
-            content = content.replace('"score": 3/10', '"score": "3/10"')
-            content = content.replace('"score": 4/10', '"score": "4/10"')
-            content = content.replace('"score": 5/10', '"score": "5/10"')
-            content = content.replace('"score": 6/10', '"score": "6/10"')
-            content = content.replace('"score": 7/10', '"score": "7/10"')
-            content = content.replace('"score": 8/10', '"score": "8/10"')
-            content = content.replace('"score": 9/10', '"score": "9/10"')
-            content = content.replace('"score": 10/10', '"score": "10/10"')
-
-            analysis = json.loads(content)
-            print("Successfully parsed JSON response")
-
-            # Keep the score as a string in format X/10 for display purposes
-            # We don't need to convert it to an integer anymore
-
-            return analysis
-        except json.JSONDecodeError as json_error:
-            print(f"JSON parsing error: {str(json_error)}")
-
-            # Try to extract JSON from the text
-            try:
-                # Look for JSON-like structure between curly braces
-                start_idx = content.find('{')
-                end_idx = content.rfind('}') + 1
-
-                if start_idx != -1 and end_idx != -1 and start_idx < end_idx:
-                    json_str = content[start_idx:end_idx]
-
-                    # Handle the case where score is formatted as X/10 which is not valid JSON
-                    json_str = json_str.replace('"score": 1/10', '"score": "1/10"')
-                    json_str = json_str.replace('"score": 2/10', '"score": "2/10"')
-                    json_str = json_str.replace('"score": 3/10', '"score": "3/10"')
-                    json_str = json_str.replace('"score": 4/10', '"score": "4/10"')
-                    json_str = json_str.replace('"score": 5/10', '"score": "5/10"')
-                    json_str = json_str.replace('"score": 6/10', '"score": "6/10"')
-                    json_str = json_str.replace('"score": 7/10', '"score": "7/10"')
-                    json_str = json_str.replace('"score": 8/10', '"score": "8/10"')
-                    json_str = json_str.replace('"score": 9/10', '"score": "9/10"')
-                    json_str = json_str.replace('"score": 10/10', '"score": "10/10"')
-
-                    analysis = json.loads(json_str)
-                    print("Successfully extracted and parsed JSON from text")
-
-                    # Keep the score as a string in format X/10 for display purposes
-                    # We don't need to convert it to an integer anymore
-
-                    return analysis
-            except Exception as extract_error:
-                print(f"JSON extraction error: {str(extract_error)}")
-
-            # If all JSON parsing fails, return as formatted text
-            formatted_text = content.replace('\n', '<br>')
-            return {"text": formatted_text}
-    except Exception as e:
-        print(f"Error analyzing response: {str(e)}")
+    content = llm_client.chat_completion(
+        messages=build_analysis_messages(question, response),
+        temperature=0.7,
+    )
+
+    analysis = parse_analysis_content(content)
+    cache_analysis(question, response, analysis)
+    return analysis
+
+def analyze_interview_response(question, response):
+    """Analyze interview response using OpenAI"""
+    try:
+        return compute_analysis(question, response)
+    except llm_client.LLMBusyError:
+        # Rejected before reaching the model; the caller tells the client when to retry
+        raise
+    except Exception:
+        logger.exception("Error analyzing response")
         return {"text": "There was an error analyzing your response. The system might be experiencing high load. Please try again later."}
 
+def parse_analysis_content(content):
+    """Parse the model output of an interview response analysis"""
+    # Bare X/10 scores are kept as strings for display
+    return llm_parsing.parse_structured(content, 'analysis')
+
 @app.route('/prep')
 @login_required
 def prep():
@@ -700,16 +1161,74 @@ def prep():
 @login_required
 def practice():
     """Render the practice interview page"""
-    # Get practice questions from session
-    questions = session.get('practice_questions', [])
-
-    # If no questions in session, redirect to prep page
+    # Look up the practice set whose id is kept in the session
+    practice_session = None
+    practice_id = session.get('practice_session_id')
+    if practice_id:
+        practice_session = PracticeSession.query.filter_by(id=practice_id, user_id=current_user.id).first()
+    questions = json.loads(practice_session.questions) if practice_session else []
+
+    # If no practice set was found, redirect to prep page
     if not questions:
         flash('No practice questions found. Please set up your practice first.', 'error')
         return redirect(url_for('prep'))
 
     return render_template('practice.html', questions=questions)
 
+def generate_practice_questions(job_title, experience_level, question_types, coding_languages, num_questions, difficulty):
+    """Generate practice interview questions using OpenAI"""
+    # Build prompt based on user preferences
+    prompt = f"""Generate {num_questions} interview questions for a {experience_level} level {job_title} position.
+        Include questions of these types: {', '.join(question_types)}.
+        The difficulty level should be {difficulty}.
+        """
+
+    # Add specific instructions for coding questions
+    if 'coding' in question_types and coding_languages:
+        prompt += f"""For coding questions, include problems that can be solved in these languages: {', '.join(coding_languages)}.
+            For each coding question, specify which language it's for.
+            """
+
+    prompt += """Format the response as a JSON array of objects with 'type', 'question', 'difficulty' fields.
+        For coding questions, also include a 'language' field."""
+
+    # Generate questions using OpenAI
+    content = llm_client.chat_completion(
+        messages=[
+            {"role": "system", "content": "You are an expert interviewer for technical positions. Generate diverse, challenging, and realistic interview questions."},
+            {"role": "user", "content": prompt}
+        ],
+        temperature=0.7,
+    )
+
+    # Parse the response to extract questions
+    questions = llm_parsing.parse_structured(content, 'practice_questions')
+
+    bank_questions('practice', {
+        "job_title": job_title,
+        "experience_level": experience_level,
+        "difficulty": difficulty
+    }, questions)
+    return questions
+
+# Practice question sets kept per user (older ones are deleted)
+PRACTICE_SESSIONS_KEPT = 5
+
+def save_practice_session(user_id, questions):
+    """Store a practice question set and prune the user's older ones, returning its id"""
+    practice_session = PracticeSession(user_id=user_id, questions=json.dumps(questions))
+    db.session.add(practice_session)
+    db.session.flush()
+
+    stale = [row.id for row in db.session.query(PracticeSession.id).filter(
+        PracticeSession.user_id == user_id
+    ).order_by(PracticeSession.id.desc()).offset(PRACTICE_SESSIONS_KEPT)]
+    if stale:
+        PracticeSession.query.filter(PracticeSession.id.in_(stale)).delete(synchronize_session=False)
+
+    db.session.commit()
+    return practice_session.id
+
 @app.route('/api/generate-prep-questions', methods=['POST'])
 @login_required
 def generate_prep_questions():
@@ -723,92 +1242,32 @@ def generate_prep_questions():
     difficulty = data.get('difficulty', 'medium')
 
     try:
-        # Build prompt based on user preferences
-        prompt = f"""Generate {num_questions} interview questions for a {experience_level} level {job_title} position.
-        Include questions of these types: {', '.join(question_types)}.
-        The difficulty level should be {difficulty}.
-        """
-
-        # Add specific instructions for coding questions
-        if 'coding' in question_types and coding_languages:
-            prompt += f"""For coding questions, include problems that can be solved in these languages: {', '.join(coding_languages)}.
-            For each coding question, specify which language it's for.
-            """
-
-        prompt += """Format the response as a JSON array of objects with 'type', 'question', 'difficulty' fields.
-        For coding questions, also include a 'language' field."""
-
-        # Generate questions using OpenAI
-        response = openai.ChatCompletion.create(
-            model="gpt-3.5-turbo",
-            messages=[
-                {"role": "system", "content": "You are an expert interviewer for technical positions. Generate diverse, challenging, and realistic interview questions."},
-                {"role": "user", "content": prompt}
-            ],
-            temperature=0.7,
-        )
-
-        # Parse the response to extract questions
-        content = response.choices[0].message.content
-        try:
-            # Try to parse as JSON directly
-            questions = json.loads(content)
-        except json.JSONDecodeError:
-            # If not valid JSON, extract JSON part from the text
-            start_idx = content.find('[')
-            end_idx = content.rfind(']') + 1
-            if start_idx != -1 and end_idx != -1:
-                questions_json = content[start_idx:end_idx]
-                questions = json.loads(questions_json)
-            else:
-                # Fallback: create structured questions from text
-                lines = content.split('\n')
-                questions = []
-                current_question = {}
-
-                for line in lines:
-                    if line.strip() and ':' in line:
-                        if line.lower().startswith('question'):
-                            if current_question and 'question' in current_question:
-                                questions.append(current_question)
-                            current_question = {'type': 'general', 'question': line.split(':', 1)[1].strip()}
-                        elif 'type' in line.lower():
-                            q_type = line.split(':', 1)[1].strip().lower()
-                            if 'technical' in q_type:
-                                current_question['type'] = 'technical'
-                            elif 'behavioral' in q_type:
-                                current_question['type'] = 'behavioral'
-                            elif 'situational' in q_type:
-                                current_question['type'] = 'situational'
-                            elif 'coding' in q_type:
-                                current_question['type'] = 'coding'
-                        elif 'language' in line.lower() and 'coding' in current_question.get('type', ''):
-                            current_question['language'] = line.split(':', 1)[1].strip()
-                        elif 'difficulty' in line.lower():
-                            current_question['difficulty'] = line.split(':', 1)[1].strip().lower()
-
-                if current_question and 'question' in current_question:
-                    questions.append(current_question)
-
-        # Store questions in session for reuse in practice page
-        session['practice_questions'] = questions
+        question_params = {
+            "job_title": job_title,
+            "experience_level": experience_level,
+            "question_types": question_types,
+            "coding_languages": coding_languages,
+            "num_questions": num_questions,
+            "difficulty": difficulty
+        }
+        # Assemble from the question bank, falling back to pooled or live generation
+        questions = take_question_set('practice', question_params, current_user.id)
+
+        # Store questions server-side for the practice page; the session keeps only the id
+        session['practice_session_id'] = save_practice_session(current_user.id, questions)
+        session.pop('practice_questions', None)
 
         return jsonify({"questions": questions})
+    except llm_client.LLMBusyError as e:
+        return busy_response(e)
     except Exception as e:
-        print(f"Error generating practice questions: {str(e)}")
+        logger.exception("Error generating practice questions")
         return jsonify({"error": str(e)}), 500
 
-@app.route('/api/check-answer', methods=['POST'])
-@login_required
-def check_answer():
-    """Check practice answer using OpenAI"""
-    data = request.json
-    question = data.get('question', {})
-    answer = data.get('answer', '')
-
-    try:
-        # Build prompt based on question type
-        prompt = f"""Question: {question.get('question')}
+def build_check_answer_messages(question, answer, test_report=None):
+    """Build the chat messages for evaluating a practice answer"""
+    # Build prompt based on question type
+    prompt = f"""Question: {question.get('question')}
         Question Type: {question.get('type')}
         User's Answer: {answer}
 
@@ -823,31 +1282,147 @@ def check_answer():
         Where X is a number between 0 and 100 representing the correctness of the answer.
         """
 
+    if test_report:
+        # Correctness comes from the test run; the model only explains it
+        prompt += f"""
+        The answer was run against {test_report['total']} test cases and passed {test_report['passed']}.
+        Test results: {json.dumps(summarize_test_report(test_report))}
+
+        Use X = {test_report['score']}. Focus the explanation and suggestions on why tests failed,
+        code quality and complexity.
+        """
+
+    return [
+        {"role": "system", "content": "You are an expert at evaluating interview responses. Provide constructive feedback to help the user improve."},
+        {"role": "user", "content": prompt}
+    ]
+
+def summarize_test_report(test_report):
+    """The parts of a test report worth showing the model"""
+    if test_report.get('error'):
+        return {"error": test_report['error']}
+    return [
+        {key: test[key] for key in ('args', 'expected', 'actual', 'status', 'error') if key in test}
+        for test in test_report['tests']
+    ]
+
+def parse_check_answer_content(content, test_report=None):
+    """Parse the model output of a practice answer evaluation"""
+    feedback = llm_parsing.parse_structured(content, 'answer_feedback')
+
+    if test_report:
+        # Coding answers are scored by their test results, never by the model
+        feedback['correctness'] = test_report['score']
+        return {"feedback": feedback, "score": test_report['score'], "tests": test_report}
+
+    # Calculate score (0-100)
+    score = feedback.get('correctness', 0)
+
+    return {"feedback": feedback, "score": score}
+
+def test_only_result(test_report):
+    """Result of a coding answer graded by its tests alone, for when the model cannot be reached"""
+    feedback = {
+        "correctness": test_report['score'],
+        "explanation": f"Passed {test_report['passed']} of {test_report['total']} test cases. "
+                       "Detailed feedback is unavailable right now, please check again later.",
+        "suggestions": []
+    }
+    return {"feedback": feedback, "score": test_report['score'], "tests": test_report, "degraded": True}
+
+def build_test_suite_messages(question):
+    """Build the chat messages for writing test cases for a coding question"""
+    prompt = f"""Coding question: {question}
+
+        Write {grading.TEST_CASES_PER_QUESTION} test cases for a function that solves this question,
+        covering typical inputs and edge cases, and a reference solution in Python.
+
+        Format your response as a JSON object with these fields:
+        {{"function_name": "snake_case_name", "reference_solution": "def snake_case_name(...): ...",
+          "test_cases": [{{"args": [argument, ...], "expected": return_value}}, ...]}}
+
+        Arguments and return values must be plain JSON values (numbers, strings, booleans, null, arrays, objects).
+        """
+
+    return [
+        {"role": "system", "content": "You are an expert at writing precise, deterministic test cases for coding interview questions."},
+        {"role": "user", "content": prompt}
+    ]
+
+def generate_test_suite(question):
+    """Generate test cases for a coding question, keeping only those its reference solution passes"""
+    content = llm_client.chat_completion(messages=build_test_suite_messages(question), temperature=0.2)
+    suite = llm_parsing.parse_structured(content, 'test_suite')
+
+    reference_solution = suite.get('reference_solution')
+    candidate = {"function_name": suite.get('function_name'), "test_cases": grading.valid_test_cases(suite.get('test_cases'))}
+    if not candidate['function_name'] or not candidate['test_cases'] or not reference_solution:
+        return None
+
+    # Expected values the model got wrong would make grading unfair
+    report = grading.grade(code_runs, 'python', reference_solution, candidate)
+    if report is None:
+        return None
+    test_cases = [test_case for test_case, test in zip(candidate['test_cases'], report['tests']) if test['passed']]
+    if not test_cases:
+        return None
+    return {"function_name": candidate['function_name'], "test_cases": test_cases}
+
+def coding_test_report(question, answer, language=None):
+    """Grade a coding answer against the question's test cases; None when it cannot be graded that way"""
+    if question.get('type') != 'coding' or not (answer or '').strip() or not question.get('question'):
+        return None
+
+    language = language or question.get('language') or 'python'
+    try:
+        # Suites are checked against a Python reference solution, so both must be runnable
+        # before paying for the test-suite call
+        code_runs.resolve(language)
+        code_runs.resolve('python')
+    except code_runner.UnsupportedLanguageError:
+        return None
+
+    try:
+        suite = test_suites.get(question['question'])
+        if suite is None:
+            suite = generate_test_suite(question['question'])
+            if suite is None:
+                return None
+            suite = test_suites.save(question['question'], suite)
+        return grading.grade(code_runs, language, answer, suite)
+    except Exception:
+        db.session.rollback()
+        logger.exception("Error running test cases")
+        return None
+
+@app.route('/api/check-answer', methods=['POST'])
+@login_required
+def check_answer():
+    """Check a practice answer: coding answers run against test cases, OpenAI gives the feedback"""
+    data = request.json
+    question = data.get('question', {})
+    answer = data.get('answer', '')
+    test_report = coding_test_report(question, answer, data.get('language'))
+    messages = build_check_answer_messages(question, answer, test_report)
+    finish = partial(parse_check_answer_content, test_report=test_report)
+
+    if wants_event_stream():
+        return stream_llm_response(messages, finish)
+
+    try:
         # Generate feedback using OpenAI
-        response = openai.ChatCompletion.create(
-            model="gpt-3.5-turbo",
-            messages=[
-                {"role": "system", "content": "You are an expert at evaluating interview responses. Provide constructive feedback to help the user improve."},
-                {"role": "user", "content": prompt}
-            ],
+        content = llm_client.chat_completion(
+            messages=messages,
             temperature=0.7,
         )
 
-        # Parse the response
-        content = response.choices[0].message.content
-        try:
-            # Try to parse as JSON
-            feedback = json.loads(content)
-        except json.JSONDecodeError:
-            # If not valid JSON, return as text
-            feedback = {"explanation": content}
-
-        # Calculate score (0-100)
-        score = feedback.get('correctness', 0)
-
-        return jsonify({"feedback": feedback, "score": score})
+        return jsonify(finish(content))
+    except llm_client.LLMBusyError as e:
+        if test_report:
+            return jsonify(test_only_result(test_report))
+        return busy_response(e)
     except Exception as e:
-        print(f"Error checking answer: {str(e)}")
+        logger.exception("Error checking answer")
         return jsonify({"error": str(e)}), 500
 
 @app.route('/learn-code')
@@ -859,49 +1434,50 @@ def learn_code():
 @app.route('/api/run-code', methods=['POST'])
 @login_required
 def run_code():
-    """Run code in a sandbox environment"""
+    """Run code in a jailed worker process"""
     data = request.json
     code = data.get('code', '')
     language = data.get('language', 'python')
 
     try:
-        # For security reasons, we'll just simulate code execution
-        # In a real app, you would use a secure sandbox environment
-
-        # Simulate output based on language and code
-        if language == 'python':
-            output = f"Python code execution simulated:\n\n```python\n{code}\n```\n\nIn a real environment, your code would run here."
-        elif language == 'javascript':
-            output = f"JavaScript code execution simulated:\n\n```javascript\n{code}\n```\n\nIn a real environment, your code would run here."
-        else:
-            output = f"{language.capitalize()} code execution simulated:\n\n```{language}\n{code}\n```\n\nIn a real environment, your code would run here."
-
-        return jsonify({"output": output})
+        result = code_runs.run(language, code, stdin=data.get('stdin', ''))
+    except code_runner.UnsupportedLanguageError as e:
+        return jsonify({"error": str(e), "languages": code_runs.supported_languages()}), 400
+    except code_runner.CodeRunnerBusyError as e:
+        return jsonify({"error": str(e)}), 503
     except Exception as e:
-        print(f"Error running code: {str(e)}")
+        logger.exception("Error running code")
         return jsonify({"error": str(e)}), 500
 
-@app.route('/api/explain-code', methods=['POST'])
-@login_required
-def explain_code():
-    """Explain code using OpenAI"""
-    data = request.json
-    code = data.get('code', '')
-    language = data.get('language', 'python')
-    explain_type = data.get('explain_type', 'detailed')
-
-    try:
-        # Build prompt based on explanation type
-        if explain_type == 'basic':
-            prompt = f"""Explain this {language} code in a simple way:
+    result["output"] = format_run_output(result)
+    return jsonify(result)
+
+def format_run_output(result):
+    """Combine a run's streams and outcome into the text shown under the editor"""
+    parts = [result["stdout"]]
+    if result["stderr"]:
+        parts.append(result["stderr"])
+    if result["status"] == 'timeout':
+        parts.append("Stopped: time limit exceeded")
+    elif result["status"] == 'output_limit':
+        parts.append("Stopped: output limit exceeded")
+    elif result["status"] == 'error':
+        parts.append(f"Exited with code {result['exit_code']}")
+    return '\n'.join(part.rstrip('\n') for part in parts if part)
+
+def build_explain_code_messages(code, language, explain_type):
+    """Build the chat messages for explaining a code snippet"""
+    # Build prompt based on explanation type
+    if explain_type == 'basic':
+        prompt = f"""Explain this {language} code in a simple way:
 
 ```{language}
 {code}
 ```
 
 Provide a brief overview and explain what the code does."""
-        elif explain_type == 'advanced':
-            prompt = f"""Provide an advanced explanation of this {language} code:
+    elif explain_type == 'advanced':
+        prompt = f"""Provide an advanced explanation of this {language} code:
 
 ```{language}
 {code}
@@ -916,8 +1492,8 @@ Include:
 6. Variable tracking showing how each variable changes throughout execution
 
 Format your response as a JSON object with these sections."""
-        else:  # detailed (default)
-            prompt = f"""Explain this {language} code in detail:
+    else:  # detailed (default)
+        prompt = f"""Explain this {language} code in detail:
 
 ```{language}
 {code}
@@ -942,44 +1518,244 @@ Format your response as a JSON object with these fields:
     }}
 }}]}}"""
 
+    return [
+        {"role": "system", "content": "You are an expert programming tutor. Explain code clearly and accurately, tracking variables and their values throughout execution."},
+        {"role": "user", "content": prompt}
+    ]
+
+def parse_explanation_content(content):
+    """Parse the model output of a code explanation"""
+    explanation = llm_parsing.parse_structured(content, 'code_explanation')
+
+    # Extract variable tracking if available
+    variable_tracking = explanation.get('variable_tracking', None)
+
+    return {"explanation": explanation, "variable_tracking": variable_tracking}
+
+@app.route('/api/explain-code', methods=['POST'])
+@login_required
+def explain_code():
+    """Explain code using OpenAI"""
+    data = request.json
+    code = data.get('code', '')
+    language = data.get('language', 'python')
+    explain_type = data.get('explain_type', 'detailed')
+    messages = build_explain_code_messages(code, language, explain_type)
+    # Advanced explanations with variable tracking take much longer
+    timeout = 120 if explain_type == 'advanced' else None
+
+    if wants_event_stream():
+        return stream_llm_response(messages, parse_explanation_content, timeout=timeout)
+
+    try:
         # Generate explanation using OpenAI
-        response = openai.ChatCompletion.create(
-            model="gpt-3.5-turbo",
-            messages=[
-                {"role": "system", "content": "You are an expert programming tutor. Explain code clearly and accurately, tracking variables and their values throughout execution."},
-                {"role": "user", "content": prompt}
-            ],
+        content = llm_client.chat_completion(
+            messages=messages,
             temperature=0.7,
+            timeout=timeout,
         )
 
-        # Parse the response
-        content = response.choices[0].message.content
+        return jsonify(parse_explanation_content(content))
+    except llm_client.LLMBusyError as e:
+        return busy_response(e)
+    except Exception as e:
+        logger.exception("Error explaining code")
+        return jsonify({"error": str(e)}), 500
+
+# Longest time a status request may wait for a job to finish
+JOB_MAX_WAIT_SECONDS = 30
+
+def run_generate_questions_job(payload):
+    """Generate interview questions in the background"""
+    questions = generate_interview_questions(
+        payload.get('job_title', ''),
+        payload.get('experience_level', ''),
+        payload.get('question_types', []),
+        int(payload.get('num_questions', 5))
+    )
+    if not questions:
+        raise RuntimeError("No questions were generated")
+    return {"questions": questions}
+
+def run_analyze_response_job(payload):
+    """Analyze an interview response in the background and save it"""
+    question = payload.get('question', '')
+    question_type = payload.get('question_type', 'general')
+    analysis = compute_analysis(question, payload.get('response', ''))
+
+    interview_id = payload.get('interview_id')
+    if interview_id and question:
+        save_response_analysis(interview_id, question, question_type, analysis)
+
+    return {"analysis": analysis}
+
+def run_check_answer_job(payload):
+    """Grade a practice answer in the background"""
+    question = payload.get('question', {})
+    answer = payload.get('answer', '')
+    test_report = coding_test_report(question, answer, payload.get('language'))
+    try:
+        content = llm_client.chat_completion(
+            messages=build_check_answer_messages(question, answer, test_report),
+            temperature=0.7,
+        )
+    except llm_client.LLMUnavailableError:
+        if test_report:
+            return test_only_result(test_report)
+        raise
+    return parse_check_answer_content(content, test_report)
+
+question_sets.register('interview', generate_interview_questions)
+question_sets.register('practice', generate_practice_questions)
+
+@app.cli.command('seed-question-bank')
+def seed_question_bank():
+    """Add the questions of every stored question set and interview to the bank"""
+    added = 0
+    for question_set in QuestionSet.query.yield_per(200):
+        params = json.loads(question_set.params)
+        added += questions_bank.add(
+            json.loads(question_set.questions), params.get('job_title', ''), params.get('experience_level', ''),
+            source=question_set.kind, difficulty=params.get('difficulty'))
+    for interview in Interview.query.filter(Interview.questions.isnot(None)).yield_per(200):
+        added += questions_bank.add(
+            json.loads(interview.questions), interview.job_title, interview.experience_level, source='interview')
+    db.session.commit()
+    questions_bank.sync_index()
+    print(f"Added {added} question(s) to the bank")
+
+@app.cli.command('rebuild-similarity-index')
+def rebuild_similarity_index():
+    """Re-vectorize every bank question into a fresh similarity index"""
+    question_index.reset()
+    indexed = questions_bank.sync_index()
+    print(f"Indexed {indexed} question(s)")
+
+@app.route('/api/question-bank/assemble', methods=['POST'])
+@login_required
+def assemble_question_set():
+    """Assemble a question set from the bank without calling the LLM"""
+    data = request.json or {}
+    num_questions = int(data.get('num_questions', 5))
+    questions = questions_bank.assemble(
+        data.get('job_title', ''),
+        data.get('experience_level', ''),
+        data.get('question_types', []),
+        num_questions,
+        difficulty=data.get('difficulty'),
+        languages=data.get('coding_languages'),
+        answered=answered_questions(current_user.id)
+    )
+    return jsonify({"questions": questions, "complete": len(questions) >= num_questions})
+
+@app.route('/api/question-bank/search')
+@login_required
+def search_question_bank():
+    """Full-text search over the question bank"""
+    query_text = request.args.get('q', '')
+    limit = min(request.args.get('limit', 20, type=int), 100)
+    return jsonify({"questions": questions_bank.search(query_text, limit)})
+
+@app.route('/api/question-bank/similar')
+@login_required
+def similar_questions():
+    """Bank questions most similar to the given text"""
+    query_text = request.args.get('q', '')
+    limit = min(request.args.get('limit', 10, type=int), 100)
+    return jsonify({"questions": questions_bank.similar(query_text, limit)})
+
+@app.cli.command('warm-question-sets')
+def warm_question_sets():
+    """Top up the question pool of every setup combination seen so far"""
+    warmed = question_sets.warm()
+    print(f"Warmed {warmed} question pool(s)")
+
+@app.cli.command('backfill-scores')
+@click.option('--all', 'rescore_all', is_flag=True, help='Rescore every analyzed response, not only unscored ones')
+def backfill_scores(rescore_all):
+    """Compute numeric scores for stored analyses and refresh interview scores"""
+    query = db.session.query(Response.id, Response.analysis).filter(Response.analysis.isnot(None))
+    if not rescore_all:
+        query = query.filter(Response.score.is_(None))
+
+    updates = []
+    for response_id, raw_analysis in query.yield_per(500):
         try:
-            # Try to parse as JSON
-            explanation = json.loads(content)
+            analysis = json.loads(raw_analysis)
         except json.JSONDecodeError:
-            # If not valid JSON, extract JSON part from the text
-            start_idx = content.find('{')
-            end_idx = content.rfind('}') + 1
-            if start_idx != -1 and end_idx != -1:
-                json_str = content[start_idx:end_idx]
-                try:
-                    explanation = json.loads(json_str)
-                except json.JSONDecodeError:
-                    # If still not valid JSON, return as text
-                    explanation = {"overview": content}
-            else:
-                # If no JSON structure found, return as text
-                explanation = {"overview": content}
-
-        # Extract variable tracking if available
-        variable_tracking = explanation.get('variable_tracking', None)
-
-        return jsonify({"explanation": explanation, "variable_tracking": variable_tracking})
+            analysis = {"text": raw_analysis}
+        updates.append({"id": response_id, "score": scoring.score_analysis(analysis)})
+
+    for start in range(0, len(updates), 500):
+        db.session.bulk_update_mappings(Response, updates[start:start + 500])
+    refresh_interview_scores()
+    user_analytics.rebuild()
+    db.session.commit()
+    print(f"Scored {len(updates)} response(s)")
+
+@app.cli.command('rebuild-analytics')
+def rebuild_analytics():
+    """Recompute every user's dashboard rollups from the interview and response tables"""
+    user_analytics.rebuild()
+    db.session.commit()
+    print("Rebuilt user analytics")
+
+job_queue.register('generate_questions', run_generate_questions_job, llm_client.PRIORITY_NORMAL)
+job_queue.register('analyze_response', run_analyze_response_job, llm_client.PRIORITY_HIGH)
+job_queue.register('check_answer', run_check_answer_job, llm_client.PRIORITY_NORMAL)
+
+@app.route('/api/jobs', methods=['POST'])
+@login_required
+def submit_job():
+    """Queue LLM work as a background job and return its id"""
+    data = request.json or {}
+    kind = data.get('kind')
+    payload = data.get('payload', {})
+
+    if kind not in job_queue.handlers:
+        return jsonify({"error": f"Unknown job kind: {kind}"}), 400
+
+    if kind == 'analyze_response':
+        # Bind the analysis to the interview that is active right now
+        payload['interview_id'] = session.get('current_interview_id')
+
+    try:
+        job = job_queue.submit(kind, payload, user_id=current_user.id)
+        return jsonify(job.to_dict()), 202
     except Exception as e:
-        print(f"Error explaining code: {str(e)}")
+        logger.exception("Error submitting job")
         return jsonify({"error": str(e)}), 500
 
+@app.route('/api/jobs/<int:job_id>', methods=['GET'])
+@login_required
+def get_job(job_id):
+    """Get the status and result of a job, optionally waiting for it to finish"""
+    job = Job.query.get(job_id)
+    if not job or job.user_id != current_user.id:
+        return jsonify({"error": "Job not found"}), 404
+
+    # Unparseable values count as no wait
+    wait = max(0.0, min(request.args.get('wait', 0.0, type=float), JOB_MAX_WAIT_SECONDS))
+    if wait > 0:
+        job = job_queue.wait(job, wait)
+
+    return jsonify(job.to_dict())
+
+@app.route('/api/analysis-cache/stats', methods=['GET'])
+@login_required
+def analysis_cache_stats():
+    """Report hit/miss counters for the response analysis cache"""
+    return jsonify(response_analysis_cache.stats())
+
+@app.route('/api/parse-stats', methods=['GET'])
+@login_required
+def parse_stats():
+    """Report how often model output parsed cleanly, needed repair or failed"""
+    return jsonify(llm_parsing.parse_stats())
+
 if __name__ == '__main__':
+    # Bring the local database up to date before serving
+    with app.app_context():
+        upgrade()
     app.run(host="0.0.0.0", port=10000, debug=True)
 
@@ -0,0 +1,554 @@
+"""Jailed code execution on pools of pre-started, single-use interpreter processes"""
+import os
+import sys
+import time
+import errno
+import shutil
+import signal
+import tempfile
+import selectors
+import subprocess
+import logging
+import threading
+from collections import deque
+
+try:
+    import resource
+except ImportError:  # Windows: runs are still bounded by the wall-clock limit
+    resource = None
+
+logger = logging.getLogger(__name__)
+
+# Runner settings (override through environment variables)
+CODE_RUN_TIME_LIMIT = float(os.getenv("CODE_RUN_TIME_LIMIT", "5"))      # wall-clock seconds
+CODE_RUN_CPU_LIMIT = int(os.getenv("CODE_RUN_CPU_LIMIT", "5"))          # CPU seconds
+CODE_RUN_MEMORY_MB = int(os.getenv("CODE_RUN_MEMORY_MB", "256"))
+CODE_RUN_MAX_OUTPUT = int(os.getenv("CODE_RUN_MAX_OUTPUT", "65536"))    # bytes kept per stream
+CODE_RUN_MAX_SOURCE = int(os.getenv("CODE_RUN_MAX_SOURCE", "65536"))    # bytes of code or stdin
+CODE_RUN_WARM_WORKERS = int(os.getenv("CODE_RUN_WARM_WORKERS", "2"))    # idle workers per language
+CODE_RUN_MAX_CONCURRENT = int(os.getenv("CODE_RUN_MAX_CONCURRENT", str(os.cpu_count() or 2)))
+CODE_RUN_QUEUE_TIMEOUT = float(os.getenv("CODE_RUN_QUEUE_TIMEOUT", "10"))
+CODE_RUN_MAX_FILE_BYTES = 1024 * 1024
+CODE_RUN_MAX_OPEN_FILES = 64
+# auto: bubblewrap if installed, else Linux namespaces via unshare (needs root); none runs code
+# unjailed and is only meant for local development
+CODE_RUN_SANDBOX = os.getenv("CODE_RUN_SANDBOX", "auto")
+# Unprivileged account the submitted code runs as
+CODE_RUN_UID = int(os.getenv("CODE_RUN_UID", "65534"))
+CODE_RUN_GID = int(os.getenv("CODE_RUN_GID", "65534"))
+# RLIMIT_NPROC is counted per uid, so this bounds the processes and threads of all runs on the host together
+CODE_RUN_MAX_PROCESSES = int(os.getenv("CODE_RUN_MAX_PROCESSES", "256"))
+
+# Read-only host paths visible inside the jail (the interpreters are added to these)
+JAIL_READ_ONLY_PATHS = ['/usr', '/bin', '/lib', '/lib64', '/lib32', '/etc/ld.so.cache', '/etc/alternatives']
+
+# Applies the resource limits, then execs the jail; every process started inside inherits them
+LIMITS_BOOT = (
+    "import os, sys, resource\n"
+    "names = ('CPU', 'DATA', 'FSIZE', 'NOFILE', 'NPROC', 'CORE')\n"
+    "for name, value in zip(names, sys.argv[1:7]):\n"
+    "    soft, hard = (int(part) for part in value.split(':'))\n"
+    "    resource.setrlimit(getattr(resource, 'RLIMIT_' + name), (soft, hard))\n"
+    "os.execv(sys.argv[7], sys.argv[7:])\n"
+)
+# Runs as root inside fresh mount, pid, network, IPC and UTS namespaces: builds a root
+# filesystem from read-only binds plus the scratch directory, then drops to the unprivileged
+# uid with no capabilities before starting the interpreter
+NAMESPACE_JAIL = r"""
+set -e
+root=$1 work=$2 uid=$3 gid=$4 paths=$5 chroot=$6 setpriv=$7
+shift 7
+mount -t tmpfs -o size=4m,mode=755,nosuid,nodev tmpfs "$root"
+IFS=:
+for path in $paths; do
+    [ -e "$path" ] || continue
+    if [ -d "$path" ]; then mkdir -p "$root$path"; else mkdir -p "$root${path%/*}"; touch "$root$path"; fi
+    mount --rbind "$path" "$root$path"
+    mount -o remount,bind,ro,nosuid,nodev "$root$path"
+done
+unset IFS
+mkdir -p "$root/sandbox" "$root/proc" "$root/tmp" "$root/dev"
+mount --bind "$work" "$root/sandbox"
+mount -o remount,bind,nosuid,nodev "$root/sandbox"
+mount -t proc -o nosuid,nodev,noexec proc "$root/proc"
+mount -t tmpfs -o size=16m,mode=1777,nosuid,nodev tmpfs "$root/tmp"
+for device in null zero random urandom; do
+    touch "$root/dev/$device"
+    mount --bind "/dev/$device" "$root/dev/$device"
+done
+mount -o remount,ro,bind "$root"
+exec "$chroot" "$root" "$setpriv" --reuid="$uid" --regid="$gid" --clear-groups \
+    --inh-caps=-all --bounding-set=-all --no-new-privs \
+    /bin/sh -c 'cd /sandbox && exec "$@"' sh "$@"
+"""
+
+# Each worker boots its interpreter, then blocks until the go line arrives on stdin.
+# Everything after that line is the program's own stdin.
+PYTHON_BOOT = (
+    "import sys\n"
+    "sys.stdin.buffer.readline()\n"
+    "sys.argv = ['solution.py']\n"
+    "try:\n"
+    "    with open('solution.py', 'rb') as source:\n"
+    "        program = compile(source.read(), 'solution.py', 'exec')\n"
+    "    exec(program, {'__name__': '__main__', '__file__': 'solution.py'})\n"
+    "except Exception as error:\n"
+    "    import traceback\n"
+    "    traceback.print_exception(type(error), error, error.__traceback__.tb_next)\n"
+    "    sys.exit(1)\n"
+)
+NODE_BOOT = (
+    "const fs = require('fs');"
+    "const byte = Buffer.alloc(1);"
+    "while (fs.readSync(0, byte, 0, 1, null) === 1 && byte[0] !== 10) {}"
+    "process.argv = [process.argv[0], 'solution.js'];"
+    "require(require('path').resolve('solution.js'));"
+)
+
+
+class CodeRunnerError(Exception):
+    """Raised when code could not be run"""
+
+
+class CodeRunnerBusyError(CodeRunnerError):
+    """Raised when no run slot frees up within CODE_RUN_QUEUE_TIMEOUT"""
+
+
+class UnsupportedLanguageError(CodeRunnerError):
+    """Raised for languages with no interpreter available"""
+
+
+class Language:
+    """How to start a worker for one language"""
+
+    def __init__(self, name, filename, command, aliases=()):
+        self.name = name
+        self.filename = filename
+        # The jail has no PATH lookup of its own, so the interpreter is resolved here
+        executable = shutil.which(command[0])
+        self.command = [os.path.realpath(executable)] + command[1:] if executable else command
+        self.aliases = aliases
+
+    @property
+    def available(self):
+        return os.path.isabs(self.command[0])
+
+    @property
+    def install_paths(self):
+        """Host directories the interpreter needs to see inside the jail"""
+        prefix = os.path.dirname(os.path.dirname(self.command[0]))
+        if self.name == 'python':
+            return [prefix, sys.prefix, sys.base_prefix]
+        return [prefix]
+
+
+def default_languages(memory_mb=CODE_RUN_MEMORY_MB):
+    return [
+        # -I ignores user site-packages and PYTHON* variables, -S skips site imports
+        Language('python', 'solution.py', [sys.executable, '-I', '-S', '-c', PYTHON_BOOT], ('python3', 'py')),
+        Language('javascript', 'solution.js', ['node', f'--max-old-space-size={memory_mb}', '-e', NODE_BOOT],
+                 ('js', 'node', 'nodejs')),
+    ]
+
+
+class BubblewrapJail:
+    """Unprivileged jail from bubblewrap: new user, pid, network, IPC and UTS namespaces,
+    a read-only view of the system and the scratch directory as the only writable path"""
+    name = 'bubblewrap'
+
+    @staticmethod
+    def available():
+        return shutil.which('bwrap') is not None
+
+    def command(self, command, root, work, read_only_paths):
+        jail = [shutil.which('bwrap'), '--unshare-all', '--die-with-parent', '--new-session',
+                '--cap-drop', 'ALL', '--hostname', 'sandbox']
+        for path in read_only_paths:
+            jail += ['--ro-bind-try', path, path]
+        jail += ['--bind', work, '/sandbox', '--chdir', '/sandbox', '--proc', '/proc', '--dev', '/dev',
+                 '--tmpfs', '/tmp', '--uid', str(CODE_RUN_UID), '--gid', str(CODE_RUN_GID), '--']
+        return jail + command
+
+    def popen_options(self):
+        # As root, bubblewrap itself starts as the unprivileged uid so RLIMIT_NPROC applies
+        if os.geteuid() == 0:
+            return {"user": CODE_RUN_UID, "group": CODE_RUN_GID, "extra_groups": []}
+        return {}
+
+
+class NamespaceJail:
+    """Jail built from util-linux (unshare, chroot, setpriv) for hosts without bubblewrap; needs root"""
+    name = 'namespaces'
+
+    @staticmethod
+    def available():
+        return (hasattr(os, 'geteuid') and os.geteuid() == 0
+                and all(shutil.which(tool) for tool in ('unshare', 'chroot', 'setpriv', 'mount'))
+                and shutil.which('setpriv').startswith('/usr/'))
+
+    def command(self, command, root, work, read_only_paths):
+        return [shutil.which('unshare'), '--mount', '--pid', '--fork', '--net', '--ipc', '--uts',
+                '/bin/sh', '-c', NAMESPACE_JAIL, 'jail', root, work, str(CODE_RUN_UID), str(CODE_RUN_GID),
+                ':'.join(read_only_paths), shutil.which('chroot'), shutil.which('setpriv')] + command
+
+    def popen_options(self):
+        return {}
+
+
+class NoJail:
+    """Runs code as the app user with resource limits only; for local development"""
+    name = 'none'
+
+    @staticmethod
+    def available():
+        return True
+
+    def command(self, command, root, work, read_only_paths):
+        return command
+
+    def popen_options(self):
+        return {}
+
+
+def default_jail():
+    """The jail CODE_RUN_SANDBOX asks for, or None when none is available"""
+    if CODE_RUN_SANDBOX == 'none':
+        logger.warning("CODE_RUN_SANDBOX=none: submitted code runs without a jail")
+        return NoJail()
+    candidates = {'bubblewrap': [BubblewrapJail], 'namespaces': [NamespaceJail]}.get(
+        CODE_RUN_SANDBOX, [BubblewrapJail, NamespaceJail])
+    for jail in candidates:
+        if jail.available():
+            return jail()
+    logger.error("No code sandbox available (install bubblewrap); running code is disabled")
+    return None
+
+
+class Worker:
+    """A started interpreter in its own jail and scratch directory, waiting for one program"""
+
+    def __init__(self, language, process, base, directory):
+        self.language = language
+        self.process = process
+        self.base = base
+        self.directory = directory
+
+    @property
+    def alive(self):
+        return self.process.poll() is None
+
+    def discard(self):
+        # Even after the interpreter exits, processes it started may still hold the jail open
+        _kill_tree(self.process)
+        self.process.wait()
+        for stream in (self.process.stdin, self.process.stdout, self.process.stderr):
+            if stream:
+                stream.close()
+        shutil.rmtree(self.base, ignore_errors=True)
+
+
+class CodeRunner:
+    """Runs untrusted snippets in a jail with CPU, memory, process, file and wall-clock limits.
+
+    The jail (bubblewrap, or namespaces set up through unshare) gives every
+    worker its own pid and network namespace, a read-only view of the system
+    with only its scratch directory writable, and an unprivileged uid. Without
+    a jail no language is offered unless CODE_RUN_SANDBOX=none.
+
+    Every language keeps a few warm workers whose interpreter has already
+    started, so a run only pays for the program itself. A worker runs exactly
+    one program and is then killed, with everything it started, and replaced
+    in the background."""
+
+    def __init__(self, languages=None, warm_workers=CODE_RUN_WARM_WORKERS, max_concurrent=CODE_RUN_MAX_CONCURRENT,
+                 time_limit=CODE_RUN_TIME_LIMIT, cpu_limit=CODE_RUN_CPU_LIMIT, memory_mb=CODE_RUN_MEMORY_MB,
+                 max_output=CODE_RUN_MAX_OUTPUT, jail=None):
+        languages = default_languages(memory_mb) if languages is None else languages
+        self.jail = jail or default_jail()
+        if self.jail is None:
+            languages = []
+        self.languages = {language.name: language for language in languages if language.available}
+        self.aliases = {alias: name for name, language in self.languages.items() for alias in language.aliases}
+        self.warm_workers = warm_workers
+        self.time_limit = time_limit
+        self.cpu_limit = cpu_limit
+        self.memory_mb = memory_mb
+        self.max_output = max_output
+        self._slots = threading.BoundedSemaphore(max_concurrent)
+        self._idle = {name: deque() for name in self.languages}
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._started = False
+        self._closed = False
+
+    def supported_languages(self):
+        return sorted(self.languages)
+
+    def resolve(self, language):
+        """Canonical language name, or raise UnsupportedLanguageError"""
+        name = (language or '').strip().lower()
+        name = self.aliases.get(name, name)
+        if not self.languages:
+            raise UnsupportedLanguageError("Running code is not available on this server")
+        if name not in self.languages:
+            raise UnsupportedLanguageError(f"Running {language} code is not supported")
+        return name
+
+    def run(self, language, code, stdin='', time_limit=None):
+        """Run code and return its captured output, exit code and timing"""
+        name = self.resolve(language)
+        source = (code or '').encode('utf-8')
+        program_input = (stdin or '').encode('utf-8')
+        if len(source) > CODE_RUN_MAX_SOURCE or len(program_input) > CODE_RUN_MAX_SOURCE:
+            raise CodeRunnerError(f"Code and input are limited to {CODE_RUN_MAX_SOURCE} bytes each")
+
+        if not self._slots.acquire(timeout=CODE_RUN_QUEUE_TIMEOUT):
+            raise CodeRunnerBusyError("Too many code runs in progress, please try again shortly")
+
+        self.ensure_started()
+        try:
+            worker = self._take_worker(name)
+            try:
+                return self._execute(worker, source, program_input, time_limit or self.time_limit)
+            finally:
+                worker.discard()
+                self._wakeup.set()
+        finally:
+            self._slots.release()
+
+    def ensure_started(self):
+        """Start the thread that keeps the warm pools topped up"""
+        with self._lock:
+            if self._started:
+                return
+            self._started = True
+        threading.Thread(target=self._refill_loop, name="code-runner-refill", daemon=True).start()
+        self._wakeup.set()
+
+    def shutdown(self):
+        """Kill every idle worker"""
+        with self._lock:
+            self._closed = True
+            idle = [worker for workers in self._idle.values() for worker in workers]
+            for workers in self._idle.values():
+                workers.clear()
+        # Lets the refill thread see _closed and exit
+        self._wakeup.set()
+        for worker in idle:
+            worker.discard()
+
+    def _take_worker(self, name):
+        with self._lock:
+            workers = self._idle[name]
+            while workers:
+                worker = workers.popleft()
+                if worker.alive:
+                    return worker
+                worker.discard()
+        # Pool drained: start one now and pay the interpreter startup in this run
+        return self._spawn(name)
+
+    def _refill_loop(self):
+        while not self._closed:
+            self._wakeup.wait()
+            self._wakeup.clear()
+            for name in self.languages:
+                while len(self._idle[name]) < self.warm_workers:
+                    try:
+                        worker = self._spawn(name)
+                    except Exception:
+                        logger.exception("Error starting code worker", extra={"language": name})
+                        break
+                    with self._lock:
+                        if not self._closed:
+                            self._idle[name].append(worker)
+                            continue
+                    # Shut down while this worker was starting
+                    worker.discard()
+                    return
+
+    def _spawn(self, name):
+        language = self.languages[name]
+        base = tempfile.mkdtemp(prefix=f"run-{name}-")
+        root = os.path.join(base, 'root')
+        work = os.path.join(base, 'work')
+        os.mkdir(root)
+        os.mkdir(work, 0o700)
+        os.chmod(base, 0o755)
+        jailed = not isinstance(self.jail, NoJail)
+        if jailed and os.geteuid() == 0:
+            # Only the scratch directory belongs to the uid the code runs as
+            os.chown(work, CODE_RUN_UID, CODE_RUN_GID)
+
+        read_only_paths = JAIL_READ_ONLY_PATHS + language.install_paths
+        command = self.jail.command(language.command, root, work, read_only_paths)
+        process = subprocess.Popen(
+            self._limited(command),
+            cwd=work,
+            env={
+                "PATH": "/usr/local/bin:/usr/bin:/bin",
+                "HOME": "/sandbox" if jailed else work,
+                "TMPDIR": "/tmp" if jailed else work,
+                "LANG": "C.UTF-8",
+                "PYTHONIOENCODING": "utf-8",
+            },
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            start_new_session=True,
+            close_fds=True,
+            **self.jail.popen_options()
+        )
+        return Worker(language, process, base, work)
+
+    def _limited(self, command):
+        """Prefix command with a launcher that sets the resource limits before anything else starts"""
+        if resource is None:
+            return command
+        memory = self.memory_mb * 1024 * 1024
+        limits = [
+            (self.cpu_limit, self.cpu_limit + 1),
+            (memory, memory),
+            (CODE_RUN_MAX_FILE_BYTES, CODE_RUN_MAX_FILE_BYTES),
+            (CODE_RUN_MAX_OPEN_FILES, CODE_RUN_MAX_OPEN_FILES),
+            (CODE_RUN_MAX_PROCESSES, CODE_RUN_MAX_PROCESSES),
+            (0, 0),
+        ]
+        return [sys.executable, '-I', '-S', '-c', LIMITS_BOOT] + [f"{soft}:{hard}" for soft, hard in limits] + command
+
+    def _execute(self, worker, source, program_input, time_limit):
+        with open(os.path.join(worker.directory, worker.language.filename), 'wb') as source_file:
+            source_file.write(source)
+
+        process = worker.process
+        started = time.monotonic()
+        deadline = started + time_limit
+        pending_input = memoryview(b'\n' + program_input)
+        output = {process.stdout: bytearray(), process.stderr: bytearray()}
+        timed_out = truncated = False
+
+        selector = selectors.DefaultSelector()
+        os.set_blocking(process.stdin.fileno(), False)
+        selector.register(process.stdin, selectors.EVENT_WRITE)
+        selector.register(process.stdout, selectors.EVENT_READ)
+        selector.register(process.stderr, selectors.EVENT_READ)
+        try:
+            while selector.get_map():
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    timed_out = True
+                    break
+                for key, _ in selector.select(remaining):
+                    if key.fileobj is process.stdin:
+                        pending_input = self._feed(selector, process.stdin, pending_input)
+                        continue
+                    chunk = os.read(key.fd, 65536)
+                    if not chunk:
+                        selector.unregister(key.fileobj)
+                        continue
+                    buffer = output[key.fileobj]
+                    buffer += chunk[:self.max_output + 1 - len(buffer)]
+                    if len(buffer) > self.max_output:
+                        truncated = True
+                if truncated:
+                    break
+        finally:
+            selector.close()
+
+        if timed_out or truncated:
+            _kill_tree(process)
+        try:
+            exit_code = process.wait(timeout=max(deadline - time.monotonic(), 0.1))
+        except subprocess.TimeoutExpired:
+            # Output closed but the program kept running
+            _kill_tree(process)
+            exit_code = process.wait()
+            timed_out = True
+        duration = time.monotonic() - started
+
+        if exit_code == -getattr(signal, 'SIGXCPU', 0):
+            # CPU limit reached
+            timed_out = True
+        status = 'ok' if exit_code == 0 else 'error'
+        if truncated:
+            status = 'output_limit'
+        elif timed_out:
+            status = 'timeout'
+
+        return {
+            "language": worker.language.name,
+            "status": status,
+            "exit_code": exit_code,
+            "stdout": bytes(output[process.stdout][:self.max_output]).decode('utf-8', 'replace'),
+            "stderr": bytes(output[process.stderr][:self.max_output]).decode('utf-8', 'replace'),
+            "timed_out": timed_out,
+            "truncated": truncated,
+            "duration_ms": int(duration * 1000)
+        }
+
+    @staticmethod
+    def _feed(selector, stdin, pending_input):
+        """Write as much queued input as the pipe takes; close stdin once it is all written"""
+        try:
+            written = os.write(stdin.fileno(), pending_input[:65536])
+            pending_input = pending_input[written:]
+        except BlockingIOError:
+            return pending_input
+        except OSError as e:
+            if e.errno != errno.EPIPE:
+                raise
+            # The program exited or closed its stdin without reading everything
+            pending_input = pending_input[len(pending_input):]
+        if not pending_input:
+            selector.unregister(stdin)
+            stdin.close()
+        return pending_input
+
+
+def _pid_namespace(pid):
+    try:
+        return os.readlink(f"/proc/{pid}/ns/pid")
+    except OSError:
+        return None
+
+
+def _children(pid):
+    try:
+        with open(f"/proc/{pid}/task/{pid}/children") as children:
+            return [int(child) for child in children.read().split()]
+    except OSError:
+        return []
+
+
+def _jail_namespace(pid):
+    """Pid namespace of the jail under pid: the first descendant in a namespace other than pid's"""
+    own = _pid_namespace(pid)
+    pending = _children(pid)
+    while pending:
+        child = pending.pop(0)
+        namespace = _pid_namespace(child)
+        if namespace and namespace != own:
+            return namespace
+        pending.extend(_children(child))
+    return None
+
+
+def _kill_tree(process):
+    """Kill the worker and everything it started, including processes that left its session"""
+    namespace = _jail_namespace(process.pid) if os.path.isdir('/proc') else None
+    try:
+        os.killpg(process.pid, signal.SIGKILL)
+    except (ProcessLookupError, PermissionError):
+        pass
+    except AttributeError:  # Windows
+        process.kill()
+    if namespace is None:
+        return
+
+    # Every process of the jail's pid namespace, wherever it moved in the process tree
+    for entry in os.listdir('/proc'):
+        if entry.isdigit() and _pid_namespace(entry) == namespace:
+            try:
+                os.kill(int(entry), signal.SIGKILL)
+            except (ProcessLookupError, PermissionError):
+                pass
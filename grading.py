@@ -0,0 +1,192 @@
+"""Deterministic grading of coding answers against stored test cases"""
+import os
+import re
+import json
+import math
+from concurrent.futures import ThreadPoolExecutor
+
+from sqlalchemy.exc import IntegrityError
+
+import code_runner
+from question_bank import make_question_hash
+
+# Grading settings (override through environment variables)
+TEST_CASES_PER_QUESTION = int(os.getenv("GRADING_TEST_CASES", "8"))
+GRADING_TIME_LIMIT = float(os.getenv("GRADING_TIME_LIMIT", "3"))   # wall-clock seconds per test case
+FLOAT_TOLERANCE = 1e-6
+# Characters of a failing test's stderr kept in the report
+ERROR_TAIL = 500
+
+# Printed before the harness's result line so the solution's own prints are ignored
+RESULT_MARKER = "__GRADER_RESULT__ "
+
+PYTHON_HARNESS = """
+
+import json as _json
+_result = {function}(*_json.loads({args!r}))
+print({marker!r} + _json.dumps(_result, default=lambda value: sorted(value, key=repr)
+                                if isinstance(value, (set, frozenset)) else str(value)))
+"""
+JAVASCRIPT_HARNESS = """
+
+Promise.resolve({function}(...JSON.parse({args}))).then(result =>
+    console.log({marker} + JSON.stringify(result === undefined ? null : result)));
+"""
+
+FUNCTION_PATTERNS = {
+    'python': [re.compile(r'^(?:async\s+)?def\s+(\w+)\s*\(', re.MULTILINE)],
+    'javascript': [
+        re.compile(r'^(?:export\s+)?(?:async\s+)?function\s*\*?\s*(\w+)\s*\(', re.MULTILINE),
+        re.compile(r'^(?:export\s+)?(?:const|let|var)\s+(\w+)\s*=\s*(?:async\s*)?(?:function\b|\(|\w+\s*=>)', re.MULTILINE),
+    ],
+}
+
+# Test cases run in parallel, each in its own jailed process
+_executor = ThreadPoolExecutor(max_workers=code_runner.CODE_RUN_MAX_CONCURRENT, thread_name_prefix="grading")
+
+
+def normalize_name(name):
+    """two_sum, twoSum and TwoSum all name the same function"""
+    return name.replace('_', '').lower()
+
+
+def find_function(language, code, function_name):
+    """Name of the solution's entry point: the expected function if defined,
+    otherwise the only top-level function; None if that is ambiguous"""
+    defined = []
+    for pattern in FUNCTION_PATTERNS.get(language, []):
+        defined.extend(pattern.findall(code or ''))
+
+    for name in defined:
+        if normalize_name(name) == normalize_name(function_name):
+            return name
+    return defined[0] if len(set(defined)) == 1 else None
+
+
+def build_program(language, code, function, args):
+    """Append a harness that calls function with args and prints the JSON result"""
+    encoded_args = json.dumps(args)
+    if language == 'python':
+        return code + PYTHON_HARNESS.format(function=function, args=encoded_args, marker=RESULT_MARKER)
+    return code + JAVASCRIPT_HARNESS.format(
+        function=function, args=json.dumps(encoded_args), marker=json.dumps(RESULT_MARKER))
+
+
+def read_result(stdout):
+    """Decode the harness's result line; raises ValueError when it is missing"""
+    for line in reversed(stdout.split('\n')):
+        if line.startswith(RESULT_MARKER):
+            return json.loads(line[len(RESULT_MARKER):])
+    raise ValueError("no result")
+
+
+def outputs_match(expected, actual):
+    """JSON equality, allowing for float rounding"""
+    if isinstance(expected, bool) or isinstance(actual, bool):
+        return expected is actual
+    if isinstance(expected, (int, float)) and isinstance(actual, (int, float)):
+        return math.isclose(expected, actual, rel_tol=FLOAT_TOLERANCE, abs_tol=FLOAT_TOLERANCE)
+    if isinstance(expected, list) and isinstance(actual, list):
+        return len(expected) == len(actual) and all(map(outputs_match, expected, actual))
+    if isinstance(expected, dict) and isinstance(actual, dict):
+        return expected.keys() == actual.keys() and all(outputs_match(expected[key], actual[key]) for key in expected)
+    return expected == actual
+
+
+def run_test_case(runner, language, code, function, index, test_case):
+    """Run one test case and describe the outcome"""
+    run = runner.run(language, build_program(language, code, function, test_case["args"]),
+                     time_limit=GRADING_TIME_LIMIT)
+    outcome = {
+        "index": index,
+        "args": test_case["args"],
+        "expected": test_case["expected"],
+        "passed": False,
+        "status": run["status"],
+        "duration_ms": run["duration_ms"]
+    }
+
+    if run["status"] == 'ok':
+        try:
+            outcome["actual"] = read_result(run["stdout"])
+        except ValueError:
+            outcome["status"] = 'no_result'
+        else:
+            outcome["passed"] = outputs_match(test_case["expected"], outcome["actual"])
+            outcome["status"] = 'passed' if outcome["passed"] else 'wrong_answer'
+
+    if not outcome["passed"] and run["stderr"]:
+        outcome["error"] = run["stderr"][-ERROR_TAIL:]
+    return outcome
+
+
+def grade(runner, language, code, suite):
+    """Run code against every test case of suite in parallel.
+
+    Returns pass/fail counts, each test's outcome and timing, and a 0-100 score,
+    or None when the answer's language cannot be run."""
+    try:
+        language = runner.resolve(language)
+    except code_runner.UnsupportedLanguageError:
+        return None
+
+    report = {
+        "language": language,
+        "function_name": suite["function_name"],
+        "total": len(suite["test_cases"]),
+        "passed": 0,
+        "failed": len(suite["test_cases"]),
+        "score": 0,
+        "tests": []
+    }
+
+    function = find_function(language, code, suite["function_name"])
+    if function is None:
+        report["error"] = f"Define a function named {suite['function_name']} to be tested"
+        return report
+
+    futures = [
+        _executor.submit(run_test_case, runner, language, code, function, index, test_case)
+        for index, test_case in enumerate(suite["test_cases"])
+    ]
+    report["tests"] = [future.result() for future in futures]
+    report["passed"] = sum(test["passed"] for test in report["tests"])
+    report["failed"] = report["total"] - report["passed"]
+    report["score"] = int(round(100 * report["passed"] / report["total"])) if report["total"] else 0
+    return report
+
+
+def valid_test_cases(test_cases):
+    """Keep test cases shaped like {"args": [...], "expected": value}"""
+    return [
+        {"args": test_case["args"], "expected": test_case.get("expected")}
+        for test_case in test_cases or []
+        if isinstance(test_case, dict) and isinstance(test_case.get("args"), list) and "expected" in test_case
+    ][:TEST_CASES_PER_QUESTION]
+
+
+class TestSuites:
+    """Test cases generated once per coding question and stored by question hash"""
+
+    def __init__(self, db, model):
+        self.db = db
+        self.model = model
+
+    def get(self, question):
+        row = self.model.query.filter_by(question_hash=make_question_hash(question, 'coding')).first()
+        return row.to_dict() if row else None
+
+    def save(self, question, suite):
+        """Store a suite, keeping the existing one if another request stored it first"""
+        row = self.model(
+            question_hash=make_question_hash(question, 'coding'),
+            function_name=suite["function_name"],
+            test_cases=json.dumps(suite["test_cases"])
+        )
+        self.db.session.add(row)
+        try:
+            self.db.session.commit()
+        except IntegrityError:
+            self.db.session.rollback()
+            return self.get(question)
+        return row.to_dict()
@@ -0,0 +1,246 @@
+"""Durable background jobs for LLM work, stored in the app database"""
+import os
+import json
+import hashlib
+import logging
+import threading
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy.exc import IntegrityError
+
+import llm_client
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# Queue settings (override through environment variables)
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "4"))
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "3"))
+JOB_LEASE_SECONDS = int(os.getenv("JOB_LEASE_SECONDS", "300"))
+JOB_POLL_INTERVAL = float(os.getenv("JOB_POLL_INTERVAL", "1"))
+# How long a finished job answers identical submissions before they run again
+JOB_DEDUP_TTL = int(os.getenv("JOB_DEDUP_TTL", "300"))
+
+TERMINAL_STATUSES = ('succeeded', 'failed')
+ACTIVE_STATUSES = ('queued', 'running')
+
+
+def make_dedup_key(kind, payload, user_id):
+    """Hash a job's kind, payload and owner so identical submissions share one job"""
+    canonical = json.dumps([kind, payload, user_id], sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+
+class JobQueue:
+    """Job table backed queue with a pool of worker threads"""
+
+    def __init__(self, app, db, model, workers=JOB_WORKERS):
+        self.app = app
+        self.db = db
+        self.model = model
+        self.workers = workers
+        self.handlers = {}
+        self.priorities = {}
+        self._started = False
+        self._start_lock = threading.Lock()
+        # Workers sleep on this between polls; each submission wakes one of them
+        self._work_available = threading.Condition()
+        self._finished = threading.Condition()
+        self._last_recovery = 0
+
+    def register(self, kind, handler, priority=llm_client.PRIORITY_NORMAL):
+        """Register the function that runs jobs of the given kind, and the priority of its LLM calls"""
+        self.handlers[kind] = handler
+        self.priorities[kind] = priority
+
+    def submit(self, kind, payload, user_id=None, max_attempts=JOB_MAX_ATTEMPTS):
+        """Queue a job, or return the existing one for an identical submission that
+        is still pending or succeeded within JOB_DEDUP_TTL"""
+        key = make_dedup_key(kind, payload, user_id)
+        job = self.model.query.filter_by(dedup_key=key).first()
+
+        if job and self._reusable(job):
+            return job
+
+        if job:
+            # A failed or expired job runs again on the same row with a fresh set of attempts
+            job.status = 'queued'
+            job.attempts = 0
+            job.error = None
+            job.result = None
+            job.run_after = datetime.utcnow()
+            job.updated_at = datetime.utcnow()
+        else:
+            job = self.model(
+                kind=kind,
+                dedup_key=key,
+                payload=json.dumps(payload),
+                user_id=user_id,
+                max_attempts=max_attempts
+            )
+            self.db.session.add(job)
+
+        try:
+            self.db.session.commit()
+        except IntegrityError:
+            # Another request queued the same job first
+            self.db.session.rollback()
+            return self.model.query.filter_by(dedup_key=key).first()
+
+        self.ensure_started()
+        with self._work_available:
+            self._work_available.notify()
+        return job
+
+    @staticmethod
+    def _reusable(job):
+        if job.status in ACTIVE_STATUSES:
+            return True
+        if job.status == 'succeeded':
+            return job.updated_at is not None and job.updated_at >= datetime.utcnow() - timedelta(seconds=JOB_DEDUP_TTL)
+        return False
+
+    def wait(self, job, timeout):
+        """Block until the job finishes or the timeout passes, then return it"""
+        deadline = time.monotonic() + timeout
+        while job.status not in TERMINAL_STATUSES:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            # Woken by local workers; the short timeout covers other processes
+            with self._finished:
+                self._finished.wait(min(remaining, 0.5))
+            self.db.session.refresh(job)
+        return job
+
+    def ensure_started(self):
+        """Start the worker threads once per process"""
+        if self._started:
+            return
+        with self._start_lock:
+            if self._started:
+                return
+            for index in range(self.workers):
+                thread = threading.Thread(target=self._work, name=f"job-worker-{index}", daemon=True)
+                thread.start()
+            self._started = True
+
+    def _work(self):
+        while True:
+            try:
+                with self.app.app_context():
+                    self._recover_stale()
+                    job_id = self._claim()
+                    if job_id is not None:
+                        self._run(job_id)
+                        continue
+            except Exception:
+                logger.exception("Job worker error")
+
+            # The timeout also picks up jobs queued by other processes and retries coming due
+            with self._work_available:
+                self._work_available.wait(JOB_POLL_INTERVAL)
+
+    def _claim(self):
+        """Atomically move the oldest runnable job to running and return its id"""
+        model = self.model
+        now = datetime.utcnow()
+
+        for _ in range(5):
+            candidate = self.db.session.query(model.id).filter(
+                model.status == 'queued',
+                model.run_after <= now
+            ).order_by(model.id).first()
+
+            if candidate is None:
+                return None
+
+            # Only one worker (in any process) wins the conditional update
+            claimed = model.query.filter_by(id=candidate.id, status='queued').update({
+                'status': 'running',
+                'locked_at': now,
+                'attempts': model.attempts + 1,
+                'updated_at': now
+            }, synchronize_session=False)
+            self.db.session.commit()
+
+            if claimed:
+                return candidate.id
+
+        return None
+
+    def _run(self, job_id):
+        job = self.model.query.get(job_id)
+        handler = self.handlers.get(job.kind)
+
+        try:
+            if handler is None:
+                raise ValueError(f"No handler registered for job kind '{job.kind}'")
+
+            with llm_client.caller(job.user_id, self.priorities.get(job.kind, llm_client.PRIORITY_NORMAL)), \
+                    metrics.call_site(f"job:{job.kind}"):
+                result = handler(json.loads(job.payload))
+            job.result = json.dumps(result)
+            job.status = 'succeeded'
+            job.error = None
+        except llm_client.LLMBusyError as e:
+            # Turned away before reaching the model: retry when told to, without using up an attempt
+            self.db.session.rollback()
+            job = self.model.query.get(job_id)
+            job.status = 'queued'
+            job.attempts = job.attempts - 1
+            job.error = str(e)
+            job.run_after = datetime.utcnow() + timedelta(seconds=e.retry_after)
+        except Exception as e:
+            logger.warning("Job failed", extra={"job_id": job_id, "kind": job.kind, "error": str(e)})
+            self.db.session.rollback()
+            job = self.model.query.get(job_id)
+            job.error = str(e)
+
+            if handler is not None and job.attempts < job.max_attempts:
+                # Retry with exponential backoff
+                job.status = 'queued'
+                job.run_after = datetime.utcnow() + timedelta(seconds=2 ** job.attempts)
+            else:
+                job.status = 'failed'
+
+        job.locked_at = None
+        job.updated_at = datetime.utcnow()
+        self.db.session.commit()
+
+        with self._finished:
+            self._finished.notify_all()
+
+    def _recover_stale(self):
+        """Requeue running jobs whose worker died before finishing them, failing those out of attempts"""
+        if time.monotonic() - self._last_recovery < JOB_LEASE_SECONDS / 2:
+            return
+        self._last_recovery = time.monotonic()
+
+        model = self.model
+        now = datetime.utcnow()
+        stale = model.query.filter(
+            model.status == 'running',
+            model.locked_at < now - timedelta(seconds=JOB_LEASE_SECONDS)
+        )
+        # A job that keeps taking its worker down must not be retried forever
+        exhausted = stale.filter(model.attempts >= model.max_attempts).update({
+            'status': 'failed',
+            'error': "Worker stopped while running the job; no attempts left",
+            'locked_at': None,
+            'updated_at': now
+        }, synchronize_session=False)
+        recovered = stale.update({
+            'status': 'queued',
+            'locked_at': None,
+            'updated_at': now
+        }, synchronize_session=False)
+        self.db.session.commit()
+
+        if exhausted:
+            logger.warning("Failed stale jobs out of attempts", extra={"count": exhausted})
+            with self._finished:
+                self._finished.notify_all()
+        if recovered:
+            logger.info("Requeued stale jobs", extra={"count": recovered})
@@ -0,0 +1,551 @@
+"""Shared OpenAI client used by every LLM call site in the app"""
+import os
+import json
+import time
+import hashlib
+import tempfile
+import heapq
+import asyncio
+import itertools
+import logging
+import threading
+import contextvars
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, TimeoutError as FutureTimeoutError, wait
+from functools import partial
+
+import openai
+import requests
+from requests.adapters import HTTPAdapter
+
+import llm_resilience
+import metrics
+from single_flight import SingleFlight
+
+logger = logging.getLogger(__name__)
+
+# Client settings (override through environment variables)
+LLM_MODEL = os.getenv("LLM_MODEL", "gpt-3.5-turbo")
+LLM_MAX_IN_FLIGHT = int(os.getenv("LLM_MAX_IN_FLIGHT", "8"))
+LLM_CONNECT_TIMEOUT = float(os.getenv("LLM_CONNECT_TIMEOUT", "5"))
+LLM_READ_TIMEOUT = float(os.getenv("LLM_READ_TIMEOUT", "60"))
+LLM_QUEUE_TIMEOUT = float(os.getenv("LLM_QUEUE_TIMEOUT", "10"))
+LLM_POOL_SIZE = int(os.getenv("LLM_POOL_SIZE", str(max(LLM_MAX_IN_FLIGHT, 10))))
+# Per-user token bucket: sustained calls per minute and burst size
+LLM_USER_RATE_PER_MINUTE = float(os.getenv("LLM_USER_RATE_PER_MINUTE", "30"))
+LLM_USER_BURST = float(os.getenv("LLM_USER_BURST", "15"))
+# Callers allowed to wait for a slot; beyond this they are turned away at once
+LLM_MAX_QUEUED = int(os.getenv("LLM_MAX_QUEUED", "32"))
+
+# Overall budget of a call, queueing and retries included, unless the request set its own deadline
+LLM_DEFAULT_DEADLINE = float(os.getenv("LLM_DEFAULT_DEADLINE", "90"))
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "2"))
+LLM_RETRY_BASE_DELAY = float(os.getenv("LLM_RETRY_BASE_DELAY", "0.5"))
+LLM_RETRY_MAX_DELAY = float(os.getenv("LLM_RETRY_MAX_DELAY", "8"))
+# Send a second, hedged request once a call runs past this latency percentile (0 turns hedging off)
+LLM_HEDGE_PERCENTILE = float(os.getenv("LLM_HEDGE_PERCENTILE", "0"))
+# Consecutive failures that open the circuit breaker, and how long it stays open
+LLM_BREAKER_FAILURES = int(os.getenv("LLM_BREAKER_FAILURES", "5"))
+LLM_BREAKER_COOLDOWN = float(os.getenv("LLM_BREAKER_COOLDOWN", "30"))
+
+# Directory shared by the processes on this host to coalesce identical prompts ("" turns that off)
+LLM_SINGLE_FLIGHT_DIR = os.getenv("LLM_SINGLE_FLIGHT_DIR", os.path.join(tempfile.gettempdir(), "ai-interviewer-llm"))
+
+# Scheduling priorities, most urgent first
+PRIORITY_HIGH = 0     # live interviews: transcription and response analysis
+PRIORITY_NORMAL = 1   # practice grading and question generation
+PRIORITY_LOW = 2      # code explanation, prep questions and background prefetch
+# Fraction of the wait queue each priority may fill, so low priority work is shed first
+QUEUE_SHARE = {PRIORITY_HIGH: 1.0, PRIORITY_NORMAL: 0.5, PRIORITY_LOW: 0.25}
+
+
+class LLMError(Exception):
+    """Raised when a completion could not be obtained"""
+
+
+class LLMBusyError(LLMError):
+    """Raised when a call is turned away or no in-flight slot frees up within LLM_QUEUE_TIMEOUT"""
+
+    def __init__(self, message, retry_after=1.0):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class LLMRateLimitError(LLMBusyError):
+    """Raised when a user has used up their own share of LLM calls"""
+
+
+class LLMUnavailableError(LLMBusyError):
+    """Raised without calling the provider while the circuit breaker is open"""
+
+
+class LLMTimeoutError(LLMError):
+    """Raised when the provider does not answer within the timeout"""
+
+
+def _make_session():
+    """Create the keep-alive HTTP session shared by all OpenAI calls"""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=LLM_POOL_SIZE, max_retries=2)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+# openai reuses this session instead of opening one per thread
+_session = _make_session()
+openai.requestssession = _session
+
+
+class Scheduler:
+    """Admission control in front of every LLM call.
+
+    Each user draws from a token bucket; calls within it take one of
+    max_in_flight slots. When all slots are busy, callers wait in priority
+    order, and a call that would grow the queue past its priority's share is
+    rejected straight away with a retry-after estimate."""
+
+    def __init__(self, max_in_flight=LLM_MAX_IN_FLIGHT, max_queued=LLM_MAX_QUEUED,
+                 user_rate_per_minute=LLM_USER_RATE_PER_MINUTE, user_burst=LLM_USER_BURST):
+        self.max_in_flight = max_in_flight
+        self.max_queued = max_queued
+        self.user_rate = user_rate_per_minute / 60
+        self.user_burst = user_burst
+        self.in_flight = 0
+        self._lock = threading.Lock()
+        self._waiters = []
+        self._sequence = itertools.count()
+        self._buckets = {}
+        # Moving average of call duration, used for retry-after estimates
+        self._average_seconds = 2.0
+
+    def acquire(self, user_id=None, priority=PRIORITY_NORMAL, timeout=LLM_QUEUE_TIMEOUT):
+        """Take a slot, waiting behind more urgent callers; raises LLMBusyError"""
+        with self._lock:
+            self._take_token(user_id)
+            if self.in_flight < self.max_in_flight and not self._waiters:
+                self.in_flight += 1
+                return
+
+            if len(self._waiters) >= self.max_queued * QUEUE_SHARE.get(priority, 1.0):
+                self._refund_token(user_id)
+                raise LLMBusyError("The AI service is busy, please try again shortly", self._retry_after())
+
+            waiter = [priority, next(self._sequence), threading.Event()]
+            heapq.heappush(self._waiters, waiter)
+
+        if waiter[2].wait(timeout):
+            return
+
+        with self._lock:
+            if waiter[2].is_set():
+                # Granted just as the wait timed out
+                return
+            self._waiters.remove(waiter)
+            heapq.heapify(self._waiters)
+            self._refund_token(user_id)
+        raise LLMBusyError("Too many LLM requests in flight, please try again shortly", self._retry_after())
+
+    def release(self, elapsed=None):
+        """Free a slot, handing it straight to the most urgent waiter"""
+        with self._lock:
+            if elapsed is not None:
+                self._average_seconds += 0.2 * (elapsed - self._average_seconds)
+            if self._waiters:
+                heapq.heappop(self._waiters)[2].set()
+            else:
+                self.in_flight -= 1
+
+    @contextmanager
+    def slot(self, user_id=None, priority=PRIORITY_NORMAL, timeout=LLM_QUEUE_TIMEOUT):
+        self.acquire(user_id, priority, timeout)
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self.release(time.monotonic() - started)
+
+    def has_capacity(self):
+        """Whether a slot is free right now"""
+        with self._lock:
+            return self.in_flight < self.max_in_flight and not self._waiters
+
+    def stats(self):
+        with self._lock:
+            return {
+                "in_flight": self.in_flight,
+                "queued": len(self._waiters),
+                "average_seconds": round(self._average_seconds, 3),
+                "tracked_users": len(self._buckets)
+            }
+
+    def _take_token(self, user_id):
+        if user_id is None:
+            return
+        now = time.monotonic()
+        tokens, updated = self._buckets.get(user_id, (self.user_burst, now))
+        tokens = min(self.user_burst, tokens + (now - updated) * self.user_rate)
+        if tokens < 1:
+            self._buckets[user_id] = (tokens, now)
+            raise LLMRateLimitError("Too many AI requests, please slow down",
+                                    (1 - tokens) / self.user_rate if self.user_rate else 60.0)
+        self._buckets[user_id] = (tokens - 1, now)
+
+        if len(self._buckets) > 10000:
+            # Full buckets carry no state worth keeping
+            horizon = self.user_burst / self.user_rate if self.user_rate else float('inf')
+            self._buckets = {key: value for key, value in self._buckets.items() if now - value[1] < horizon}
+
+    def _refund_token(self, user_id):
+        if user_id in self._buckets:
+            tokens, updated = self._buckets[user_id]
+            self._buckets[user_id] = (min(self.user_burst, tokens + 1), updated)
+
+    def _retry_after(self):
+        # Time for the calls ahead in the queue to drain through the slots
+        return max(1.0, self._average_seconds * (len(self._waiters) + 1) / self.max_in_flight)
+
+
+# Caps the number of completions in flight in this process
+scheduler = Scheduler()
+
+# (user id, priority) of the code making LLM calls, set per request or job
+_caller = contextvars.ContextVar("llm_caller", default=(None, PRIORITY_NORMAL))
+
+
+def set_caller(user_id, priority=PRIORITY_NORMAL):
+    """Attribute LLM calls made from the current context to user_id at priority"""
+    _caller.set((user_id, priority))
+
+
+@contextmanager
+def caller(user_id, priority=PRIORITY_NORMAL):
+    """Attribute LLM calls made inside the block to user_id at priority"""
+    token = _caller.set((user_id, priority))
+    try:
+        yield
+    finally:
+        _caller.reset(token)
+
+
+def _slot(remaining=None):
+    user_id, priority = _caller.get()
+    timeout = LLM_QUEUE_TIMEOUT if remaining is None else max(0.0, min(LLM_QUEUE_TIMEOUT, remaining))
+    return scheduler.slot(user_id, priority, timeout)
+
+
+call_duration = metrics.Histogram(
+    "llm_call_duration_seconds", "LLM calls from start to last byte, queueing and retries included",
+    ("call_site", "operation", "outcome"))
+tokens_used = metrics.Counter(
+    "llm_tokens_total", "Tokens reported by the provider for completed calls",
+    ("call_site", "model", "type"))
+retries = metrics.Counter(
+    "llm_retries_total", "LLM attempts retried after a transient provider error",
+    ("call_site", "error"))
+metrics.Gauge("llm_calls_in_flight", "LLM calls holding a scheduler slot",
+              function=lambda: scheduler.stats()["in_flight"])
+metrics.Gauge("llm_calls_queued", "LLM calls waiting for a scheduler slot",
+              function=lambda: scheduler.stats()["queued"])
+metrics.Gauge("llm_circuit_open", "1 while the circuit breaker refuses or probes LLM calls",
+              function=lambda: int(breaker.is_open))
+
+
+def _outcome(error):
+    if isinstance(error, LLMRateLimitError):
+        return 'rate_limited'
+    if isinstance(error, LLMUnavailableError):
+        return 'unavailable'
+    if isinstance(error, LLMBusyError):
+        return 'busy'
+    if isinstance(error, (LLMTimeoutError, openai.error.Timeout)):
+        return 'timeout'
+    if isinstance(error, GeneratorExit):
+        return 'closed'
+    return 'error'
+
+
+@contextmanager
+def _measured(operation):
+    """Record the block's duration and outcome under the current call site"""
+    started = time.perf_counter()
+    outcome = 'ok'
+    try:
+        yield
+    except BaseException as e:
+        # BaseException so streams closed by the client are recorded too
+        outcome = _outcome(e)
+        raise
+    finally:
+        call_duration.observe(time.perf_counter() - started,
+                              call_site=metrics.current_call_site(), operation=operation, outcome=outcome)
+
+
+# Monotonic time by which the current request's LLM calls must finish
+_deadline = contextvars.ContextVar("llm_deadline", default=None)
+
+
+def set_deadline(seconds):
+    """Bound every LLM call made from the current context to finish within seconds from now"""
+    _deadline.set(time.monotonic() + seconds if seconds else None)
+
+
+def _call_deadline():
+    request_deadline = _deadline.get()
+    return time.monotonic() + LLM_DEFAULT_DEADLINE if request_deadline is None else request_deadline
+
+
+# Health of the provider as seen by this process
+breaker = llm_resilience.CircuitBreaker(LLM_BREAKER_FAILURES, LLM_BREAKER_COOLDOWN)
+latencies = llm_resilience.LatencyTracker()
+_hedge_counts = {"hedged": 0, "hedge_won": 0}
+
+# Runs first and hedged attempts so the caller can wait on whichever finishes first
+_hedge_executor = ThreadPoolExecutor(max_workers=LLM_MAX_IN_FLIGHT * 2, thread_name_prefix="llm-hedge")
+
+
+def resilience_stats():
+    """Circuit breaker state, hedging counters and recent latency percentiles"""
+    return dict(
+        breaker.stats(),
+        p50_seconds=latencies.percentile(50),
+        p95_seconds=latencies.percentile(95),
+        **_hedge_counts
+    )
+
+
+def _call_with_resilience(attempt, hedge=False):
+    """Run attempt(remaining_seconds) within the call's deadline.
+
+    Transient provider errors are retried with jittered backoff while time
+    remains; while the circuit breaker is open the call fails at once."""
+    deadline = _call_deadline()
+    for number in itertools.count():
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            raise LLMTimeoutError("The AI service did not answer in time")
+
+        wait_seconds = breaker.before_call()
+        if wait_seconds is not None:
+            raise LLMUnavailableError("The AI service is temporarily unavailable, please try again shortly",
+                                      wait_seconds)
+
+        started = time.monotonic()
+        try:
+            result = _hedged(attempt, remaining) if hedge else attempt(remaining)
+        except Exception as e:
+            if not llm_resilience.is_retryable(e):
+                # Rejected before reaching the provider, or a request the provider refused: not a health signal
+                breaker.after_call(None)
+                raise
+            breaker.after_call(False)
+
+            delay = llm_resilience.backoff_delay(number, LLM_RETRY_BASE_DELAY, LLM_RETRY_MAX_DELAY)
+            if number >= LLM_MAX_RETRIES or time.monotonic() + delay >= deadline:
+                if isinstance(e, openai.error.Timeout):
+                    raise LLMTimeoutError(str(e)) from e
+                raise
+            retries.inc(call_site=metrics.current_call_site(), error=type(e).__name__)
+            logger.warning("LLM call failed, retrying", extra={
+                "call_site": metrics.current_call_site(), "error": type(e).__name__, "retry_in_seconds": round(delay, 2)})
+            time.sleep(delay)
+            continue
+
+        breaker.after_call(True)
+        latencies.add(time.monotonic() - started)
+        return result
+
+
+def _hedged(attempt, remaining):
+    """Run attempt, and a second copy if the first is slower than LLM_HEDGE_PERCENTILE; first success wins"""
+    delay = latencies.percentile(LLM_HEDGE_PERCENTILE) if LLM_HEDGE_PERCENTILE else None
+    if delay is None or delay >= remaining:
+        return attempt(remaining)
+
+    started = time.monotonic()
+    first = _hedge_executor.submit(contextvars.copy_context().run, attempt, remaining)
+    try:
+        return first.result(timeout=delay)
+    except FutureTimeoutError:
+        pass
+    if not scheduler.has_capacity():
+        # Hedging only uses spare capacity; under load it would add to the problem
+        return first.result()
+
+    # The hedge is not charged to the user's rate limit
+    context = contextvars.copy_context()
+    context.run(_caller.set, (None, _caller.get()[1]))
+    second = _hedge_executor.submit(context.run, attempt, remaining - (time.monotonic() - started))
+    _hedge_counts["hedged"] += 1
+
+    pending = {first, second}
+    error = None
+    while pending:
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            if future.exception() is None:
+                if future is second:
+                    _hedge_counts["hedge_won"] += 1
+                return future.result()
+            error = future.exception()
+    raise error
+
+
+# Worker threads for async views and fan-out work
+_executor = ThreadPoolExecutor(max_workers=LLM_MAX_IN_FLIGHT, thread_name_prefix="llm")
+
+
+def _request_timeout(timeout, remaining=None):
+    """Build the (connect, read) timeout tuple passed to requests, cut short by the call's deadline"""
+    read_timeout = timeout or LLM_READ_TIMEOUT
+    if remaining is not None:
+        read_timeout = max(0.1, min(read_timeout, remaining))
+    return (LLM_CONNECT_TIMEOUT, read_timeout)
+
+
+# Identical prompts in flight at the same time share one completion. Each caller waits
+# on another process's identical call for as long as its own deadline allows.
+_flights = SingleFlight(
+    LLM_SINGLE_FLIGHT_DIR or None,
+    wait_timeout=LLM_DEFAULT_DEADLINE,
+    retry_on=(LLMBusyError,)
+)
+
+
+def prompt_key(model, messages, temperature, **kwargs):
+    """Hash of everything that determines a completion"""
+    canonical = json.dumps([model, messages, temperature, kwargs], sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+
+def coalescing_stats():
+    """Completions made, and calls that shared another call's completion"""
+    return _flights.stats()
+
+
+def chat_completion(messages, temperature=0.7, model=None, timeout=None, **kwargs):
+    """Run a chat completion and return the message content"""
+    model = model or LLM_MODEL
+    return _flights.do(
+        prompt_key(model, messages, temperature, **kwargs),
+        partial(_chat_completion, messages, temperature, model, timeout, **kwargs),
+        wait_timeout=max(0.0, _call_deadline() - time.monotonic())
+    )
+
+
+def _chat_completion(messages, temperature, model, timeout, **kwargs):
+    def attempt(remaining):
+        with _slot(remaining):
+            return openai.ChatCompletion.create(
+                model=model,
+                messages=messages,
+                temperature=temperature,
+                request_timeout=_request_timeout(timeout, remaining),
+                **kwargs
+            )
+
+    with _measured('chat'):
+        response = _call_with_resilience(attempt, hedge=True)
+
+    usage = getattr(response, 'usage', None) or {}
+    for kind in ('prompt', 'completion'):
+        if usage.get(f'{kind}_tokens'):
+            tokens_used.inc(usage[f'{kind}_tokens'], call_site=metrics.current_call_site(), model=model, type=kind)
+    return response.choices[0].message.content
+
+
+def stream_chat_completion(messages, temperature=0.7, model=None, timeout=None, **kwargs):
+    """Run a streaming chat completion and yield content tokens as they arrive"""
+    def attempt(remaining):
+        return openai.ChatCompletion.create(
+            model=model or LLM_MODEL,
+            messages=messages,
+            temperature=temperature,
+            request_timeout=_request_timeout(timeout, remaining),
+            stream=True,
+            **kwargs
+        )
+
+    # The slot is held until the stream is exhausted or closed; only opening the stream is retried
+    try:
+        with _measured('stream'), _slot(_call_deadline() - time.monotonic()):
+            chunks = _call_with_resilience(attempt)
+            for chunk in chunks:
+                if not chunk.choices:
+                    continue
+                token = chunk.choices[0].delta.get("content")
+                if token:
+                    yield token
+    except openai.error.Timeout as e:
+        raise LLMTimeoutError(str(e)) from e
+
+
+def _transcription_request(model, audio_file, filename, request_timeout):
+    """openai.Audio.transcribe_raw with a request timeout.
+
+    transcribe_raw sends its extra keyword arguments as form fields, so the
+    timeout has to go to the requestor directly."""
+    requestor, files, data = openai.Audio._prepare_request(audio_file, filename, model)
+    api_type, api_version = openai.Audio._get_api_type_and_version()
+    url = openai.Audio._get_url("transcriptions", api_type=api_type, api_version=api_version)
+    response, _, api_key = requestor.request("post", url, files=files, params=data, request_timeout=request_timeout)
+    return openai.util.convert_to_openai_object(response, api_key, api_version)
+
+
+def transcribe(audio_file, filename, model="whisper-1"):
+    """Transcribe an in-memory or spooled audio file and return the text"""
+    def attempt(remaining):
+        if hasattr(audio_file, 'seek'):
+            # A retry sends the upload again from the start
+            audio_file.seek(0)
+        with _slot(remaining):
+            return _transcription_request(model, audio_file, filename, _request_timeout(None, remaining))
+
+    if hasattr(audio_file, 'seek'):
+        audio_file.seek(0, os.SEEK_END)
+        metrics.transcription_audio_bytes.observe(audio_file.tell(), service='whisper')
+
+    started = time.perf_counter()
+    try:
+        with _measured('transcribe'):
+            transcript = _call_with_resilience(attempt)
+    except openai.error.Timeout as e:
+        raise LLMTimeoutError(str(e)) from e
+    metrics.transcription_duration.observe(time.perf_counter() - started, service='whisper')
+
+    return transcript.text
+
+
+async def achat_completion(messages, temperature=0.7, model=None, timeout=None, **kwargs):
+    """Async variant of chat_completion for async views"""
+    loop = asyncio.get_running_loop()
+    call = partial(chat_completion, messages, temperature=temperature, model=model, timeout=timeout, **kwargs)
+    return await loop.run_in_executor(_executor, contextvars.copy_context().run, call)
+
+
+def submit(func, *args, **kwargs):
+    """Run func on the shared LLM worker pool and return a Future"""
+    # The worker thread keeps the submitting caller's user and priority
+    return _executor.submit(contextvars.copy_context().run, func, *args, **kwargs)
+
+
+def map_concurrent(func, arg_tuples, limit=None, return_exceptions=False):
+    """Run func over each argument tuple on the shared pool, at most limit at once, and return results in order.
+
+    With return_exceptions, a call that raised has its exception in its place instead of failing the map."""
+    gate = threading.BoundedSemaphore(limit or LLM_MAX_IN_FLIGHT)
+
+    def run(args):
+        try:
+            return func(*args)
+        finally:
+            gate.release()
+
+    futures = []
+    for args in arg_tuples:
+        gate.acquire()
+        futures.append(_executor.submit(contextvars.copy_context().run, run, args))
+
+    if not return_exceptions:
+        return [future.result() for future in futures]
+    return [future.exception() or future.result() for future in futures]
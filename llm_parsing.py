@@ -0,0 +1,333 @@
+"""Helpers for turning LLM output into structured data"""
+import json
+import re
+import logging
+import threading
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# A bare score such as 7/10, which is not valid JSON on its own
+BARE_SCORE_PATTERN = re.compile(r'^\d+(\.\d+)?\s*/\s*\d+$')
+# The same quirk inside a document: "score": 7/10, -> "score": "7/10",
+BARE_FRACTION_VALUE = re.compile(r'(:\s*)(\d+(?:\.\d+)?\s*/\s*\d+)(?=\s*[,}\]])')
+# Trailing commas before a closing bracket
+TRAILING_COMMA = re.compile(r',(\s*[}\]])')
+# Openers tried before giving up on finding JSON in a model's output
+MAX_JSON_STARTS = 20
+
+# Lenient decoder: raw newlines and tabs inside strings are accepted
+DECODER = json.JSONDecoder(strict=False)
+
+QUESTION_TYPES = ('technical', 'behavioral', 'situational', 'coding')
+
+
+def question_lines_fallback(content):
+    """Build interview questions from 'Type: question' style lines"""
+    questions = []
+    for line in content.split('\n'):
+        if line.strip() and ':' in line:
+            q_type = "general"
+            if "technical" in line.lower():
+                q_type = "technical"
+            elif "behavioral" in line.lower():
+                q_type = "behavioral"
+            elif "situational" in line.lower():
+                q_type = "situational"
+
+            question_text = line.split(':', 1)[1].strip()
+            questions.append({"type": q_type, "question": question_text})
+    return questions
+
+
+def practice_question_lines_fallback(content):
+    """Build practice questions from 'Question:/Type:/Language:/Difficulty:' blocks"""
+    questions = []
+    current_question = {}
+
+    for line in content.split('\n'):
+        if line.strip() and ':' in line:
+            if line.lower().startswith('question'):
+                if current_question and 'question' in current_question:
+                    questions.append(current_question)
+                current_question = {'type': 'general', 'question': line.split(':', 1)[1].strip()}
+            elif 'type' in line.lower():
+                q_type = line.split(':', 1)[1].strip().lower()
+                for known_type in QUESTION_TYPES:
+                    if known_type in q_type:
+                        current_question['type'] = known_type
+                        break
+            elif 'language' in line.lower() and 'coding' in current_question.get('type', ''):
+                current_question['language'] = line.split(':', 1)[1].strip()
+            elif 'difficulty' in line.lower():
+                current_question['difficulty'] = line.split(':', 1)[1].strip().lower()
+
+    if current_question and 'question' in current_question:
+        questions.append(current_question)
+
+    return questions
+
+
+# Expected shape of each endpoint's output and what to return when no JSON is found
+SCHEMAS = {
+    "analysis": {
+        "type": dict,
+        "fields": {
+            "contentRelevance": str,
+            "clarityAndStructure": str,
+            "technicalAccuracy": str,
+            "areasOfImprovement": str,
+            "score": (str, int, float),
+        },
+        "required": ("score",),
+        "fallback": lambda content: {"text": content.replace('\n', '<br>')},
+    },
+    "interview_questions": {
+        "type": list,
+        "fields": {"type": str, "question": str},
+        "required": ("question",),
+        "fallback": question_lines_fallback,
+    },
+    "practice_questions": {
+        "type": list,
+        "fields": {"type": str, "question": str, "difficulty": str, "language": str},
+        "required": ("question",),
+        "fallback": practice_question_lines_fallback,
+    },
+    "answer_feedback": {
+        "type": dict,
+        "fields": {"correctness": (int, float, str), "explanation": str, "suggestions": (list, str)},
+        "required": ("correctness",),
+        "fallback": lambda content: {"explanation": content},
+    },
+    "test_suite": {
+        "type": dict,
+        "fields": {"function_name": str, "reference_solution": str, "test_cases": list},
+        "required": ("function_name", "test_cases"),
+        "fallback": lambda content: {},
+    },
+    "code_explanation": {
+        "type": dict,
+        "fields": {"overview": (str, dict, list), "line_by_line": list, "variable_tracking": list},
+        "required": (),
+        "fallback": lambda content: {"overview": content},
+    },
+}
+
+# Outcome counters per schema: parsed, repaired, invalid (schema mismatch), failed (no JSON)
+_stats_lock = threading.Lock()
+_stats = {}
+
+parse_outcomes = metrics.Counter(
+    "llm_parse_outcomes_total", "Model outputs parsed cleanly, repaired, schema-invalid or failed",
+    ("call_site", "schema", "outcome"))
+
+
+def _count(schema_name, outcome):
+    with _stats_lock:
+        counters = _stats.setdefault(schema_name, {"parsed": 0, "repaired": 0, "invalid": 0, "failed": 0})
+        counters[outcome] += 1
+    parse_outcomes.inc(call_site=metrics.current_call_site(), schema=schema_name, outcome=outcome)
+
+
+def parse_stats():
+    """Return a copy of the per-schema parse outcome counters"""
+    with _stats_lock:
+        return {name: dict(counters) for name, counters in _stats.items()}
+
+
+def _repairs(text):
+    """Versions of text with common model quirks fixed, least invasive first"""
+    fractions = BARE_FRACTION_VALUE.sub(r'\1"\2"', text)
+    yield fractions
+    yield TRAILING_COMMA.sub(r'\1', fractions)
+
+
+def _decode_at(text):
+    """Decode the JSON value text starts with, returning (value, repaired) or (None, False)"""
+    # The untouched text first: the repairs are regex based and would also rewrite inside strings
+    try:
+        return DECODER.raw_decode(text)[0], False
+    except json.JSONDecodeError:
+        pass
+    for fixed in _repairs(text):
+        if fixed == text:
+            continue
+        try:
+            return DECODER.raw_decode(fixed)[0], True
+        except json.JSONDecodeError:
+            continue
+    return None, False
+
+
+def extract_json(content, expected_type=dict):
+    """Decode the first JSON value in content once, returning (value, repaired)"""
+    # Start at the first bracket, which skips code fences and preamble.
+    # Arrays may arrive wrapped in an object, so either bracket can start one,
+    # and a preamble may itself hold brackets ("Sure! [note] [...]"), so later
+    # openers are tried when one does not decode.
+    openers = '{' if expected_type is dict else '[{'
+    starts = [position for position, char in enumerate(content) if char in openers]
+    if expected_type is dict:
+        starts = starts[:1]
+
+    for start in starts[:MAX_JSON_STARTS]:
+        value, repaired = _decode_at(content[start:])
+        if value is None:
+            continue
+        if expected_type is list and isinstance(value, dict):
+            lists = [item for item in value.values() if isinstance(item, list)]
+            if len(lists) == 1:
+                value, repaired = lists[0], True
+        if expected_type is dict or isinstance(value, list):
+            return value, repaired or start > 0
+    return None, False
+
+
+def _field_problems(item, schema):
+    problems = [f"missing '{name}'" for name in schema["required"] if name not in item]
+    for name, expected in schema["fields"].items():
+        if name in item and item[name] is not None and not isinstance(item[name], expected):
+            problems.append(f"'{name}' has type {type(item[name]).__name__}")
+    return problems
+
+
+def parse_structured(content, schema_name):
+    """Parse model output against a named schema, falling back to the schema's text fallback"""
+    schema = SCHEMAS[schema_name]
+    value, repaired = extract_json(content or '', schema["type"])
+
+    if not isinstance(value, schema["type"]):
+        _count(schema_name, "failed")
+        logger.warning("Could not parse model output as JSON; using text fallback",
+                       extra={"schema": schema_name, "content_length": len(content or '')})
+        return schema["fallback"](content or '')
+
+    if schema["type"] is list:
+        # Drop entries that are not usable, keep the rest
+        items = [item for item in value if isinstance(item, dict) and not _field_problems(item, schema)]
+        problems = len(value) - len(items)
+        value = items
+    else:
+        problems = len(_field_problems(value, schema))
+
+    if problems:
+        _count(schema_name, "invalid")
+        logger.warning("Model output did not match its schema", extra={"schema": schema_name, "problems": problems})
+    else:
+        _count(schema_name, "repaired" if repaired else "parsed")
+
+    return value
+
+
+def _load_value(raw):
+    """Decode one JSON value, keeping bare X/10 scores as strings"""
+    try:
+        return DECODER.decode(raw)
+    except json.JSONDecodeError:
+        if BARE_SCORE_PATTERN.match(raw):
+            return raw.replace(' ', '')
+        return raw.strip('"')
+
+
+class StreamingJSONFields:
+    """Scan a streamed JSON object and report each top-level field, and each
+    element of a top-level array field, as soon as it is complete"""
+
+    def __init__(self):
+        self.text = ''
+        self.pos = 0
+        self.depth = 0
+        self.started = False
+        self.done = False
+        self.in_string = False
+        self.escape = False
+        self.key = None
+        self.key_start = None
+        self.value_start = None
+        self.array_field = False
+        self.item_start = None
+        self.item_index = 0
+
+    def feed(self, chunk):
+        """Consume the next chunk of text and return the events it completed"""
+        self.text += chunk
+        events = []
+
+        while self.pos < len(self.text) and not self.done:
+            i = self.pos
+            ch = self.text[i]
+            self.pos += 1
+
+            # Skip any preamble or code fence before the object
+            if not self.started:
+                if ch == '{':
+                    self.started = True
+                    self.depth = 1
+                continue
+
+            if self.in_string:
+                if self.escape:
+                    self.escape = False
+                elif ch == '\\':
+                    self.escape = True
+                elif ch == '"':
+                    self.in_string = False
+                    if self.key_start is not None:
+                        self.key = _load_value(self.text[self.key_start:i + 1])
+                        self.key_start = None
+                continue
+
+            if ch == '"':
+                self.in_string = True
+                if self.depth == 1 and self.key is None:
+                    self.key_start = i
+                else:
+                    self._mark_item_start(i)
+            elif ch == ':' and self.depth == 1 and self.key is not None and self.value_start is None:
+                self.value_start = i + 1
+            elif ch in '{[':
+                if self.depth == 1 and ch == '[' and not self.text[self.value_start:i].strip():
+                    self.array_field = True
+                    self.item_index = 0
+                else:
+                    self._mark_item_start(i)
+                self.depth += 1
+            elif ch in '}]':
+                self.depth -= 1
+                if self.depth == 1 and ch == ']' and self.array_field:
+                    self._emit_item(events, i)
+                elif self.depth == 0:
+                    self._emit_field(events, i)
+                    self.done = True
+            elif ch == ',':
+                if self.depth == 1:
+                    self._emit_field(events, i)
+                elif self.depth == 2 and self.array_field:
+                    self._emit_item(events, i)
+            elif not ch.isspace():
+                self._mark_item_start(i)
+
+        return events
+
+    def _mark_item_start(self, index):
+        if self.depth == 2 and self.array_field and self.item_start is None:
+            self.item_start = index
+
+    def _emit_item(self, events, end):
+        if self.item_start is not None:
+            raw = self.text[self.item_start:end].strip()
+            events.append({"event": "item", "field": self.key, "index": self.item_index, "value": _load_value(raw)})
+            self.item_index += 1
+        self.item_start = None
+
+    def _emit_field(self, events, end):
+        if self.key is not None and self.value_start is not None:
+            raw = self.text[self.value_start:end].strip()
+            if raw:
+                events.append({"event": "field", "field": self.key, "value": _load_value(raw)})
+        self.key = None
+        self.value_start = None
+        self.array_field = False
+        self.item_start = None
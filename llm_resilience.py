@@ -0,0 +1,113 @@
+"""Retry backoff, latency tracking and a circuit breaker for calls to the LLM provider"""
+import time
+import random
+import logging
+import threading
+from collections import deque
+
+import openai
+
+logger = logging.getLogger(__name__)
+
+
+# Provider errors worth retrying: the request may well succeed a moment later
+RETRYABLE_ERRORS = (
+    openai.error.Timeout,
+    openai.error.APIConnectionError,
+    openai.error.RateLimitError,
+    openai.error.ServiceUnavailableError,
+    openai.error.TryAgain,
+    openai.error.APIError,
+)
+
+
+def is_retryable(error):
+    """Transient provider failure (timeouts, connection problems, 429 and 5xx responses)"""
+    if not isinstance(error, RETRYABLE_ERRORS):
+        return False
+    status = getattr(error, 'http_status', None)
+    # Plain APIErrors also cover 4xx responses, which a retry will not fix
+    return not (type(error) is openai.error.APIError and status is not None and status < 500)
+
+
+def backoff_delay(attempt, base, cap):
+    """Full-jitter exponential backoff: anywhere between 0 and base * 2^attempt, at most cap"""
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+
+class LatencyTracker:
+    """Durations of recent successful calls, for percentile lookups"""
+
+    def __init__(self, window=200, min_samples=20):
+        self.min_samples = min_samples
+        self._samples = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def add(self, seconds):
+        with self._lock:
+            self._samples.append(seconds)
+
+    def percentile(self, percent):
+        """The given percentile in seconds, or None until enough calls were seen"""
+        with self._lock:
+            if len(self._samples) < self.min_samples:
+                return None
+            ordered = sorted(self._samples)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * percent / 100))]
+
+
+class CircuitBreaker:
+    """Stops calls to a failing backend for a cooldown, then lets one probe through.
+
+    closed: calls flow, consecutive failures are counted.
+    open: calls are refused until the cooldown has passed.
+    half_open: a single probe call decides whether to close or reopen."""
+
+    def __init__(self, failure_threshold=5, cooldown_seconds=30):
+        self.failure_threshold = failure_threshold
+        self.cooldown_seconds = cooldown_seconds
+        self.state = 'closed'
+        self.failures = 0
+        self.opened_at = 0.0
+        self._probing = False
+        self._lock = threading.Lock()
+
+    def before_call(self):
+        """None if the call may go ahead, otherwise the seconds until calls are allowed again"""
+        with self._lock:
+            if self.state == 'closed':
+                return None
+            remaining = self.opened_at + self.cooldown_seconds - time.monotonic()
+            if self.state == 'open' and remaining <= 0:
+                self.state = 'half_open'
+            if self.state == 'half_open' and not self._probing:
+                self._probing = True
+                return None
+            return max(remaining, 1.0)
+
+    def after_call(self, succeeded):
+        """Record the outcome of an allowed call; None means it never reached the backend"""
+        with self._lock:
+            if self.state == 'half_open':
+                self._probing = False
+            if succeeded is None:
+                return
+            if succeeded:
+                self.state = 'closed'
+                self.failures = 0
+                return
+
+            self.failures += 1
+            if self.state == 'half_open' or self.failures >= self.failure_threshold:
+                if self.state != 'open':
+                    logger.error("LLM circuit breaker opened", extra={"consecutive_failures": self.failures})
+                self.state = 'open'
+                self.opened_at = time.monotonic()
+
+    @property
+    def is_open(self):
+        return self.state != 'closed'
+
+    def stats(self):
+        with self._lock:
+            return {"state": self.state, "consecutive_failures": self.failures}
@@ -0,0 +1,68 @@
+"""Leveled, structured logging shared by the web app, the voice server and the job workers"""
+import os
+import sys
+import json
+import time
+import logging
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+# json (one object per line, for log shippers) or text (for reading in a terminal)
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json")
+# Longest message or field value written; model output and transcripts are cut to this
+LOG_MAX_VALUE_LENGTH = int(os.getenv("LOG_MAX_VALUE_LENGTH", "2000"))
+
+# Attributes every LogRecord has; anything else was passed through extra=
+_RECORD_ATTRIBUTES = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime'}
+
+
+def _truncate(value):
+    if isinstance(value, str) and len(value) > LOG_MAX_VALUE_LENGTH:
+        return value[:LOG_MAX_VALUE_LENGTH] + f"... ({len(value)} chars)"
+    return value
+
+
+def _fields(record):
+    return {key: _truncate(value) for key, value in vars(record).items() if key not in _RECORD_ATTRIBUTES}
+
+
+class JSONFormatter(logging.Formatter):
+    """One JSON object per record: time, level, logger, message and the extra= fields"""
+
+    def format(self, record):
+        entry = {
+            "time": time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime(record.created)) + f".{int(record.msecs):03d}Z",
+            "level": record.levelname.lower(),
+            "logger": record.name,
+            "message": _truncate(record.getMessage()),
+        }
+        entry.update(_fields(record))
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    """Human readable lines with the extra= fields appended as key=value"""
+
+    def __init__(self):
+        super().__init__('%(asctime)s %(levelname)s %(name)s: %(message)s')
+
+    def format(self, record):
+        line = super().format(record)
+        fields = _fields(record)
+        if fields:
+            line += ' ' + ' '.join(f"{key}={value!r}" for key, value in fields.items())
+        return line
+
+
+def configure(level=None, format=None):
+    """Send every logger's records to stderr in the configured format; safe to call more than once"""
+    handler = logging.StreamHandler(sys.stderr)
+    handler.setFormatter(TextFormatter() if (format or LOG_FORMAT) == 'text' else JSONFormatter())
+
+    root = logging.getLogger()
+    for existing in [h for h in root.handlers if getattr(h, '_log_setup', False)]:
+        root.removeHandler(existing)
+    handler._log_setup = True
+    root.addHandler(handler)
+    root.setLevel(level or LOG_LEVEL)
@@ -0,0 +1,251 @@
+"""In-process metrics exposed in the Prometheus text format"""
+import os
+import time
+import bisect
+import threading
+import contextvars
+from contextlib import contextmanager
+
+# Latency buckets in seconds, from cache hits up to slow LLM calls
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 250)
+# Audio uploads, in bytes
+SIZE_BUCKETS = (16e3, 64e3, 256e3, 1e6, 4e6, 16e6)
+
+# Routes the request metrics leave out; scrapes would otherwise dominate them
+UNTIMED_PATHS = {'/metrics'}
+# Set METRICS_TOKEN to require "Authorization: Bearer <token>" on /metrics
+METRICS_TOKEN = os.getenv("METRICS_TOKEN")
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(names, values, extra=()):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in list(zip(names, values)) + list(extra)]
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _format_number(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Registry:
+    """The metrics of one process, rendered together for /metrics"""
+
+    def __init__(self):
+        self._metrics = []
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            if any(existing.name == metric.name for existing in self._metrics):
+                raise ValueError(f"Metric {metric.name} is already registered")
+            self._metrics.append(metric)
+        return metric
+
+    def render(self):
+        with self._lock:
+            metrics = list(self._metrics)
+        lines = []
+        for metric in metrics:
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.samples())
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=(), registry=REGISTRY):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+        registry.register(self)
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} takes labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+
+class Counter(_Metric):
+    """A total that only goes up"""
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            values = dict(self._values)
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_number(value)}"
+                for key, value in sorted(values.items())]
+
+
+class Gauge(_Metric):
+    """A current value, read from function at scrape time (labels map to values) or set directly"""
+    kind = 'gauge'
+
+    def __init__(self, name, documentation, labelnames=(), function=None, registry=REGISTRY):
+        self.function = function
+        super().__init__(name, documentation, labelnames, registry)
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def samples(self):
+        if self.function is not None:
+            try:
+                values = self.function()
+            except Exception:
+                return []
+            if not self.labelnames:
+                values = {(): values}
+        else:
+            with self._lock:
+                values = dict(self._values)
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_number(value)}"
+                for key, value in sorted(values.items())]
+
+
+class Histogram(_Metric):
+    """Observations counted into cumulative buckets, with their sum and count"""
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS, registry=REGISTRY):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, documentation, labelnames, registry)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            series = self._values.get(key)
+            if series is None:
+                series = self._values[key] = {"counts": [0] * (len(self.buckets) + 1), "sum": 0.0}
+            series["counts"][bisect.bisect_left(self.buckets, value)] += 1
+            series["sum"] += value
+
+    def samples(self):
+        with self._lock:
+            values = {key: (list(series["counts"]), series["sum"]) for key, series in self._values.items()}
+
+        lines = []
+        for key, (counts, total) in sorted(values.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                le = (("le", _format_number(bound)),)
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {_format_number(total)}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {cumulative}")
+        return lines
+
+
+# Request metrics, shared by every Flask app instrumented in this process
+request_duration = Histogram(
+    "http_request_duration_seconds", "Time to produce a response, by route",
+    ("route", "method", "status"))
+request_db_queries = Histogram(
+    "http_request_db_queries", "Database queries run while handling a request, by route",
+    ("route",), buckets=COUNT_BUCKETS)
+
+# Speech to text, recorded by llm_client (service="whisper") and voice.py (service="google")
+transcription_duration = Histogram(
+    "transcription_duration_seconds", "Time to transcribe a recording, by speech service",
+    ("service",))
+transcription_audio_bytes = Histogram(
+    "transcription_audio_bytes", "Size of the audio sent for transcription, by speech service",
+    ("service",), buckets=SIZE_BUCKETS)
+
+# Name of the code running (endpoint or job kind), the call_site label of LLM and parsing metrics
+_call_site = contextvars.ContextVar("call_site", default="other")
+
+
+def set_call_site(name):
+    """Label metrics recorded from the current context with name"""
+    _call_site.set(name or "other")
+
+
+@contextmanager
+def call_site(name):
+    """Label metrics recorded inside the block with name"""
+    token = _call_site.set(name)
+    try:
+        yield
+    finally:
+        _call_site.reset(token)
+
+
+def current_call_site():
+    return _call_site.get()
+
+
+# Database queries of the current request, or None outside requests
+_query_count = contextvars.ContextVar("db_query_count", default=None)
+# Set by count_queries; apps without a database do not report query counts
+_counting_queries = False
+
+
+def instrument(app, registry=REGISTRY):
+    """Time every request of app by route and serve registry on /metrics"""
+    from flask import Response, g, request
+
+    @app.before_request
+    def start_request_timer():
+        g.metrics_started = time.perf_counter()
+        if _counting_queries:
+            g.metrics_queries = [0]
+            _query_count.set(g.metrics_queries)
+        set_call_site(request.endpoint)
+
+    @app.after_request
+    def record_request(response):
+        started = g.pop('metrics_started', None)
+        queries = g.pop('metrics_queries', None)
+        _query_count.set(None)
+        if started is None or request.path in UNTIMED_PATHS:
+            return response
+
+        # The URL rule keeps the label set small: /api/jobs/<int:job_id>, not every id
+        route = request.url_rule.rule if request.url_rule else 'unmatched'
+        request_duration.observe(time.perf_counter() - started,
+                                 route=route, method=request.method, status=response.status_code)
+        if queries is not None:
+            request_db_queries.observe(queries[0], route=route)
+        return response
+
+    @app.route('/metrics')
+    def metrics():
+        if METRICS_TOKEN and request.headers.get('Authorization') != f"Bearer {METRICS_TOKEN}":
+            return Response("Unauthorized\n", status=401, mimetype='text/plain')
+        return Response(registry.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+    return app
+
+
+def count_queries(engine=None):
+    """Count the statements engine (by default every engine) runs against the current request"""
+    from sqlalchemy import event
+    from sqlalchemy.engine import Engine
+    global _counting_queries
+    _counting_queries = True
+
+    @event.listens_for(engine or Engine, 'before_cursor_execute')
+    def count_query(*args):
+        counter = _query_count.get()
+        if counter is not None:
+            counter[0] += 1
@@ -0,0 +1,58 @@
+"""per-user analytics rollups and interview history index
+
+Revision ID: 0d49f6e2a8b4
+Revises: a71d0e6b3c52
+Create Date: 2026-10-17 09:30:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0d49f6e2a8b4'
+down_revision = 'a71d0e6b3c52'
+branch_labels = None
+depends_on = None
+
+
+def has_table(name):
+    return sa.inspect(op.get_bind()).has_table(name)
+
+
+def upgrade():
+    if not has_table('user_stats'):
+        op.create_table('user_stats',
+        sa.Column('user_id', sa.Integer(), nullable=False),
+        sa.Column('interview_count', sa.Integer(), nullable=False),
+        sa.Column('scored_interview_count', sa.Integer(), nullable=False),
+        sa.Column('score_total', sa.Float(), nullable=False),
+        sa.Column('best_score', sa.Integer(), nullable=True),
+        sa.Column('last_interview_at', sa.DateTime(), nullable=True),
+        sa.ForeignKeyConstraint(['user_id'], ['user.id'], ),
+        sa.PrimaryKeyConstraint('user_id')
+        )
+
+    if not has_table('user_score_rollup'):
+        op.create_table('user_score_rollup',
+        sa.Column('user_id', sa.Integer(), nullable=False),
+        sa.Column('dimension', sa.String(length=20), nullable=False),
+        sa.Column('bucket', sa.String(length=50), nullable=False),
+        sa.Column('count', sa.Integer(), nullable=False),
+        sa.Column('total', sa.Float(), nullable=False),
+        sa.ForeignKeyConstraint(['user_id'], ['user.id'], ),
+        sa.PrimaryKeyConstraint('user_id', 'dimension', 'bucket')
+        )
+
+    indexes = [index['name'] for index in sa.inspect(op.get_bind()).get_indexes('interview')]
+    if 'ix_interview_user_id_id' not in indexes:
+        with op.batch_alter_table('interview', schema=None) as batch_op:
+            batch_op.create_index('ix_interview_user_id_id', ['user_id', 'id'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('interview', schema=None) as batch_op:
+        batch_op.drop_index('ix_interview_user_id_id')
+
+    op.drop_table('user_score_rollup')
+    op.drop_table('user_stats')
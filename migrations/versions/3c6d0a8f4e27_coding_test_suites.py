@@ -0,0 +1,32 @@
+"""stored test cases for coding questions
+
+Revision ID: 3c6d0a8f4e27
+Revises: e2c85f7a1b94
+Create Date: 2026-10-17 14:10:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3c6d0a8f4e27'
+down_revision = 'e2c85f7a1b94'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('coding_test_suite',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('question_hash', sa.String(length=64), nullable=False),
+    sa.Column('function_name', sa.String(length=100), nullable=False),
+    sa.Column('test_cases', sa.Text(), nullable=False),
+    sa.Column('created_at', sa.DateTime(), nullable=True),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('question_hash')
+    )
+
+
+def downgrade():
+    op.drop_table('coding_test_suite')
@@ -0,0 +1,86 @@
+"""job queue, analysis cache and question pool tables
+
+Revision ID: 5e8b24c7f913
+Revises: c3f1a9d2b701
+Create Date: 2026-10-17 09:10:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5e8b24c7f913'
+down_revision = 'c3f1a9d2b701'
+branch_labels = None
+depends_on = None
+
+
+def has_table(name):
+    return sa.inspect(op.get_bind()).has_table(name)
+
+
+def upgrade():
+    if not has_table('job'):
+        op.create_table('job',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('user_id', sa.Integer(), nullable=True),
+        sa.Column('kind', sa.String(length=50), nullable=False),
+        sa.Column('dedup_key', sa.String(length=64), nullable=False),
+        sa.Column('payload', sa.Text(), nullable=False),
+        sa.Column('status', sa.String(length=20), nullable=False),
+        sa.Column('attempts', sa.Integer(), nullable=False),
+        sa.Column('max_attempts', sa.Integer(), nullable=False),
+        sa.Column('result', sa.Text(), nullable=True),
+        sa.Column('error', sa.Text(), nullable=True),
+        sa.Column('run_after', sa.DateTime(), nullable=False),
+        sa.Column('locked_at', sa.DateTime(), nullable=True),
+        sa.Column('created_at', sa.DateTime(), nullable=True),
+        sa.Column('updated_at', sa.DateTime(), nullable=True),
+        sa.ForeignKeyConstraint(['user_id'], ['user.id'], ),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('dedup_key')
+        )
+        with op.batch_alter_table('job', schema=None) as batch_op:
+            batch_op.create_index(batch_op.f('ix_job_status'), ['status'], unique=False)
+
+    if not has_table('analysis_cache_entry'):
+        op.create_table('analysis_cache_entry',
+        sa.Column('key', sa.String(length=64), nullable=False),
+        sa.Column('value', sa.Text(), nullable=False),
+        sa.Column('created_at', sa.DateTime(), nullable=True),
+        sa.Column('last_used_at', sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint('key')
+        )
+        with op.batch_alter_table('analysis_cache_entry', schema=None) as batch_op:
+            batch_op.create_index(batch_op.f('ix_analysis_cache_entry_created_at'), ['created_at'], unique=False)
+            batch_op.create_index(batch_op.f('ix_analysis_cache_entry_last_used_at'), ['last_used_at'], unique=False)
+
+    if not has_table('question_set'):
+        op.create_table('question_set',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('kind', sa.String(length=50), nullable=False),
+        sa.Column('cache_key', sa.String(length=64), nullable=False),
+        sa.Column('params', sa.Text(), nullable=False),
+        sa.Column('questions', sa.Text(), nullable=False),
+        sa.Column('serve_count', sa.Integer(), nullable=False),
+        sa.Column('created_at', sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint('id')
+        )
+        with op.batch_alter_table('question_set', schema=None) as batch_op:
+            batch_op.create_index(batch_op.f('ix_question_set_cache_key'), ['cache_key'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('question_set', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_question_set_cache_key'))
+    op.drop_table('question_set')
+
+    with op.batch_alter_table('analysis_cache_entry', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_analysis_cache_entry_last_used_at'))
+        batch_op.drop_index(batch_op.f('ix_analysis_cache_entry_created_at'))
+    op.drop_table('analysis_cache_entry')
+
+    with op.batch_alter_table('job', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_job_status'))
+    op.drop_table('job')
@@ -0,0 +1,42 @@
+"""server-side storage for generated question sets
+
+Revision ID: 7b3e91c05d6a
+Revises: 0d49f6e2a8b4
+Create Date: 2026-10-17 09:40:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '7b3e91c05d6a'
+down_revision = '0d49f6e2a8b4'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('practice_session',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('questions', sa.Text(), nullable=False),
+    sa.Column('created_at', sa.DateTime(), nullable=True),
+    sa.ForeignKeyConstraint(['user_id'], ['user.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    with op.batch_alter_table('practice_session', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_practice_session_user_id'), ['user_id'], unique=False)
+
+    with op.batch_alter_table('interview', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('questions', sa.Text(), nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table('interview', schema=None) as batch_op:
+        batch_op.drop_column('questions')
+
+    with op.batch_alter_table('practice_session', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_practice_session_user_id'))
+
+    op.drop_table('practice_session')
@@ -0,0 +1,85 @@
+"""response question_key and score columns
+
+Revision ID: a71d0e6b3c52
+Revises: 5e8b24c7f913
+Create Date: 2026-10-17 09:20:00.000000
+
+"""
+import hashlib
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a71d0e6b3c52'
+down_revision = '5e8b24c7f913'
+branch_labels = None
+depends_on = None
+
+
+def make_question_key(question, question_type):
+    # Frozen copy of app.make_question_key at the time of this migration
+    return hashlib.sha256(f"{question_type}\x1f{(question or '').strip()}".encode('utf-8')).hexdigest()
+
+
+def response_columns():
+    return [column['name'] for column in sa.inspect(op.get_bind()).get_columns('response')]
+
+
+def response_indexes():
+    return [index['name'] for index in sa.inspect(op.get_bind()).get_indexes('response')]
+
+
+def backfill_question_keys():
+    """Fill question_key, keeping the newest row per question and merging older duplicates into it"""
+    bind = op.get_bind()
+    kept = {}
+    rows = bind.execute(sa.text(
+        "SELECT id, interview_id, question, question_type, transcript, analysis FROM response ORDER BY id DESC"
+    )).fetchall()
+    for row in rows:
+        key = (row.interview_id, make_question_key(row.question, row.question_type))
+        if key not in kept:
+            kept[key] = {"id": row.id, "question_key": key[1], "transcript": row.transcript, "analysis": row.analysis}
+            continue
+        survivor = kept[key]
+        survivor["transcript"] = survivor["transcript"] or row.transcript
+        survivor["analysis"] = survivor["analysis"] or row.analysis
+        bind.execute(sa.text("DELETE FROM response WHERE id = :id"), {"id": row.id})
+
+    for survivor in kept.values():
+        bind.execute(sa.text(
+            "UPDATE response SET question_key = :question_key, transcript = :transcript, analysis = :analysis WHERE id = :id"
+        ), survivor)
+
+
+def upgrade():
+    columns = response_columns()
+    if 'question_key' not in columns:
+        with op.batch_alter_table('response', schema=None) as batch_op:
+            batch_op.add_column(sa.Column('question_key', sa.String(length=64), nullable=True))
+
+    # Rows written before the column existed (or by the old startup migration) need keys
+    backfill_question_keys()
+
+    with op.batch_alter_table('response', schema=None) as batch_op:
+        batch_op.alter_column('question_key', existing_type=sa.String(length=64), nullable=False)
+        if 'ix_response_interview_question_key' not in response_indexes():
+            batch_op.create_index('ix_response_interview_question_key', ['interview_id', 'question_key'], unique=True)
+
+    if 'score' not in columns:
+        # Filled by 'flask backfill-scores'
+        with op.batch_alter_table('response', schema=None) as batch_op:
+            batch_op.add_column(sa.Column('score', sa.Float(), nullable=True))
+    if 'ix_response_score' not in response_indexes():
+        with op.batch_alter_table('response', schema=None) as batch_op:
+            batch_op.create_index(batch_op.f('ix_response_score'), ['score'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('response', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_response_score'))
+        batch_op.drop_index('ix_response_interview_question_key')
+        batch_op.drop_column('score')
+        batch_op.drop_column('question_key')
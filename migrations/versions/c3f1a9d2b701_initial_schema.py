@@ -0,0 +1,67 @@
+"""initial schema
+
+Revision ID: c3f1a9d2b701
+Revises: 
+Create Date: 2026-10-17 09:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c3f1a9d2b701'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def has_table(name):
+    return sa.inspect(op.get_bind()).has_table(name)
+
+
+def upgrade():
+    # Databases created by db.create_all() already have these tables
+    if not has_table('user'):
+        op.create_table('user',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('username', sa.String(length=100), nullable=False),
+        sa.Column('email', sa.String(length=100), nullable=False),
+        sa.Column('password_hash', sa.String(length=200), nullable=False),
+        sa.Column('created_at', sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('email'),
+        sa.UniqueConstraint('username')
+        )
+
+    if not has_table('interview'):
+        op.create_table('interview',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('user_id', sa.Integer(), nullable=False),
+        sa.Column('job_title', sa.String(length=100), nullable=False),
+        sa.Column('experience_level', sa.String(length=50), nullable=False),
+        sa.Column('experience_years', sa.Integer(), nullable=True),
+        sa.Column('overall_score', sa.Integer(), nullable=True),
+        sa.Column('created_at', sa.DateTime(), nullable=True),
+        sa.ForeignKeyConstraint(['user_id'], ['user.id'], ),
+        sa.PrimaryKeyConstraint('id')
+        )
+
+    if not has_table('response'):
+        op.create_table('response',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('interview_id', sa.Integer(), nullable=False),
+        sa.Column('question', sa.Text(), nullable=False),
+        sa.Column('question_type', sa.String(length=50), nullable=False),
+        sa.Column('transcript', sa.Text(), nullable=True),
+        sa.Column('analysis', sa.Text(), nullable=True),
+        sa.Column('created_at', sa.DateTime(), nullable=True),
+        sa.ForeignKeyConstraint(['interview_id'], ['interview.id'], ),
+        sa.PrimaryKeyConstraint('id')
+        )
+
+
+def downgrade():
+    op.drop_table('response')
+    op.drop_table('interview')
+    op.drop_table('user')
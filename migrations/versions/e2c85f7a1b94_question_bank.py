@@ -0,0 +1,74 @@
+"""question bank with full-text index
+
+Revision ID: e2c85f7a1b94
+Revises: 7b3e91c05d6a
+Create Date: 2026-10-17 09:50:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e2c85f7a1b94'
+down_revision = '7b3e91c05d6a'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('question',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('question', sa.Text(), nullable=False),
+    sa.Column('question_hash', sa.String(length=64), nullable=False),
+    sa.Column('question_type', sa.String(length=50), nullable=False),
+    sa.Column('role', sa.String(length=100), nullable=False),
+    sa.Column('level', sa.String(length=50), nullable=False),
+    sa.Column('difficulty', sa.String(length=20), nullable=True),
+    sa.Column('language', sa.String(length=50), nullable=True),
+    sa.Column('source', sa.String(length=20), nullable=False),
+    sa.Column('created_at', sa.DateTime(), nullable=True),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('question_hash')
+    )
+    with op.batch_alter_table('question', schema=None) as batch_op:
+        batch_op.create_index('ix_question_level_type', ['level', 'question_type'], unique=False)
+
+    if op.get_bind().dialect.name != 'sqlite':
+        return
+
+    # External-content FTS5 index over question text and role, kept in sync by triggers
+    op.execute("""
+        CREATE VIRTUAL TABLE question_fts USING fts5(
+            question, role, content='question', content_rowid='id', tokenize='porter unicode61'
+        )
+    """)
+    op.execute("""
+        CREATE TRIGGER question_fts_insert AFTER INSERT ON question BEGIN
+            INSERT INTO question_fts(rowid, question, role) VALUES (new.id, new.question, new.role);
+        END
+    """)
+    op.execute("""
+        CREATE TRIGGER question_fts_delete AFTER DELETE ON question BEGIN
+            INSERT INTO question_fts(question_fts, rowid, question, role) VALUES ('delete', old.id, old.question, old.role);
+        END
+    """)
+    op.execute("""
+        CREATE TRIGGER question_fts_update AFTER UPDATE ON question BEGIN
+            INSERT INTO question_fts(question_fts, rowid, question, role) VALUES ('delete', old.id, old.question, old.role);
+            INSERT INTO question_fts(rowid, question, role) VALUES (new.id, new.question, new.role);
+        END
+    """)
+
+
+def downgrade():
+    if op.get_bind().dialect.name == 'sqlite':
+        op.execute("DROP TRIGGER IF EXISTS question_fts_update")
+        op.execute("DROP TRIGGER IF EXISTS question_fts_delete")
+        op.execute("DROP TRIGGER IF EXISTS question_fts_insert")
+        op.execute("DROP TABLE IF EXISTS question_fts")
+
+    with op.batch_alter_table('question', schema=None) as batch_op:
+        batch_op.drop_index('ix_question_level_type')
+
+    op.drop_table('question')
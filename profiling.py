@@ -0,0 +1,272 @@
+"""Opt-in request profiling, saved in formats that flame graph tools read"""
+import os
+import re
+import sys
+import json
+import time
+import uuid
+import glob
+import random
+import logging
+import cProfile
+import threading
+from collections import Counter
+
+logger = logging.getLogger(__name__)
+
+# Profiling settings (override through environment variables)
+# Fraction of requests profiled at random; 0 leaves sampling off
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "0"))
+# Secret that enables profiling per request (X-Profile: <token>) and guards the admin endpoints
+PROFILING_TOKEN = os.getenv("PROFILING_TOKEN")
+# sample: wall-clock stack sampling, saved as folded stacks (flamegraph.pl, speedscope)
+# cprofile: deterministic cProfile, saved as pstats (snakeviz, flameprof); slows the request down more
+PROFILE_MODE = os.getenv("PROFILE_MODE", "sample")
+PROFILE_INTERVAL_MS = float(os.getenv("PROFILE_INTERVAL_MS", "5"))
+# Profiles of requests faster than this are discarded
+PROFILE_MIN_MS = float(os.getenv("PROFILE_MIN_MS", "0"))
+PROFILE_KEEP = int(os.getenv("PROFILE_KEEP", "200"))
+PROFILE_DIR = os.getenv("PROFILE_DIR")
+
+# Never profiled: the profile listing itself and metric scrapes
+UNPROFILED_PREFIXES = ('/admin/profiles', '/metrics')
+PROFILE_ID_PATTERN = re.compile(r'^[\w-]+$')
+# Deepest stack recorded by the sampler
+MAX_STACK_DEPTH = 200
+
+
+def _frame_name(code):
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+class StackSampler:
+    """One background thread that periodically records the stacks of the threads being profiled"""
+
+    def __init__(self, interval=PROFILE_INTERVAL_MS / 1000):
+        self.interval = interval
+        self._threads = {}
+        self._lock = threading.Lock()
+        self._active = threading.Event()
+        self._thread = None
+
+    def start(self, thread_id):
+        with self._lock:
+            self._threads[thread_id] = Counter()
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="profile-sampler", daemon=True)
+                self._thread.start()
+        self._active.set()
+
+    def stop(self, thread_id):
+        """Stop sampling thread_id and return its {stack: samples} counts"""
+        with self._lock:
+            stacks = self._threads.pop(thread_id, Counter())
+            if not self._threads:
+                self._active.clear()
+        return stacks
+
+    def _run(self):
+        while True:
+            # Sleeps without waking up while nothing is being profiled
+            self._active.wait()
+            time.sleep(self.interval)
+            frames = sys._current_frames()
+            with self._lock:
+                for thread_id, stacks in self._threads.items():
+                    frame = frames.get(thread_id)
+                    if frame is not None:
+                        stacks[self._stack(frame)] += 1
+
+    @staticmethod
+    def _stack(frame):
+        names = []
+        while frame is not None and len(names) < MAX_STACK_DEPTH:
+            names.append(_frame_name(frame.f_code))
+            frame = frame.f_back
+        return ';'.join(reversed(names))
+
+
+class ProfileStore:
+    """Profiles on disk: the profile data next to a JSON summary of the request"""
+
+    def __init__(self, directory, keep=PROFILE_KEEP):
+        self.directory = directory
+        self.keep = keep
+
+    def save(self, summary, write_data, extension):
+        # Profiles show code paths and request paths, so only this user may read them
+        os.makedirs(self.directory, mode=0o700, exist_ok=True)
+        profile_id = f"{int(time.time() * 1000)}-{summary['service']}-{uuid.uuid4().hex[:8]}"
+        summary = dict(summary, id=profile_id, file=f"{profile_id}.{extension}")
+        write_data(os.path.join(self.directory, summary["file"]))
+        with open(os.path.join(self.directory, f"{profile_id}.json"), 'w') as summary_file:
+            json.dump(summary, summary_file)
+        self._prune()
+        return summary
+
+    def list(self, limit=50, slowest=False):
+        summaries = []
+        for path in glob.glob(os.path.join(self.directory, "*.json")):
+            try:
+                with open(path) as summary_file:
+                    summaries.append(json.load(summary_file))
+            except (OSError, ValueError):
+                continue
+        summaries.sort(key=lambda summary: summary["duration_ms" if slowest else "created_at"], reverse=True)
+        return summaries[:limit]
+
+    def path(self, profile_id):
+        """Path of a profile's data, or None for an unknown id"""
+        if not PROFILE_ID_PATTERN.match(profile_id):
+            return None
+        matches = [path for path in glob.glob(os.path.join(self.directory, f"{profile_id}.*"))
+                   if not path.endswith('.json')]
+        return matches[0] if matches else None
+
+    def _prune(self):
+        summaries = sorted(glob.glob(os.path.join(self.directory, "*.json")), key=os.path.getmtime)
+        for path in summaries[:max(0, len(summaries) - self.keep)]:
+            for profile_path in glob.glob(path[:-len('.json')] + '.*'):
+                try:
+                    os.unlink(profile_path)
+                except OSError:
+                    pass
+
+
+def _folded_writer(stacks):
+    """Writer of folded stacks, one "frame;frame;frame count" line per distinct stack"""
+    def write(path):
+        with open(path, 'w') as folded_file:
+            for stack, count in stacks.most_common():
+                folded_file.write(f"{stack} {count}\n")
+    return write
+
+
+class _ProfiledResponse:
+    """Response body that finishes the profile once the server has sent it"""
+
+    def __init__(self, body, finish):
+        self._body = body
+        self._finish = finish
+
+    def __iter__(self):
+        return iter(self._body)
+
+    def close(self):
+        try:
+            if hasattr(self._body, 'close'):
+                self._body.close()
+        finally:
+            self._finish()
+
+
+class ProfilingMiddleware:
+    """WSGI middleware profiling the requests that ask for it (or are sampled) from start to last byte.
+
+    Requests that are not profiled cost one header lookup and, with sampling on, one random number."""
+
+    def __init__(self, wsgi_app, service, store, sampler=None):
+        self.wsgi_app = wsgi_app
+        self.service = service
+        self.store = store
+        self.sampler = sampler or StackSampler()
+
+    def _trigger(self, environ):
+        if environ.get('PATH_INFO', '').startswith(UNPROFILED_PREFIXES):
+            return None
+        if PROFILING_TOKEN and environ.get('HTTP_X_PROFILE') == PROFILING_TOKEN:
+            return 'header'
+        if PROFILE_SAMPLE_RATE and random.random() < PROFILE_SAMPLE_RATE:
+            return 'sampled'
+        return None
+
+    def __call__(self, environ, start_response):
+        trigger = self._trigger(environ)
+        if trigger is None:
+            return self.wsgi_app(environ, start_response)
+
+        thread_id = threading.get_ident()
+        mode = PROFILE_MODE
+        profiler = None
+        if mode == 'cprofile':
+            profiler = cProfile.Profile()
+            try:
+                profiler.enable()
+            except ValueError:
+                # Python 3.12+ allows one cProfile at a time; sample this request instead
+                profiler, mode = None, 'sample'
+        if mode != 'cprofile':
+            self.sampler.start(thread_id)
+
+        started = time.perf_counter()
+        status = []
+
+        def capture_status(code, headers, *args):
+            status.append(code)
+            return start_response(code, headers, *args)
+
+        def finish():
+            duration_ms = (time.perf_counter() - started) * 1000
+            if profiler is not None:
+                profiler.disable()
+            stacks = self.sampler.stop(thread_id) if profiler is None else None
+            if duration_ms < PROFILE_MIN_MS:
+                return
+            summary = {
+                "service": self.service,
+                "method": environ.get('REQUEST_METHOD'),
+                "path": environ.get('PATH_INFO'),
+                "status": int(status[0].split()[0]) if status else None,
+                "duration_ms": round(duration_ms, 1),
+                "mode": mode,
+                "trigger": trigger,
+                "created_at": time.time(),
+            }
+            try:
+                if profiler is not None:
+                    self.store.save(summary, profiler.dump_stats, 'prof')
+                else:
+                    summary["samples"] = sum(stacks.values())
+                    self.store.save(summary, _folded_writer(stacks), 'folded')
+            except OSError:
+                logger.exception("Could not save profile")
+
+        try:
+            body = self.wsgi_app(environ, capture_status)
+        except BaseException:
+            finish()
+            raise
+        return _ProfiledResponse(body, finish)
+
+
+def instrument(app, service):
+    """Profile app's requests on demand and list the profiles on /admin/profiles"""
+    from flask import abort, jsonify, request, send_file
+
+    store = ProfileStore(PROFILE_DIR or os.path.join(app.instance_path, 'profiles'))
+    app.wsgi_app = ProfilingMiddleware(app.wsgi_app, service, store)
+
+    def require_token():
+        # Without a token the admin endpoints do not exist
+        if not PROFILING_TOKEN:
+            abort(404)
+        if request.headers.get('Authorization') != f"Bearer {PROFILING_TOKEN}":
+            abort(401)
+
+    @app.route('/admin/profiles')
+    def list_profiles():
+        """Recent profiles, newest first (or slowest first with ?sort=slowest)"""
+        require_token()
+        limit = min(request.args.get('limit', 50, type=int), PROFILE_KEEP)
+        return jsonify({"profiles": store.list(limit, slowest=request.args.get('sort') == 'slowest')})
+
+    @app.route('/admin/profiles/<profile_id>')
+    def download_profile(profile_id):
+        """The profile data: folded stacks or a pstats file"""
+        require_token()
+        path = store.path(profile_id)
+        if path is None:
+            abort(404)
+        return send_file(path, as_attachment=True, download_name=os.path.basename(path))
+
+    return app
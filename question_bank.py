@@ -0,0 +1,186 @@
+"""Persistent bank of generated questions, searchable through an FTS5 index"""
+import re
+import hashlib
+from itertools import zip_longest
+
+from sqlalchemy import func, text
+from sqlalchemy.dialects import postgresql, sqlite
+
+from analysis_cache import normalize_text
+import similarity_index
+
+WORD_PATTERN = re.compile(r'\w+')
+
+# Candidates fetched per requested question, so repeated setups do not all get the same set
+CANDIDATES_PER_QUESTION = 5
+# Rows read per query when bringing the similarity index up to date
+INDEX_SYNC_BATCH = 5000
+
+
+def make_question_hash(question, question_type):
+    """Hash of the normalized question text and type, used to store each question once"""
+    return hashlib.sha256(f"{question_type}\x1f{normalize_text(question)}".encode('utf-8')).hexdigest()
+
+
+def fts_query(text_value):
+    """Build an FTS5 query that matches every word of text_value, in any order"""
+    return ' '.join(f'"{word}"' for word in WORD_PATTERN.findall(text_value.lower()))
+
+
+class QuestionBank:
+    """Stores every generated question and assembles new sets from them by role and category.
+
+    With a similarity index attached, near-duplicates of stored questions are not
+    added and similar() ranks the whole bank by vector similarity."""
+
+    def __init__(self, db, model, index=None):
+        self.db = db
+        self.model = model
+        self.index = index
+
+    @property
+    def has_fts(self):
+        # The question_fts index only exists on SQLite (see migrations)
+        return self.db.engine.dialect.name == 'sqlite'
+
+    def add(self, questions, role, level, source, difficulty=None):
+        """Store generated questions, skipping ones already in the bank; the caller commits"""
+        rows = []
+        for item in questions or []:
+            question = (item.get('question') or '').strip()
+            if not question:
+                continue
+            question_type = item.get('type', 'general')
+            rows.append({
+                "question": question,
+                "question_hash": make_question_hash(question, question_type),
+                "question_type": question_type,
+                "role": normalize_text(role),
+                "level": normalize_text(level),
+                "difficulty": normalize_text(item.get('difficulty') or difficulty) or None,
+                "language": item.get('language'),
+                "source": source
+            })
+        rows = self._drop_near_duplicates(rows)
+        if not rows:
+            return 0
+
+        dialect = self.db.engine.dialect.name
+        if dialect in ('sqlite', 'postgresql'):
+            insert = sqlite.insert if dialect == 'sqlite' else postgresql.insert
+            result = self.db.session.execute(
+                insert(self.model.__table__).values(rows).on_conflict_do_nothing(index_elements=['question_hash'])
+            )
+            return result.rowcount
+
+        known = {row.question_hash for row in self.db.session.query(self.model.question_hash).filter(
+            self.model.question_hash.in_([row["question_hash"] for row in rows]))}
+        new_rows = [row for row in rows if row["question_hash"] not in known]
+        self.db.session.bulk_insert_mappings(self.model, new_rows)
+        return len(new_rows)
+
+    def assemble(self, role, level, question_types, num_questions, difficulty=None, languages=None, answered=None):
+        """Pick num_questions distinct questions for the role, spread evenly over question_types
+        and skipping near-duplicates of the answered question texts.
+
+        Returns fewer than num_questions when the bank does not hold enough matches."""
+        question_types = list(question_types) or [None]
+        per_type = -(-num_questions // len(question_types))
+
+        candidates = {}
+        for question_type in question_types:
+            candidates[question_type] = self.candidates(
+                role, level, question_type, per_type * CANDIDATES_PER_QUESTION, difficulty, languages)
+
+        return self.select(candidates, num_questions, answered)
+
+    def candidates(self, role, level, question_type=None, limit=50, difficulty=None, languages=None):
+        """Return matching bank rows in random order"""
+        model = self.model
+        query = model.query.filter(model.level == normalize_text(level))
+        if question_type:
+            query = query.filter(model.question_type == question_type)
+        if difficulty:
+            query = query.filter(model.difficulty == normalize_text(difficulty))
+        if question_type == 'coding' and languages:
+            query = query.filter(func.lower(model.language).in_([language.lower() for language in languages]))
+
+        role_query = fts_query(role or '')
+        if role_query and self.has_fts:
+            # Every word of the requested role must appear in the stored role
+            matching_ids = text("SELECT rowid FROM question_fts WHERE question_fts MATCH :match")
+            query = query.filter(model.id.in_(matching_ids.bindparams(match=f"role : ({role_query})")))
+        elif role_query:
+            for word in WORD_PATTERN.findall(role.lower()):
+                query = query.filter(model.role.like(f"%{word}%"))
+
+        return query.order_by(func.random()).limit(limit).all()
+
+    def select(self, candidates, num_questions, answered=None):
+        """Take questions from each type in turn until num_questions are chosen,
+        skipping any too similar to one already chosen or answered"""
+        ordered = [row for row_group in zip_longest(*candidates.values()) for row in row_group if row is not None]
+        vectors = similarity_index.vectorize([row.question for row in ordered])
+        avoid = similarity_index.vectorize(answered) if answered else None
+
+        chosen = similarity_index.pick_diverse(vectors, num_questions, avoid)
+        return [ordered[index].to_dict() for index in chosen]
+
+    def search(self, query_text, limit=20):
+        """Full-text search over question text and role, best matches first"""
+        match = fts_query(query_text)
+        if not match:
+            return []
+        if not self.has_fts:
+            model = self.model
+            query = model.query
+            for word in WORD_PATTERN.findall(query_text.lower()):
+                query = query.filter(func.lower(model.question).like(f"%{word}%"))
+            return [row.to_dict() for row in query.limit(limit)]
+
+        ids = [row[0] for row in self.db.session.execute(text(
+            "SELECT rowid FROM question_fts WHERE question_fts MATCH :match ORDER BY bm25(question_fts) LIMIT :limit"
+        ), {"match": match, "limit": limit})]
+        rows = {row.id: row for row in self.model.query.filter(self.model.id.in_(ids))}
+        return [rows[row_id].to_dict() for row_id in ids if row_id in rows]
+
+    def similar(self, query_text, limit=20):
+        """Stored questions closest in meaning to query_text, with cosine similarity"""
+        if self.index is None:
+            return []
+        self.sync_index()
+
+        matches = self.index.nearest(similarity_index.vectorize([query_text]), limit)[0]
+        rows = {row.id: row for row in self.model.query.filter(self.model.id.in_([match[0] for match in matches]))}
+        return [
+            dict(rows[question_id].to_dict(), similarity=round(score, 4))
+            for question_id, score in matches if question_id in rows
+        ]
+
+    def sync_index(self):
+        """Append questions stored since the last sync to the similarity index"""
+        if self.index is None:
+            return 0
+
+        appended = 0
+        while True:
+            batch = self.db.session.query(self.model.id, self.model.question).filter(
+                self.model.id > self.index.last_id
+            ).order_by(self.model.id).limit(INDEX_SYNC_BATCH).all()
+            if not batch:
+                return appended
+            appended += self.index.append([row.id for row in batch], [row.question for row in batch])
+
+    def _drop_near_duplicates(self, rows):
+        """Remove rows that repeat each other or a question already in the index"""
+        vectors = similarity_index.vectorize([row["question"] for row in rows])
+        keep = similarity_index.pick_diverse(vectors, len(rows))
+
+        if self.index is not None:
+            self.sync_index()
+            nearest = self.index.nearest(vectors[keep], k=1)
+            keep = [
+                index for index, matches in zip(keep, nearest)
+                if not matches or matches[0][1] < similarity_index.DUPLICATE_THRESHOLD
+            ]
+        return [rows[index] for index in keep]
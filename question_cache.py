@@ -0,0 +1,141 @@
+"""Rotating pools of generated question sets, refilled in the background"""
+import os
+import json
+import hashlib
+import logging
+import threading
+
+import llm_client
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# Pool settings (override through environment variables)
+POOL_SIZE = int(os.getenv("QUESTION_POOL_SIZE", "4"))
+POOL_LOW_WATER = int(os.getenv("QUESTION_POOL_LOW_WATER", "2"))
+MAX_SERVES = int(os.getenv("QUESTION_SET_MAX_SERVES", "5"))
+
+
+def normalize_params(params):
+    """Lowercase strings and sort lists so equivalent requests share a key"""
+    normalized = {}
+    for name, value in params.items():
+        if isinstance(value, str):
+            value = ' '.join(value.lower().split())
+        elif isinstance(value, (list, tuple)):
+            value = sorted(' '.join(str(item).lower().split()) for item in value)
+        normalized[name] = value
+    return normalized
+
+
+def make_key(kind, params):
+    """Hash the kind and normalized params into a pool key"""
+    canonical = json.dumps([kind, normalize_params(params)], sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+
+class QuestionSetCache:
+    """Serves each stored set up to MAX_SERVES times, least served first"""
+
+    def __init__(self, app, db, model, pool_size=POOL_SIZE, low_water=POOL_LOW_WATER, max_serves=MAX_SERVES):
+        self.app = app
+        self.db = db
+        self.model = model
+        self.pool_size = pool_size
+        self.low_water = low_water
+        self.max_serves = max_serves
+        self.generators = {}
+        self._refilling = set()
+        self._lock = threading.Lock()
+
+    def register(self, kind, generator):
+        """Register the function that generates sets of the given kind from its params"""
+        self.generators[kind] = generator
+
+    def take(self, kind, params):
+        """Return a pooled question set for these params, or None on a miss"""
+        key = make_key(kind, params)
+        model = self.model
+        questions = None
+
+        for _ in range(3):
+            row = model.query.filter(
+                model.cache_key == key,
+                model.serve_count < self.max_serves
+            ).order_by(model.serve_count, model.id).first()
+            if row is None:
+                break
+
+            # Conditional update so concurrent requests do not overserve a set
+            served = model.query.filter_by(id=row.id, serve_count=row.serve_count).update(
+                {'serve_count': model.serve_count + 1}, synchronize_session=False)
+            self.db.session.commit()
+            if served:
+                questions = json.loads(row.questions)
+                break
+
+        self._schedule_refill(kind, params, key)
+        return questions
+
+    def add(self, kind, params, questions, serve_count=0):
+        """Add a generated set to the pool for these params"""
+        self.db.session.add(self.model(
+            kind=kind,
+            cache_key=make_key(kind, params),
+            params=json.dumps(params),
+            questions=json.dumps(questions),
+            serve_count=serve_count
+        ))
+        self.db.session.commit()
+
+    def warm(self):
+        """Top up the pool of every parameter combination seen before"""
+        model = self.model
+        seen = {}
+        for kind, key, params in self.db.session.query(model.kind, model.cache_key, model.params).distinct():
+            seen.setdefault(key, (kind, json.loads(params)))
+        for key, (kind, params) in seen.items():
+            self._refill(kind, params, key)
+        return len(seen)
+
+    def _live_sets(self, key):
+        return self.model.query.filter(
+            self.model.cache_key == key,
+            self.model.serve_count < self.max_serves
+        ).count()
+
+    def _schedule_refill(self, kind, params, key):
+        if kind not in self.generators or self._live_sets(key) >= self.low_water:
+            return
+
+        with self._lock:
+            if key in self._refilling:
+                return
+            self._refilling.add(key)
+
+        thread = threading.Thread(target=self._refill_in_background, args=(kind, params, key), daemon=True)
+        thread.start()
+
+    def _refill_in_background(self, kind, params, key):
+        try:
+            # Prefetching is never more urgent than a user waiting on the model
+            with self.app.app_context(), llm_client.caller(None, llm_client.PRIORITY_LOW), \
+                    metrics.call_site(f"question_pool:{kind}"):
+                self._refill(kind, params, key)
+        except Exception:
+            logger.exception("Error refilling question pool", extra={"kind": kind})
+        finally:
+            with self._lock:
+                self._refilling.discard(key)
+
+    def _refill(self, kind, params, key):
+        model = self.model
+        # Retire sets that have been served enough times
+        model.query.filter(model.cache_key == key, model.serve_count >= self.max_serves).delete(synchronize_session=False)
+        self.db.session.commit()
+
+        for _ in range(self.pool_size - self._live_sets(key)):
+            questions = self.generators[kind](**params)
+            if not questions:
+                break
+            self.add(kind, params, questions)
@@ -0,0 +1,46 @@
+"""Numeric scores for analyzed responses, on a 0-10 scale"""
+import re
+
+SCORE_SCALE = 10
+
+# "7", "7.5", "7/10", "7 / 10", "Score: 7/10"
+SCORE_PATTERN = re.compile(r'(-?\d+(?:\.\d+)?)\s*(?:/\s*(\d+(?:\.\d+)?))?')
+
+
+def parse_score(value):
+    """Convert a score value from the model to a 0-10 float, or None"""
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, (int, float)):
+        score = float(value)
+    elif isinstance(value, str):
+        match = SCORE_PATTERN.search(value)
+        if not match:
+            return None
+        score = float(match.group(1))
+        if match.group(2):
+            out_of = float(match.group(2))
+            if out_of <= 0:
+                return None
+            score = score * SCORE_SCALE / out_of
+    else:
+        return None
+
+    return min(max(score, 0.0), float(SCORE_SCALE))
+
+
+def score_analysis(analysis):
+    """Score an analysis dict, or None when the model gave no usable score.
+
+    Unscored responses (text fallbacks, missing or unreadable scores) are left
+    out of interview averages and rollups rather than counted as a guess."""
+    if not isinstance(analysis, dict) or 'score' not in analysis:
+        return None
+    return parse_score(analysis['score'])
+
+
+def to_percentage(score):
+    """Convert an average 0-10 score to the whole percentage shown to users"""
+    if score is None:
+        return None
+    return int(round(score * 100 / SCORE_SCALE))
@@ -0,0 +1,231 @@
+"""Hashing-vector similarity index over question text, stored as memory-mapped NumPy arrays"""
+import os
+import re
+import json
+import math
+import zlib
+import threading
+
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:  # Windows: fall back to the in-process lock only
+    fcntl = None
+
+# Index settings (override through environment variables)
+SIMILARITY_DIM = int(os.getenv("SIMILARITY_DIM", "256"))
+DUPLICATE_THRESHOLD = float(os.getenv("SIMILARITY_DUPLICATE_THRESHOLD", "0.8"))
+# Rows scored per matrix product when scanning the whole index
+SCAN_CHUNK_ROWS = 65536
+INITIAL_CAPACITY = 1024
+
+WORD_PATTERN = re.compile(r'[a-z0-9]+')
+STOPWORDS = frozenset("""
+a an and are as at be but by can could did do does for from had has have how i if in into is it its
+me my of on or our so that the their them then there these this to was we were what when where which
+who why will with would you your
+""".split())
+
+
+def features(text):
+    """Content words and adjacent word pairs of a question"""
+    words = [word for word in WORD_PATTERN.findall((text or '').lower()) if word not in STOPWORDS]
+    return words + [f"{first} {second}" for first, second in zip(words, words[1:])]
+
+
+def vectorize(texts, dim=SIMILARITY_DIM):
+    """Signed feature hashing with sublinear term frequency, L2-normalized rows (float32)"""
+    matrix = np.zeros((len(texts), dim), dtype=np.float32)
+    for row, text in enumerate(texts):
+        counts = {}
+        for feature in features(text):
+            counts[feature] = counts.get(feature, 0) + 1
+        for feature, count in counts.items():
+            hashed = zlib.crc32(feature.encode('utf-8'))
+            sign = 1.0 if hashed & 0x80000000 else -1.0
+            matrix[row, hashed % dim] += sign * (1.0 + math.log(count))
+
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+def pick_diverse(vectors, k, avoid=None, threshold=DUPLICATE_THRESHOLD):
+    """Walk the rows in order and keep up to k whose cosine similarity to every
+    kept row, and to every row of avoid, stays below threshold; returns row indexes"""
+    if len(vectors) == 0:
+        return []
+
+    closest = np.full(len(vectors), -1.0, dtype=np.float32)
+    if avoid is not None and len(avoid):
+        closest = (vectors @ avoid.T).max(axis=1)
+
+    pairwise = vectors @ vectors.T
+    chosen = []
+    for index in range(len(vectors)):
+        if len(chosen) >= k:
+            break
+        if closest[index] >= threshold:
+            continue
+        chosen.append(index)
+        closest = np.maximum(closest, pairwise[:, index])
+    return chosen
+
+
+class SimilarityIndex:
+    """Append-only index of question vectors keyed by question id.
+
+    vectors.f32 and ids.i64 are memory-mapped; meta.json records how many rows
+    are valid. Appends take a file lock, so several processes can share the
+    directory, and readers reopen the maps when meta.json changes."""
+
+    def __init__(self, directory, dim=SIMILARITY_DIM):
+        self.directory = directory
+        self.dim = dim
+        self._lock = threading.Lock()
+        self._meta_mtime = None
+        self.meta = {"dim": dim, "count": 0, "capacity": 0, "last_id": 0}
+        self.vectors = None
+        self.ids = None
+
+    @property
+    def last_id(self):
+        self._refresh()
+        return self.meta["last_id"]
+
+    def __len__(self):
+        self._refresh()
+        return self.meta["count"]
+
+    def append(self, question_ids, texts):
+        """Add vectors for new questions; ids must be increasing and above last_id"""
+        if not question_ids:
+            return 0
+        vectors = vectorize(texts, self.dim)
+
+        with self._lock, self._file_lock():
+            self._refresh(force=True)
+            keep = [row for row, question_id in enumerate(question_ids) if question_id > self.meta["last_id"]]
+            if not keep:
+                return 0
+
+            count = self.meta["count"]
+            needed = count + len(keep)
+            if needed > self.meta["capacity"]:
+                self._grow(max(needed, self.meta["capacity"] * 2, INITIAL_CAPACITY))
+
+            self.vectors[count:needed] = vectors[keep]
+            self.ids[count:needed] = np.asarray(question_ids, dtype=np.int64)[keep]
+            self.vectors.flush()
+            self.ids.flush()
+
+            self.meta["count"] = needed
+            self.meta["last_id"] = int(self.ids[needed - 1])
+            self._write_meta()
+            return len(keep)
+
+    def nearest(self, query_vectors, k=10):
+        """Top-k (question_id, similarity) pairs over the whole index for each query row"""
+        self._refresh()
+        count = self.meta["count"]
+        results = [[] for _ in range(len(query_vectors))]
+        if count == 0 or len(query_vectors) == 0:
+            return results
+
+        # Keep each chunk's top k, then merge the small per-chunk results
+        chunk_scores, chunk_rows = [], []
+        for start in range(0, count, SCAN_CHUNK_ROWS):
+            block = self.vectors[start:min(start + SCAN_CHUNK_ROWS, count)]
+            scores = query_vectors @ block.T
+            keep = min(k, scores.shape[1])
+            top = np.argpartition(-scores, keep - 1, axis=1)[:, :keep]
+            chunk_scores.append(np.take_along_axis(scores, top, axis=1))
+            chunk_rows.append(top + start)
+
+        best_scores = np.concatenate(chunk_scores, axis=1)
+        best_rows = np.concatenate(chunk_rows, axis=1)
+        order = np.argsort(-best_scores, axis=1)[:, :k]
+        best_scores = np.take_along_axis(best_scores, order, axis=1)
+        best_rows = np.take_along_axis(best_rows, order, axis=1)
+        for query in range(len(query_vectors)):
+            results[query] = [
+                (int(self.ids[row]), float(score)) for row, score in zip(best_rows[query], best_scores[query])
+            ]
+        return results
+
+    def reset(self):
+        """Drop every stored vector (used before a full rebuild)"""
+        with self._lock, self._file_lock():
+            self.meta = {"dim": self.dim, "count": 0, "capacity": 0, "last_id": 0}
+            self.vectors = None
+            self.ids = None
+            for name in ("vectors.f32", "ids.i64"):
+                path = os.path.join(self.directory, name)
+                if os.path.exists(path):
+                    os.remove(path)
+            self._write_meta()
+
+    def _path(self, name):
+        return os.path.join(self.directory, name)
+
+    def _refresh(self, force=False):
+        """Reopen the memory maps if another process (or a reset) changed them"""
+        try:
+            mtime = os.stat(self._path("meta.json")).st_mtime_ns
+        except FileNotFoundError:
+            return
+        if not force and mtime == self._meta_mtime:
+            return
+
+        with open(self._path("meta.json")) as meta_file:
+            meta = json.load(meta_file)
+        if meta["dim"] != self.dim:
+            raise ValueError(f"Similarity index at {self.directory} has dim {meta['dim']}, expected {self.dim}")
+
+        if meta["capacity"] and (self.vectors is None or meta["capacity"] != self.meta["capacity"]):
+            self._open(meta["capacity"])
+        self.meta = meta
+        self._meta_mtime = mtime
+
+    def _open(self, capacity):
+        self.vectors = np.memmap(self._path("vectors.f32"), dtype=np.float32, mode='r+', shape=(capacity, self.dim))
+        self.ids = np.memmap(self._path("ids.i64"), dtype=np.int64, mode='r+', shape=(capacity,))
+
+    def _grow(self, capacity):
+        # Extending the files keeps existing rows in place; the maps are reopened at the new size
+        for name, row_bytes in (("vectors.f32", self.dim * 4), ("ids.i64", 8)):
+            with open(self._path(name), 'ab') as data_file:
+                data_file.truncate(capacity * row_bytes)
+        self._open(capacity)
+        self.meta["capacity"] = capacity
+
+    def _write_meta(self):
+        temporary = self._path("meta.json.tmp")
+        with open(temporary, 'w') as meta_file:
+            json.dump(self.meta, meta_file)
+        os.replace(temporary, self._path("meta.json"))
+        self._meta_mtime = os.stat(self._path("meta.json")).st_mtime_ns
+
+    def _file_lock(self):
+        os.makedirs(self.directory, exist_ok=True)
+        return _FileLock(self._path("index.lock"))
+
+
+class _FileLock:
+    """Exclusive advisory lock on a file, shared between processes"""
+
+    def __init__(self, path):
+        self.path = path
+        self.handle = None
+
+    def __enter__(self):
+        self.handle = open(self.path, 'a')
+        if fcntl:
+            fcntl.flock(self.handle, fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, *exc_info):
+        if fcntl:
+            fcntl.flock(self.handle, fcntl.LOCK_UN)
+        self.handle.close()
@@ -0,0 +1,170 @@
+"""Coalescing of identical concurrent calls, within a process and across processes on one host"""
+import os
+import json
+import time
+import glob
+import threading
+
+try:
+    import fcntl
+except ImportError:  # Windows: calls are only coalesced within a process
+    fcntl = None
+
+# How often a waiting process retries the lock of a call another process is making
+LOCK_POLL_SECONDS = 0.05
+# Shared results are only needed by processes already waiting; older ones are swept away
+RESULT_TTL_SECONDS = 60
+SWEEP_INTERVAL_SECONDS = 60
+
+
+class _Flight:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """Runs one call per key at a time and hands its result to every caller that
+    asked for the same key meanwhile.
+
+    Threads of one process wait on the leading thread. With a directory, the
+    leading thread of each process also takes an exclusive lock file for the
+    key; a process that had to wait for another's lock reads the result it left
+    behind instead of repeating the call. A process that waits longer than its
+    wait_timeout makes its own call without the lock. Results must be JSON serializable."""
+
+    def __init__(self, directory=None, wait_timeout=120, retry_on=()):
+        self.directory = directory if fcntl else None
+        self.wait_timeout = wait_timeout
+        # Errors particular to the leading caller (such as its rate limit); waiters retry instead of sharing them
+        self.retry_on = retry_on
+        self._flights = {}
+        self._lock = threading.Lock()
+        self._last_sweep = 0
+        self.counts = {"calls": 0, "coalesced": 0, "shared_across_processes": 0}
+        if self.directory:
+            # Results hold model output, so only this user may read them
+            os.makedirs(self.directory, mode=0o700, exist_ok=True)
+
+    def do(self, key, func, wait_timeout=None):
+        """Return func(), or the result of an identical call already in flight.
+
+        wait_timeout (by default the instance's) bounds the wait for another process's call."""
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+                self.counts["calls"] += 1
+            else:
+                self.counts["coalesced"] += 1
+
+        if not leader:
+            # The leader's own call is bounded by its timeouts
+            flight.done.wait()
+            if isinstance(flight.error, self.retry_on):
+                return self.do(key, func, wait_timeout)
+            if flight.error is not None:
+                raise flight.error
+            return flight.result
+
+        try:
+            if self.directory:
+                flight.result = self._call_across_processes(
+                    key, func, self.wait_timeout if wait_timeout is None else wait_timeout)
+            else:
+                flight.result = func()
+        except Exception as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._flights[key]
+            flight.done.set()
+        return flight.result
+
+    def stats(self):
+        with self._lock:
+            return dict(self.counts, in_flight=len(self._flights))
+
+    def _call_across_processes(self, key, func, wait_timeout):
+        lock_path = os.path.join(self.directory, f"{key}.lock")
+        result_path = os.path.join(self.directory, f"{key}.json")
+        waiting_since = time.time()
+        self._sweep()
+
+        with open(lock_path, 'a') as handle:
+            waited = self._lock_file(handle, wait_timeout)
+            if waited is None:
+                # Give up on coordinating: call without the lock, leaving the other process's alone
+                return func()
+            try:
+                if waited:
+                    shared = self._read_result(result_path, waiting_since)
+                    if shared is not None:
+                        with self._lock:
+                            self.counts["shared_across_processes"] += 1
+                        return shared["result"]
+
+                result = func()
+                self._write_result(result_path, result)
+                return result
+            finally:
+                # Processes still blocked on this file read the result; later ones start a new flight
+                self._unlink_if_same(lock_path, handle)
+                fcntl.flock(handle, fcntl.LOCK_UN)
+
+    @staticmethod
+    def _lock_file(handle, wait_timeout):
+        """Lock handle, polling up to wait_timeout; returns whether another process held it,
+        or None when it was still held at the timeout"""
+        deadline = time.monotonic() + wait_timeout
+        waited = False
+        while True:
+            try:
+                fcntl.flock(handle, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                return waited
+            except BlockingIOError:
+                if time.monotonic() > deadline:
+                    return None
+                waited = True
+                time.sleep(LOCK_POLL_SECONDS)
+
+    @staticmethod
+    def _read_result(path, since):
+        """The result another process stored after we started waiting, or None"""
+        try:
+            if os.stat(path).st_mtime < since:
+                return None
+            with open(path) as result_file:
+                return json.load(result_file)
+        except (OSError, ValueError):
+            return None
+
+    @staticmethod
+    def _write_result(path, result):
+        temporary = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(temporary, 'w') as result_file:
+            json.dump({"result": result}, result_file)
+        os.replace(temporary, path)
+
+    @staticmethod
+    def _unlink_if_same(path, handle):
+        try:
+            if os.stat(path).st_ino == os.fstat(handle.fileno()).st_ino:
+                os.unlink(path)
+        except OSError:
+            pass
+
+    def _sweep(self):
+        now = time.time()
+        if now - self._last_sweep < SWEEP_INTERVAL_SECONDS:
+            return
+        self._last_sweep = now
+        for path in glob.glob(os.path.join(self.directory, "*.json")):
+            try:
+                if now - os.stat(path).st_mtime > RESULT_TTL_SECONDS:
+                    os.unlink(path)
+            except OSError:
+                pass
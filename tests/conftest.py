@@ -0,0 +1,39 @@
+import os
+import sys
+import tempfile
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# Keep the app away from the checked-in databases and any real LLM/logging setup
+_database_dir = tempfile.mkdtemp(prefix="interviewer-tests-")
+os.environ["DATABASE_URL"] = "sqlite:///" + os.path.join(_database_dir, "test.db")
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+os.environ.setdefault("LLM_SINGLE_FLIGHT_DIR", os.path.join(_database_dir, "llm"))
+
+
+@pytest.fixture(scope="session")
+def app_module():
+    from flask_migrate import upgrade
+    import app as app_module
+
+    app_module.app.config.update(TESTING=True, WTF_CSRF_ENABLED=False)
+    with app_module.app.app_context():
+        upgrade(directory=os.path.join(ROOT, "migrations"))
+    return app_module
+
+
+@pytest.fixture
+def login(app_module):
+    """Return a function that signs up a new user and returns a test client logged in as them"""
+    def login(username):
+        client = app_module.app.test_client()
+        client.post('/signup', data={
+            'username': username, 'email': f'{username}@example.com',
+            'password': 'password', 'confirm_password': 'password'
+        })
+        client.post('/login', data={'username': username, 'password': 'password'})
+        return client
+    return login
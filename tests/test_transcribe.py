@@ -0,0 +1,47 @@
+import io
+import time
+import threading
+
+import openai
+from openai.api_requestor import APIRequestor
+from openai.openai_response import OpenAIResponse
+
+UPLOADS = 8
+
+
+def echo_request(self, method, url, params=None, headers=None, files=None, request_timeout=None, **kwargs):
+    """Stand-in for the Whisper API: the transcript is the uploaded audio itself"""
+    assert url.endswith('/audio/transcriptions')
+    # The call is bounded by its deadline, not left to the library's default timeout
+    assert request_timeout is not None
+    audio = files[0][1][1].read()
+    # Overlap the requests so they really are in flight together
+    time.sleep(0.05)
+    return OpenAIResponse({"text": audio.decode()}, {}), False, "test-key"
+
+
+def test_concurrent_uploads_get_their_own_transcripts(login, monkeypatch):
+    monkeypatch.setattr(openai, 'api_key', 'test-key')
+    monkeypatch.setattr(APIRequestor, 'request', echo_request)
+    clients = [login(f'transcriber{index}') for index in range(UPLOADS)]
+
+    start = threading.Barrier(UPLOADS)
+    results = [None] * UPLOADS
+
+    def upload(index):
+        audio = f'recording {index} '.encode() * 100
+        start.wait()
+        response = clients[index].post('/api/transcribe', data={
+            'audio': (io.BytesIO(audio), f'recording{index}.webm')
+        }, content_type='multipart/form-data')
+        results[index] = (response.status_code, response.get_json(), audio.decode())
+
+    threads = [threading.Thread(target=upload, args=(index,)) for index in range(UPLOADS)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    for status, body, expected in results:
+        assert status == 200, body
+        assert body["transcript"] == expected
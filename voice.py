@@ -1,83 +1,350 @@
 from flask import Flask, request, jsonify, make_response
 from flask_cors import CORS
 import speech_recognition as sr
+import io
 import os
-import traceback
+import logging
+import threading
+import time
+import uuid
+import wave
+from array import array
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+import log_setup
+import metrics
+import profiling
+
+log_setup.configure()
+logger = logging.getLogger(__name__)
 
 app = Flask(__name__)
+# Request latency by route, served on /metrics
+metrics.instrument(app)
+# Per-request profiles on demand (X-Profile header or PROFILE_SAMPLE_RATE), listed on /admin/profiles
+profiling.instrument(app, 'voice')
 # Enable CORS for all routes with more specific settings
 CORS(app, resources={r"/*": {"origins": "*", "methods": ["GET", "POST"], "allow_headers": "*"}})
 
-# Path to store the audio file
-AUDIO_FILE_PATH = "recorded_audio.wav"
+# Base recognition settings; every request builds its own recognizers from these
+RECOGNIZER_SETTINGS = {
+    "energy_threshold": 300,
+    "dynamic_energy_threshold": True,
+    "dynamic_energy_adjustment_damping": 0.15,
+    "dynamic_energy_ratio": 1.5,
+    "pause_threshold": 0.8,
+    "phrase_threshold": 0.3,
+    "non_speaking_duration": 0.5,
+}
+
+# The recognizer settings only shape listening, so every request sent to Google for the
+# same audio is identical. One request is sent; a second, identical one is sent when the
+# first is slow (a hedge) or fails to reach the service.
+RECOGNITION_HEDGE_SECONDS = float(os.getenv("RECOGNITION_HEDGE_SECONDS", "4"))
+RECOGNITION_MAX_ATTEMPTS = 2
+
+# Thread pool shared by all requests for recognition attempts
+RECOGNITION_WORKERS = int(os.getenv("RECOGNITION_WORKERS", "6"))
+recognition_pool = ThreadPoolExecutor(max_workers=RECOGNITION_WORKERS, thread_name_prefix="recognition")
+
+# Counters reported by the health endpoint
+stats_lock = threading.Lock()
+stats = {"queued": 0, "running": 0, "requests_in_flight": 0, "segments_queued": 0}
+
+metrics.Gauge("voice_recognitions_queued", "Recognition attempts waiting for a worker",
+              function=lambda: stats["queued"])
+metrics.Gauge("voice_recognitions_running", "Recognition attempts running",
+              function=lambda: stats["running"])
+metrics.Gauge("voice_recording_sessions", "Incremental recording sessions held in memory",
+              function=lambda: len(recording_sessions))
+
+# Incremental recording: finished segments are transcribed while the candidate keeps speaking
+SEGMENT_SECONDS = float(os.getenv("SEGMENT_SECONDS", "10"))
+# Window at the end of a segment searched for the quietest point to cut at
+SEGMENT_SEARCH_SECONDS = 1.5
+SESSION_TTL_SECONDS = int(os.getenv("RECORDING_SESSION_TTL", "900"))
+SEGMENT_WORKERS = int(os.getenv("SEGMENT_WORKERS", "4"))
+segment_pool = ThreadPoolExecutor(max_workers=SEGMENT_WORKERS, thread_name_prefix="segment")
+
+# Active recording sessions by id (kept in process memory, so use sticky routing)
+sessions_lock = threading.Lock()
+recording_sessions = {}
+
+class RecordingSession:
+    """Audio and partial transcript for one incremental recording"""
+
+    def __init__(self):
+        self.id = uuid.uuid4().hex
+        self.lock = threading.Lock()
+        self.sample_rate = None
+        self.sample_width = None
+        self.frames = bytearray()
+        self.segments = []
+        self.last_seen = time.monotonic()
+
+    def add_chunk(self, chunk_file):
+        """Append a WAV chunk and start transcribing any completed segments"""
+        with wave.open(chunk_file, 'rb') as chunk:
+            if chunk.getnchannels() != 1:
+                raise ValueError("Audio chunks must be mono")
+            params = (chunk.getframerate(), chunk.getsampwidth())
+            frames = chunk.readframes(chunk.getnframes())
+
+        with self.lock:
+            self.last_seen = time.monotonic()
+            if self.sample_rate is None:
+                self.sample_rate, self.sample_width = params
+            elif params != (self.sample_rate, self.sample_width):
+                raise ValueError("Audio chunk format changed during recording")
+
+            self.frames.extend(frames)
+            segment_bytes = int(SEGMENT_SECONDS * self.sample_rate) * self.sample_width
+            while len(self.frames) >= segment_bytes:
+                cut = self._find_cut(segment_bytes)
+                self._submit_segment(bytes(self.frames[:cut]))
+                del self.frames[:cut]
+
+    def finish(self):
+        """Transcribe the remaining audio and return (transcript, segments that could not be sent)"""
+        with self.lock:
+            if self.frames:
+                self._submit_segment(bytes(self.frames))
+                self.frames.clear()
+            segments = list(self.segments)
+
+        texts = []
+        errors = []
+        request_errors = []
+        for segment in segments:
+            try:
+                texts.append(segment.result())
+            except sr.UnknownValueError as e:
+                # Usually a segment of silence
+                errors.append(str(e))
+            except sr.RequestError as e:
+                # Keep what the other segments produced
+                request_errors.append(e)
+
+        if not texts:
+            if request_errors:
+                raise request_errors[0]
+            raise sr.UnknownValueError('; '.join(errors) or "No audio received")
+        if request_errors:
+            logger.warning("Recording transcribed with missing segments",
+                           extra={"failed_segments": len(request_errors), "segments": len(segments)})
+        return ' '.join(texts), len(request_errors)
+
+    def partial_transcript(self):
+        """Join the text of the leading segments that are already transcribed"""
+        texts = []
+        with self.lock:
+            segments = list(self.segments)
+        for segment in segments:
+            if not segment.done():
+                break
+            if segment.exception() is None:
+                texts.append(segment.result())
+        return ' '.join(texts), len(texts), len(segments)
+
+    def _find_cut(self, segment_bytes):
+        """Pick the quietest 100ms window near the segment end as the cut point"""
+        if self.sample_width != 2:
+            return segment_bytes
+
+        window = int(self.sample_rate * 0.1) * 2
+        search_start = max(segment_bytes - int(SEGMENT_SEARCH_SECONDS * self.sample_rate) * 2, 0)
+        middle = window // 2 - (window // 2) % 2
+        best_cut, best_energy = segment_bytes, None
+        for start in range(search_start, segment_bytes - window + 1, window):
+            samples = array('h', bytes(self.frames[start:start + window]))
+            energy = sum(abs(sample) for sample in samples)
+            if best_energy is None or energy <= best_energy:
+                best_cut, best_energy = start + middle, energy
+        return best_cut
+
+    def _submit_segment(self, frames):
+        audio = sr.AudioData(frames, self.sample_rate, self.sample_width)
+        update_stats(segments_queued=1)
+        self.segments.append(segment_pool.submit(transcribe_segment, audio))
+
+def transcribe_segment(audio):
+    update_stats(segments_queued=-1)
+    return recognize_audio_data(audio)
+
+def get_recording_session(session_id):
+    with sessions_lock:
+        return recording_sessions.get(session_id)
+
+def expire_recording_sessions():
+    """Drop sessions that have been idle for longer than the TTL"""
+    cutoff = time.monotonic() - SESSION_TTL_SECONDS
+    with sessions_lock:
+        for session_id in [key for key, value in recording_sessions.items() if value.last_seen < cutoff]:
+            del recording_sessions[session_id]
+
+def make_recognizer(**overrides):
+    """Create a recognizer with the base settings plus any overrides"""
+    recognizer = sr.Recognizer()
+    for name, value in {**RECOGNIZER_SETTINGS, **overrides}.items():
+        setattr(recognizer, name, value)
+    return recognizer
+
+def update_stats(**deltas):
+    with stats_lock:
+        for name, delta in deltas.items():
+            stats[name] += delta
+
+def run_attempt(attempt, audio):
+    """Send one recognition request with its own recognizer"""
+    update_stats(queued=-1, running=1)
+    try:
+        logger.debug("Attempting speech recognition", extra={"attempt": attempt})
+        text = make_recognizer().recognize_google(audio, language='en-US')
+        logger.debug("Recognition successful", extra={"attempt": attempt, "characters": len(text)})
+        return text
+    finally:
+        update_stats(running=-1)
+
+def recognize_audio(audio_buffer):
+    """Transcribe a WAV/AIFF/FLAC buffer, returning its text"""
+    with sr.AudioFile(audio_buffer) as source:
+        recognizer = make_recognizer()
+        # Adjust for ambient noise
+        recognizer.adjust_for_ambient_noise(source, duration=0.5)
+
+        # Record the entire audio file
+        audio = recognizer.record(source)
+
+    return recognize_audio_data(audio)
+
+def recognize_audio_data(audio):
+    """Recognize audio with Google, hedging a slow or failed request with a second one"""
+    metrics.transcription_audio_bytes.observe(len(audio.frame_data), service='google')
+    started = time.perf_counter()
+    pending = set()
+    errors = []
+
+    def send():
+        update_stats(queued=1)
+        pending.add(recognition_pool.submit(run_attempt, len(errors) + len(pending) + 1, audio))
+
+    send()
+    try:
+        while pending:
+            can_hedge = len(errors) + len(pending) < RECOGNITION_MAX_ATTEMPTS
+            done, _ = wait(pending, timeout=RECOGNITION_HEDGE_SECONDS if can_hedge else None,
+                           return_when=FIRST_COMPLETED)
+            if not done:
+                logger.info("Recognition is slow; sending a hedged request")
+                send()
+                continue
+            for future in done:
+                pending.discard(future)
+                try:
+                    text = future.result()
+                    metrics.transcription_duration.observe(time.perf_counter() - started, service='google')
+                    return text
+                except sr.UnknownValueError:
+                    # The service heard no words; asking again gets the same answer
+                    raise sr.UnknownValueError("Google Speech Recognition could not understand audio")
+                except sr.RequestError as e:
+                    errors.append(str(e))
+                    logger.info("Recognition request failed", extra={"error": str(e)})
+            if not pending and len(errors) < RECOGNITION_MAX_ATTEMPTS:
+                send()
+    finally:
+        # Drop attempts that have not started yet
+        for future in pending:
+            if future.cancel():
+                update_stats(queued=-1)
+
+    logger.warning("All recognition requests failed", extra={"errors": errors})
+    raise sr.RequestError(f"Could not request results from Google Speech Recognition service; {'; '.join(errors)}")
+
+# Added to every response, errors included, so browsers can read failures too
+CORS_HEADERS = {
+    'Access-Control-Allow-Origin': '*',
+    'Access-Control-Allow-Methods': 'GET, POST, OPTIONS',
+    'Access-Control-Allow-Headers': 'Content-Type'
+}
 
-# Initialize the recognizer
-recognizer = sr.Recognizer()
-# Adjust recognition settings
-recognizer.energy_threshold = 300
-recognizer.dynamic_energy_threshold = True
-recognizer.dynamic_energy_adjustment_damping = 0.15
-recognizer.dynamic_energy_ratio = 1.5
-recognizer.pause_threshold = 0.8
-recognizer.phrase_threshold = 0.3
-recognizer.non_speaking_duration = 0.5
+@app.before_request
+def expire_idle_sessions():
+    # Abandoned recordings are dropped whichever endpoint is being called
+    expire_recording_sessions()
+
+@app.after_request
+def add_cors_headers(response):
+    for key, value in CORS_HEADERS.items():
+        response.headers[key] = value
+    return response
 
 @app.route('/')
 def index():
     # Return a simple response for status check
-    response = make_response(jsonify({
+    return jsonify({
         "status": "ok",
         "message": "Voice recognition server is running"
-    }))
-    response.headers.add('Access-Control-Allow-Origin', '*')
-    return response
+    })
+
+@app.route('/health')
+def health():
+    # Report recognition load for monitoring
+    with stats_lock:
+        snapshot = dict(stats)
+    return jsonify({
+        "status": "ok",
+        "queue_depth": snapshot["queued"],
+        "recognitions_running": snapshot["running"],
+        "requests_in_flight": snapshot["requests_in_flight"],
+        "segments_queued": snapshot["segments_queued"],
+        "recording_sessions": len(recording_sessions),
+        "workers": RECOGNITION_WORKERS
+    })
 
 @app.route('/start_recording', methods=['POST', 'OPTIONS'])
 def start_recording():
-    # Add CORS headers
-    response_headers = {
-        'Access-Control-Allow-Origin': '*',
-        'Access-Control-Allow-Methods': 'POST, OPTIONS',
-        'Access-Control-Allow-Headers': 'Content-Type'
-    }
-
     # Handle preflight OPTIONS request
     if request.method == 'OPTIONS':
-        response = make_response()
-        for key, value in response_headers.items():
-            response.headers.add(key, value)
-        return response
-
-    print("Start recording request received")
-    response = jsonify(status="Recording started")
-    for key, value in response_headers.items():
-        response.headers.add(key, value)
-    return response
+        return make_response()
 
-@app.route('/stop_recording', methods=['POST'])
-def stop_recording():
-    # Add CORS headers
-    response_headers = {
-        'Access-Control-Allow-Origin': '*',
-        'Access-Control-Allow-Methods': 'POST, OPTIONS',
-        'Access-Control-Allow-Headers': 'Content-Type'
-    }
+    # Open a session that audio chunks can be streamed into
+    recording_session = RecordingSession()
+    with sessions_lock:
+        recording_sessions[recording_session.id] = recording_session
 
+    return jsonify(status="Recording started", session_id=recording_session.id)
+
+@app.route('/stop_recording', methods=['POST', 'OPTIONS'])
+def stop_recording():
     # Handle preflight OPTIONS request
     if request.method == 'OPTIONS':
-        response = make_response()
-        for key, value in response_headers.items():
-            response.headers.add(key, value)
-        return response
+        return make_response()
+
+    # Incremental mode: only the last segment still needs transcribing
+    session_id = request.form.get('session_id') or request.args.get('session_id')
+    if session_id and 'audio_data' not in request.files:
+        with sessions_lock:
+            recording_session = recording_sessions.pop(session_id, None)
+        if recording_session is None:
+            return jsonify(status="Error", error="Unknown recording session."), 404
+
+        try:
+            text, failed_segments = recording_session.finish()
+            return jsonify(status="Recording stopped", text=text, failed_segments=failed_segments)
+        except sr.UnknownValueError as e:
+            logger.info("Could not understand the audio", extra={"error": str(e)})
+            return jsonify(status="Error", error=f"Could not understand the audio. Please speak clearly and try again. Details: {str(e)}"), 400
+        except sr.RequestError as e:
+            logger.error("Speech recognition service request failed", extra={"error": str(e)})
+            return jsonify(status="Error", error=f"Could not request results from Google Speech Recognition service; {e}"), 500
 
     # Check if audio file is present
     if 'audio_data' not in request.files:
-        print("Error: No audio file received in request")
-        print("Request files:", list(request.files.keys()))
+        logger.info("No audio file received", extra={"files": list(request.files.keys())})
         return jsonify(status="Error", error="No audio file received."), 400
 
     audio_file = request.files['audio_data']
-    print(f"Received audio file: {audio_file.filename}, size: {audio_file.content_length} bytes")
 
     # Check if file is empty
     audio_file.seek(0, os.SEEK_END)
@@ -85,138 +352,68 @@ def stop_recording():
     audio_file.seek(0)  # Reset file pointer
 
     if file_size == 0:
-        print("Error: Empty audio file received")
+        logger.info("Empty audio file received")
         return jsonify(status="Error", error="Empty audio file received."), 400
 
+    update_stats(requests_in_flight=1)
     try:
-        # Make sure the directory exists
-        os.makedirs(os.path.dirname(os.path.abspath(AUDIO_FILE_PATH)), exist_ok=True)
-
-        # Save the original file
-        audio_file.save(AUDIO_FILE_PATH)
-        print(f"Audio file saved to {AUDIO_FILE_PATH}")
-
-        # Check if the file was saved correctly
-        if not os.path.exists(AUDIO_FILE_PATH) or os.path.getsize(AUDIO_FILE_PATH) == 0:
-            print(f"Error: Failed to save audio file or file is empty. Path: {AUDIO_FILE_PATH}")
-            return jsonify(status="Error", error="Failed to save audio file."), 500
-
-        # Use speech recognition with multiple attempts
-        with sr.AudioFile(AUDIO_FILE_PATH) as source:
-            print("Adjusting for ambient noise...")
-            # Adjust for ambient noise
-            recognizer.adjust_for_ambient_noise(source, duration=0.5)
-
-            print("Recording from audio file...")
-            # Record the entire audio file
-            audio = recognizer.record(source)
-
-            # Try recognition with different settings
-            text = None
-            exceptions = []
-
-            print("Attempt 1: Using default settings for speech recognition...")
-            # Attempt 1: Default settings
-            try:
-                text = recognizer.recognize_google(audio, language='en-US')
-                print(f"Recognition successful: '{text}'")
-            except sr.UnknownValueError as e:
-                error_msg = "Google Speech Recognition could not understand audio"
-                print(f"Recognition failed: {error_msg}")
-                exceptions.append(error_msg)
-            except sr.RequestError as e:
-                error_msg = f"Could not request results from Google Speech Recognition service; {e}"
-                print(f"Recognition failed: {error_msg}")
-                exceptions.append(error_msg)
-            except Exception as e:
-                error_msg = str(e)
-                print(f"Recognition failed with unexpected error: {error_msg}")
-                exceptions.append(error_msg)
-                traceback.print_exc()
-
-            # Attempt 2: Different pause threshold
-            if text is None:
-                print("Attempt 2: Using increased pause threshold...")
-                try:
-                    recognizer.pause_threshold = 1
-                    text = recognizer.recognize_google(audio, language='en-US')
-                    print(f"Recognition successful: '{text}'")
-                except Exception as e:
-                    error_msg = str(e)
-                    print(f"Recognition failed: {error_msg}")
-                    exceptions.append(error_msg)
-
-            # Attempt 3: Different energy threshold
-            if text is None:
-                print("Attempt 3: Using increased energy threshold...")
-                try:
-                    recognizer.energy_threshold = 400
-                    text = recognizer.recognize_google(audio, language='en-US')
-                    print(f"Recognition successful: '{text}'")
-                except Exception as e:
-                    error_msg = str(e)
-                    print(f"Recognition failed: {error_msg}")
-                    exceptions.append(error_msg)
-
-            if text is None:
-                error_msg = f"Speech recognition failed after multiple attempts. Errors: {'; '.join(exceptions)}"
-                print(f"All recognition attempts failed: {error_msg}")
-                raise sr.UnknownValueError(error_msg)
-
-            response = jsonify(status="Recording stopped", text=text)
-            for key, value in response_headers.items():
-                response.headers.add(key, value)
-            return response
+        # Keep this request's audio in its own in-memory buffer
+        audio_buffer = io.BytesIO(audio_file.read())
 
+        text = recognize_audio(audio_buffer)
+
+        return jsonify(status="Recording stopped", text=text)
     except sr.UnknownValueError as e:
-        print(f"UnknownValueError: {str(e)}")
-        response = jsonify(status="Error", error=f"Could not understand the audio. Please speak clearly and try again. Details: {str(e)}")
-        for key, value in response_headers.items():
-            response.headers.add(key, value)
-        return response, 400
+        logger.info("Could not understand the audio", extra={"error": str(e)})
+        return jsonify(status="Error", error=f"Could not understand the audio. Please speak clearly and try again. Details: {str(e)}"), 400
     except sr.RequestError as e:
-        print(f"RequestError: {str(e)}")
-        response = jsonify(status="Error", error=f"Could not request results from Google Speech Recognition service; {e}")
-        for key, value in response_headers.items():
-            response.headers.add(key, value)
-        return response, 500
+        logger.error("Speech recognition service request failed", extra={"error": str(e)})
+        return jsonify(status="Error", error=f"Could not request results from Google Speech Recognition service; {e}"), 500
     except Exception as e:
-        print(f"Unexpected error: {str(e)}")
-        traceback.print_exc()
-        response = jsonify(status="Error", error=f"Error processing audio: {str(e)}")
-        for key, value in response_headers.items():
-            response.headers.add(key, value)
-        return response, 500
+        logger.exception("Error processing audio")
+        return jsonify(status="Error", error=f"Error processing audio: {str(e)}"), 500
     finally:
-        # Clean up the audio file
-        if os.path.exists(AUDIO_FILE_PATH):
-            try:
-                print(f"Cleaning up temporary file: {AUDIO_FILE_PATH}")
-                os.remove(AUDIO_FILE_PATH)
-                print("File removed successfully")
-            except Exception as e:
-                print(f"Error removing temporary file: {str(e)}")
+        update_stats(requests_in_flight=-1)
+
+@app.route('/upload_chunk', methods=['POST', 'OPTIONS'])
+def upload_chunk():
+    # Handle preflight OPTIONS request
+    if request.method == 'OPTIONS':
+        return make_response()
+
+    recording_session = get_recording_session(request.form.get('session_id'))
+    if recording_session is None:
+        return jsonify(status="Error", error="Unknown recording session."), 404
+
+    if 'audio_chunk' not in request.files:
+        return jsonify(status="Error", error="No audio chunk received."), 400
+
+    try:
+        # Each chunk is a standalone mono WAV file
+        recording_session.add_chunk(io.BytesIO(request.files['audio_chunk'].read()))
+    except (wave.Error, ValueError, EOFError) as e:
+        logger.info("Invalid audio chunk", extra={"error": str(e)})
+        return jsonify(status="Error", error=f"Invalid audio chunk: {str(e)}"), 400
+
+    text, completed, total = recording_session.partial_transcript()
+    return jsonify(status="Chunk received", partial_text=text, segments_done=completed, segments_total=total)
+
+@app.route('/partial_transcript', methods=['GET'])
+def partial_transcript():
+    recording_session = get_recording_session(request.args.get('session_id'))
+    if recording_session is None:
+        return jsonify(status="Error", error="Unknown recording session."), 404
+
+    text, completed, total = recording_session.partial_transcript()
+    return jsonify(status="ok", partial_text=text, segments_done=completed, segments_total=total)
 
 @app.route('/get_text', methods=['GET', 'OPTIONS'])
 def get_text():
-    # Add CORS headers
-    response_headers = {
-        'Access-Control-Allow-Origin': '*',
-        'Access-Control-Allow-Methods': 'GET, OPTIONS',
-        'Access-Control-Allow-Headers': 'Content-Type'
-    }
-
     # Handle preflight OPTIONS request
     if request.method == 'OPTIONS':
-        response = make_response()
-        for key, value in response_headers.items():
-            response.headers.add(key, value)
-        return response
-
-    response = jsonify(status="Error", error="This endpoint is no longer supported.")
-    for key, value in response_headers.items():
-        response.headers.add(key, value)
-    return response
+        return make_response()
+
+    return jsonify(status="Error", error="This endpoint is no longer supported.")
 
 if __name__ == '__main__':
     app.run(debug=True, port=5500)
\ No newline at end of file